@@ -0,0 +1,297 @@
+import os
+import sys
+import io
+import json
+import time
+import argparse
+import builtins
+import platform
+import shutil
+import tempfile
+import tracemalloc
+import contextlib
+from datetime import datetime
+import numpy as np
+from colorama import Fore, Style
+
+from main import Holding, FinancialMarket, StockTycoon
+
+# ========== 规模配置 ==========
+# 每个规模：股票数、价格历史天数、交易记录条数、持仓数
+PROFILES = {
+    "small": [
+        {"stocks": 29, "days": 365, "trades": 10_000, "positions": 10},
+    ],
+    "medium": [
+        {"stocks": 1_000, "days": 365, "trades": 100_000, "positions": 100},
+        {"stocks": 1_000, "days": 3_650, "trades": 100_000, "positions": 100},
+    ],
+    "large": [
+        {"stocks": 100_000, "days": 365, "trades": 1_000_000, "positions": 1_000},
+    ],
+}
+JSON_SAVE_CELL_LIMIT = 5_000_000  # 价格历史超过这么多个数据点时跳过JSON存档相关操作（内存和耗时不可接受）
+
+# ========== 合成状态 ==========
+def build_state(scale, seed):
+    """按规模构造一个不读写存档的内存游戏：价格历史、交易记录和持仓都由种子决定"""
+    rng = np.random.default_rng(seed)
+    market = FinancialMarket(seed, universe={"size": scale["stocks"], "seed": seed}, history_days=scale["days"])
+    game = StockTycoon(None, background_save=False, seed=seed, market=market)
+
+    # 价格历史：对数正态随机游走
+    days = scale["days"]
+    for engine, store in ((market.stock_engine, market.stock_history), (market.bond_engine, market.bond_history)):
+        steps = rng.normal(0.0, 0.02, (days, len(engine)))
+        matrix = np.trunc(engine.base_prices * np.exp(np.cumsum(steps, axis=0)))
+        store.load_matrix(np.arange(1, days + 1), matrix, np.full(len(engine), days))
+        engine.set_prices(matrix[-1])
+    game.day = days
+    market.set_day(days)
+    game.total_assets_history = np.linspace(1e13, 1.1e13, days).tolist()
+    game.stocks_bonds_value_history = np.linspace(0.0, 1e12, days).tolist()
+
+    # 交易记录
+    n_trades = scale["trades"]
+    codes = np.array([s.code for s in market.stocks])
+    trade_days = np.sort(rng.integers(1, days + 1, n_trades)).tolist()
+    trade_codes = codes[rng.integers(0, len(codes), n_trades)].tolist()
+    trade_actions = np.array(["买入", "卖出"])[rng.integers(0, 2, n_trades)].tolist()
+    trade_amounts = rng.integers(1, 1000, n_trades).astype(float).tolist()
+    trade_prices = np.round(rng.uniform(3000.0, 16000.0, n_trades), 2).tolist()
+    game.ledger.load_columns({"day": trade_days, "type": ["股票"] * n_trades, "code": trade_codes,
+                              "action": trade_actions, "amount": trade_amounts, "price": trade_prices})
+
+    # 持仓
+    held = rng.choice(len(market.stocks), size=min(scale["positions"], len(market.stocks)), replace=False)
+    for idx in held.tolist():
+        stock = market.stocks[idx]
+        game.player["stocks"][stock.code] = Holding(float(rng.integers(1, 1000)), stock.current_price)
+    game.valuation.reload(game.player)
+    game._reset_pending_changes()
+    return game
+
+# ========== 被测操作 ==========
+@contextlib.contextmanager
+def scripted_input(*answers):
+    """把交互函数的 input() 替换为固定回答"""
+    original = builtins.input
+    replies = iter(answers)
+    builtins.input = lambda prompt="": next(replies)
+    try:
+        yield
+    finally:
+        builtins.input = original
+
+def _invalidate_prices(game):
+    """模拟一次价格变动，让估值缓存失效"""
+    game.market.stock_engine.version += 1
+    game.market.bond_engine.version += 1
+
+def _save_snapshot(game, name):
+    game.current_save = name
+    game.save_game(snapshot=True)
+    game.flush_saves()
+
+def _ensure_snapshot(game, name):
+    """确保存档快照存在并切换到该存档，之后的保存只追加日志"""
+    if game.current_save != name or not os.path.exists(os.path.join('saves', name)):
+        _save_snapshot(game, name)
+    game.current_save = name
+
+def _load(game, name):
+    game.current_save = name
+    game.load_game()
+
+def _leave_save(game):
+    game.current_save = None
+
+def _screen(game):
+    with scripted_input("20", "10", "n"):
+        game.screen_good_investments()
+
+def _screen_indicators(game):
+    with scripted_input("momentum_20>5, volatility_20<3, drawdown_60<10", "momentum_20", "20", "n"):
+        game.screen_good_investments()
+
+def _clear_charts(game):
+    """清空图表缓存，测量的是完整渲染而不是缓存命中"""
+    game.chart_cache.clear()
+
+def _chart(game):
+    game.show_horizontal_chart_for_asset(game.market.stocks[0])
+
+def _chart_long(game):
+    game.show_horizontal_chart_for_asset(game.market.stocks[0], days=game.day)
+
+def _trend(game):
+    game.show_asset_trend()
+
+def _trade_query(game):
+    code = game.market.stocks[0].code
+    game.ledger.query(code=code, start_day=game.day // 2, page=2, page_size=30)
+
+def _trade_summary(game):
+    game.ledger.aggregate(start_day=game.day // 2)
+
+# 操作名 -> (准备函数, 被测函数, 收尾函数, 是否需要JSON存档)
+OPERATIONS = {
+    "daily_update": (_leave_save, lambda g: g.advance_days(1), None, False),
+    "calculate_total_assets": (_invalidate_prices, lambda g: g.calculate_total_assets(), None, False),
+    "save_snapshot_json": (None, lambda g: _save_snapshot(g, "bench.json"), _leave_save, True),
+    "save_snapshot_npz": (None, lambda g: _save_snapshot(g, "bench.npz"), _leave_save, False),
+    "daily_update_saved": (lambda g: _ensure_snapshot(g, "bench.npz"), lambda g: (g.advance_days(1), g.flush_saves()), _leave_save, False),
+    "load_json": (lambda g: os.path.exists("saves/bench.json") or _save_snapshot(g, "bench.json"), lambda g: _load(g, "bench.json"), _leave_save, True),
+    "load_npz": (lambda g: os.path.exists("saves/bench.npz") or _save_snapshot(g, "bench.npz"), lambda g: _load(g, "bench.npz"), _leave_save, False),
+    "daily_update_sqlite": (lambda g: _ensure_snapshot(g, "bench.db"), lambda g: (g.advance_days(1), g.flush_saves()), _leave_save, False),
+    "load_sqlite": (lambda g: os.path.exists("saves/bench.db") or _save_snapshot(g, "bench.db"), lambda g: _load(g, "bench.db"), _leave_save, False),
+    "screen_good_investments": (None, _screen, None, False),
+    "screen_indicators": (None, _screen_indicators, None, False),
+    "chart_asset": (_clear_charts, _chart, None, False),
+    "chart_asset_cached": (None, _chart, None, False),
+    "chart_asset_long": (_clear_charts, _chart_long, None, False),
+    "asset_trend": (_clear_charts, _trend, None, False),
+    "trade_query": (None, _trade_query, None, False),
+    "trade_summary": (None, _trade_summary, None, False),
+}
+
+def measure(game, op, repeat):
+    """计时repeat次取中位数，再单独运行一次用tracemalloc记录峰值内存"""
+    setup, func, teardown, _ = OPERATIONS[op]
+    timings = []
+    for _ in range(repeat + 1):
+        if setup:
+            setup(game)
+        start = time.perf_counter()
+        func(game)
+        elapsed = time.perf_counter() - start
+        if teardown:
+            teardown(game)
+        timings.append(elapsed)
+    if setup:
+        setup(game)
+    tracemalloc.start()
+    func(game)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    if teardown:
+        teardown(game)
+    timings = timings[1:]  # 丢弃预热的第一次
+    return {"seconds": float(np.median(timings)), "min_seconds": min(timings), "runs": len(timings), "peak_bytes": peak}
+
+def scale_key(scale):
+    return f"stocks={scale['stocks']},days={scale['days']},trades={scale['trades']},positions={scale['positions']}"
+
+def run_suite(scales, ops, repeat, seed, shards=None):
+    """在临时目录中依次构造各规模的状态并测量各操作，返回结果字典；shards为分片进程数"""
+    results = []
+    cwd = os.getcwd()
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)  # 存档写入临时目录下的 saves/
+        try:
+            for scale in scales:
+                start = time.perf_counter()
+                with contextlib.redirect_stdout(io.StringIO()):
+                    game = build_state(scale, seed)
+                    if shards:
+                        game.market.start_sharding(shards, seed)
+                print(f"{scale_key(scale)}：构造状态 {time.perf_counter() - start:.2f} 秒", file=sys.stderr)
+                too_big = scale["stocks"] * scale["days"] > JSON_SAVE_CELL_LIMIT
+                for op in ops:
+                    entry = {"scale": scale, "key": scale_key(scale), "op": op}
+                    if OPERATIONS[op][3] and too_big:
+                        entry["skipped"] = "价格历史过大，跳过JSON存档"
+                    else:
+                        with contextlib.redirect_stdout(io.StringIO()):
+                            entry.update(measure(game, op, repeat))
+                        print(f"  {op}: {entry['seconds'] * 1000:.2f} ms, 峰值内存 {entry['peak_bytes'] / 1e6:.1f} MB", file=sys.stderr)
+                    results.append(entry)
+                game.close_sqlite()
+                game.close_archive()
+                shutil.rmtree('saves', ignore_errors=True)  # 存档、日志和价格归档目录
+                game.market.stop_sharding()
+                del game
+        finally:
+            os.chdir(cwd)
+    return {
+        "meta": {
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "seed": seed,
+            "repeat": repeat,
+            "shards": shards,
+        },
+        "results": results,
+    }
+
+# ========== 结果对比 ==========
+def compare_results(baseline, current, threshold):
+    """按 (规模, 操作) 对比两次结果，返回耗时超过 (1+threshold) 倍的回归项数"""
+    old = {(r["key"], r["op"]): r for r in baseline["results"] if "seconds" in r}
+    regressions = 0
+    print("规模 | 操作 | 基线(ms) | 当前(ms) | 比值 | 峰值内存变化(MB)")
+    print("-" * 100)
+    for entry in current["results"]:
+        before = old.get((entry["key"], entry["op"]))
+        if before is None or "seconds" not in entry:
+            continue
+        ratio = entry["seconds"] / before["seconds"] if before["seconds"] > 0 else float("inf")
+        memory = (entry["peak_bytes"] - before["peak_bytes"]) / 1e6
+        color = Style.RESET_ALL
+        if ratio > 1.0 + threshold:
+            color = Fore.RED
+            regressions += 1
+        elif ratio < 1.0 - threshold:
+            color = Fore.GREEN
+        print(f"{entry['key']} | {entry['op']} | {before['seconds'] * 1000:.2f} | {entry['seconds'] * 1000:.2f} | "
+              f"{color}{ratio:.2f}x{Style.RESET_ALL} | {memory:+.1f}")
+    print(f"\n共 {regressions} 项回归（阈值 {threshold * 100:.0f}%）")
+    return regressions
+
+def main_cli(argv=None):
+    parser = argparse.ArgumentParser(description="Rainbow 核心引擎性能基准测试")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="small", help="预设规模")
+    parser.add_argument("--stocks", type=int, help="自定义规模：股票数（与以下参数一起覆盖 --profile）")
+    parser.add_argument("--days", type=int, default=365, help="自定义规模：价格历史天数")
+    parser.add_argument("--trades", type=int, default=10_000, help="自定义规模：交易记录条数")
+    parser.add_argument("--positions", type=int, default=10, help="自定义规模：持仓数")
+    parser.add_argument("--ops", default=",".join(OPERATIONS), help="要测量的操作（逗号分隔）")
+    parser.add_argument("--repeat", type=int, default=5, help="每个操作计时次数")
+    parser.add_argument("--seed", type=int, default=20250101)
+    parser.add_argument("--shards", type=int, help="用多个进程分片推进股票价格")
+    parser.add_argument("--output", default="benchmark_results.json", help="结果文件")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"), help="对比两个结果文件，不运行测试")
+    parser.add_argument("--baseline", help="运行后与该结果文件对比")
+    parser.add_argument("--threshold", type=float, default=0.2, help="判定回归的耗时增幅")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        with open(args.compare[0], 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        with open(args.compare[1], 'r', encoding='utf-8') as f:
+            current = json.load(f)
+        return 1 if compare_results(baseline, current, args.threshold) else 0
+
+    ops = [op.strip() for op in args.ops.split(",") if op.strip()]
+    unknown = [op for op in ops if op not in OPERATIONS]
+    if unknown:
+        parser.error(f"未知的操作：{', '.join(unknown)}")
+    if args.stocks:
+        scales = [{"stocks": args.stocks, "days": args.days, "trades": args.trades, "positions": args.positions}]
+    else:
+        scales = PROFILES[args.profile]
+
+    results = run_suite(scales, ops, args.repeat, args.seed, args.shards)
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.output}")
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        return 1 if compare_results(baseline, results, args.threshold) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main_cli())
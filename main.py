@@ -1,26 +1,539 @@
+import sys
 import random
 import time
+import heapq
+import bisect
 import json
+import csv
+import re
+import sqlite3
 import shutil
 import os
+import atexit
+import argparse
+import asyncio
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+import contextlib
+import io
+import zlib
 from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 from colorama import Fore, Style
 
+# ========== 价格引擎 ==========
+def step_prices(prices, shocks, volatility, scale, floors, clamp=None):
+    """向量化的单日价格演化：波动限制、整数截断、价格保护（支持任意前导维度广播）"""
+    change = shocks * volatility * scale
+    if clamp is not None:
+        # 限制波动幅度在±clamp之间
+        np.clip(change, -clamp, clamp, out=change)
+    # 保持价格为整数元，但存储为浮点以便计算
+    new_prices = np.trunc(prices * (1.0 + change))
+    return np.maximum(new_prices, floors, out=new_prices)
+
+class PriceEngine:
+    """以连续数组保存一组资产的当前价格、基础价格和波动性，资产对象只是其中一行的视图"""
+    def __init__(self, assets, base_prices, volatility, floor_ratio=0.0, floor_min=0.0, clamp=None, seed=None):
+        self.assets = assets
+        self.prices = np.array([a.current_price for a in assets], dtype=np.float64)
+        self.base_prices = np.asarray(base_prices, dtype=np.float64).copy()
+        self.volatility = np.asarray(volatility, dtype=np.float64).copy()
+        self.floor_ratio = floor_ratio  # 价格保护：不低于基础价格的比例
+        self.floor_min = floor_min      # 价格保护：绝对下限
+        self.clamp = clamp
+        self.rng = np.random.default_rng(seed)
+        self.version = 0  # 价格每变动一次加一，供估值等缓存判断是否过期
+        for idx, asset in enumerate(assets):
+            asset._engine = self
+            asset._index = idx
+
+    def __len__(self):
+        return len(self.prices)
+
+    def floors(self):
+        """每个资产的价格下限"""
+        return np.maximum(self.base_prices * self.floor_ratio, self.floor_min)
+
+    def draw_shocks(self, days=None):
+        """批量抽取标准正态冲击，days为None时返回单日向量，否则返回(days, 资产数)矩阵"""
+        shape = len(self.prices) if days is None else (days, len(self.prices))
+        return self.rng.standard_normal(shape)
+
+    def step(self, scale, shocks=None):
+        """推进一天：所有资产一次性完成冲击、限幅、取整和保护"""
+        if shocks is None:
+            shocks = self.draw_shocks()
+        self.prices[:] = step_prices(self.prices, shocks, self.volatility, scale, self.floors(), self.clamp)
+        self.version += 1
+        return self.prices
+
+    def set_prices(self, prices):
+        """整体替换当前价格（读档、日志重放）"""
+        self.prices[:] = prices
+        self.version += 1
+
+class PriceHistory:
+    """固定容量的环形价格历史：日期列与价格列并行存储，同组资产共用日期轴
+
+    每条记录同时写入 pos 和 pos+capacity 两个位置（镜像写入），
+    因此任意"最近N天"窗口在底层数组中都是连续的，可以零拷贝切片。
+    """
+    def __init__(self, n_assets, capacity=365):
+        self.capacity = capacity
+        self.days = np.zeros(2 * capacity, dtype=np.int64)
+        self.prices = np.zeros((2 * capacity, n_assets), dtype=np.float64)
+        self.counts = np.zeros(n_assets, dtype=np.int64)  # 每个资产的有效记录数
+        self.length = 0  # 日期轴上的有效记录数
+        self._pos = 0    # 下一次写入的位置
+        self._loader = None  # 延迟加载的数据来源
+        self.version = 0     # 每追加一天加一，滚动指标据此判断能否增量更新
+        self.epoch = 0       # 每次整体替换（读档）加一
+
+    def clear(self):
+        self.counts[:] = 0
+        self.length = 0
+        self._pos = 0
+        self._loader = None
+        self.epoch += 1
+
+    def defer(self, length, counts, loader):
+        """登记延迟加载：记录数立即可用，价格数据在第一次访问时才由loader解码"""
+        self.clear()
+        self.length = min(int(length), self.capacity)
+        self.counts[:] = np.minimum(counts, self.capacity)
+        self._loader = loader
+
+    def _materialize(self):
+        loader, self._loader = self._loader, None
+        self.load_matrix(*loader())
+
+    def append(self, day, prices):
+        """追加一天所有资产的价格，O(1)（与资产数成正比的单行写入）"""
+        if self._loader is not None:
+            self._materialize()
+        pos, cap = self._pos, self.capacity
+        self.days[pos] = self.days[pos + cap] = day
+        self.prices[pos] = prices
+        self.prices[pos + cap] = prices
+        self._pos = (pos + 1) % cap
+        self.length = min(self.length + 1, cap)
+        np.minimum(self.counts + 1, cap, out=self.counts)
+        self.version += 1
+
+    def advance(self, day):
+        """价格行已由外部（分片进程）写入 pos 和 pos+capacity 两个位置，这里只推进日期轴和记录数"""
+        pos, cap = self._pos, self.capacity
+        self.days[pos] = self.days[pos + cap] = day
+        self._pos = (pos + 1) % cap
+        self.length = min(self.length + 1, cap)
+        np.minimum(self.counts + 1, cap, out=self.counts)
+        self.version += 1
+
+    def window(self, n=None):
+        """返回最近n天的 (日期, 价格矩阵[天, 资产]) 零拷贝视图"""
+        if self._loader is not None:
+            self._materialize()
+        n = self.length if n is None else max(0, min(int(n), self.length))
+        end = self._pos + self.capacity
+        return self.days[end - n:end], self.prices[end - n:end]
+
+    def series(self, index, n=None):
+        """返回单个资产最近n天的 (日期, 价格) 零拷贝视图"""
+        if self._loader is not None:
+            self._materialize()
+        count = int(self.counts[index])
+        n = count if n is None else max(0, min(int(n), count))
+        end = self._pos + self.capacity
+        return self.days[end - n:end], self.prices[end - n:end, index]
+
+    def load_records(self, records_per_asset):
+        """从存档中的 [{"day", "price"}, ...] 列表重建历史（各资产记录按最后一天对齐）"""
+        self.clear()
+        cleaned = []
+        for records in records_per_asset:
+            valid = [(int(h["day"]), float(h["price"])) for h in (records if isinstance(records, list) else [])
+                     if isinstance(h, dict) and isinstance(h.get("day"), (int, float)) and isinstance(h.get("price"), (int, float))]
+            cleaned.append(valid[-self.capacity:])
+        length = max((len(v) for v in cleaned), default=0)
+        if length == 0:
+            return
+        # 以最长的记录作为日期轴，较短的记录对齐到末尾
+        axis = max(cleaned, key=len)
+        matrix = np.zeros((length, len(cleaned)), dtype=np.float64)
+        for idx, valid in enumerate(cleaned):
+            if valid:
+                matrix[length - len(valid):, idx] = [p for _, p in valid]
+        self.load_matrix([d for d, _ in axis], matrix, [len(v) for v in cleaned])
+
+    def load_matrix(self, days, matrix, counts):
+        """直接装入 (日期, 价格矩阵[天, 资产], 每资产记录数)，只保留最近capacity天"""
+        self.clear()
+        length = min(len(days), self.capacity)
+        if length:
+            cap = self.capacity
+            self.days[:length] = self.days[cap:cap + length] = np.asarray(days)[-length:]
+            self.prices[:length] = self.prices[cap:cap + length] = np.asarray(matrix)[-length:]
+        self.length = length
+        self._pos = length % self.capacity
+        self.counts[:] = np.minimum(counts, length)
+
+class AssetHistory:
+    """单个资产在 PriceHistory 中的一列视图"""
+    __slots__ = ("store", "index")
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+    def __len__(self):
+        return int(self.store.counts[self.index])
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def last(self, n=None):
+        """最近n天的 (日期, 价格) 零拷贝视图"""
+        return self.store.series(self.index, n)
+
+    def to_records(self):
+        """转换为存档使用的 [{"day", "price"}, ...] 列表"""
+        days, prices = self.last()
+        return [{"day": int(d), "price": float(p)} for d, p in zip(days.tolist(), prices.tolist())]
+
+def _engine_field(column, fallback):
+    """生成映射到价格引擎数组的属性；尚未绑定引擎时读写实例自身字段"""
+    def getter(self):
+        if self._engine is None:
+            return getattr(self, fallback)
+        return float(getattr(self._engine, column)[self._index])
+
+    def setter(self, value):
+        if self._engine is None:
+            setattr(self, fallback, float(value))
+        else:
+            getattr(self._engine, column)[self._index] = value
+            self._engine.version += 1
+    return property(getter, setter)
+
+# ========== 滚动指标 ==========
+INDICATOR_WINDOWS = (5, 20, 60, 120, 250)  # 预先维护的滚动窗口（天），都小于价格历史的容量
+INDICATOR_FAMILIES = {
+    "momentum": "动量：近N天涨幅(%)",
+    "volatility": "波动率：近N天日收益率的标准差(%)",
+    "ma": "均线偏离：当前价相对N日均线(%)",
+    "drawdown": "回撤：当前价低于N日最高价的幅度(%)",
+}
+INDICATOR_BLOCK = 4096  # 重建时每次处理的资产数，限制临时矩阵的内存
+SCREEN_OPERATORS = {">": np.greater, ">=": np.greater_equal, "<": np.less, "<=": np.less_equal}
+SCREEN_CONDITION = re.compile(r"^([a-z]+(?:_\d+)?)\s*(>=|<=|>|<)\s*(-?\d+(?:\.\d+)?)$")
+DEFAULT_SCREEN_SORT = "momentum_20"
+
+def parse_screen_conditions(text):
+    """把 "momentum_20>10, volatility_20<2" 解析为 [(指标名, 运算符, 阈值)]，格式错误时抛出ValueError"""
+    conditions = []
+    for part in re.split(r"\s*(?:,|，|;|\band\b|且)\s*", text.strip().lower()):
+        if not part:
+            continue
+        match = SCREEN_CONDITION.match(part)
+        if match is None:
+            raise ValueError(f"无法解析的筛选条件：{part}")
+        conditions.append((match.group(1), match.group(2), float(match.group(3))))
+    return conditions
+
+def format_indicator(name, value):
+    """筛选结果中的一列指标：动量和均线偏离按正负着色"""
+    if name == "price":
+        return f"{name} {value:.2f}元"
+    color = Style.RESET_ALL
+    if name.startswith(("momentum_", "ma_")):
+        color = Fore.GREEN if value > 0 else (Fore.RED if value < 0 else Style.RESET_ALL)
+    return f"{name} {color}{value:.2f}%{Style.RESET_ALL}"
+
+def daily_returns(previous, current):
+    """逐资产的日收益率；前一天没有价格（为0）的资产记为0，保证增量更新和整体重建得到相同的窗口和"""
+    returns = np.zeros(np.broadcast(previous, current).shape)
+    np.divide(current - previous, previous, out=returns, where=previous > 0)
+    return returns
+
+class RollingIndicators:
+    """一组资产在若干标准窗口上的滚动指标（动量、波动率、均线偏离、回撤），指标列与价格历史的资产列对齐
+
+    每天价格追加到历史后只做与资产数成正比的增量更新：均线和收益率的窗口和加上新进入的一行、减去离开的一行，
+    离开窗口的恰好是最高价的资产只标记为过期，查询回撤时才重新求最大值；读档或一次追加多天后按历史窗口整体重建。
+    窗口和的加减会累积浮点误差，因此每增量更新 span 天也整体重建一次（摊到每天仍与资产数成正比）。
+    """
+    def __init__(self, store, windows=INDICATOR_WINDOWS):
+        self.store = store
+        self.windows = tuple(w for w in sorted(windows) if w + 2 <= store.capacity)  # 历史容量较小时只维护放得下的窗口
+        self.span = max(self.windows, default=0)
+        shape = (len(self.windows), len(store.counts))
+        self.price_sums = np.zeros(shape)      # 窗口内价格之和（均线）
+        self.return_sums = np.zeros(shape)     # 窗口内日收益率之和
+        self.return_squares = np.zeros(shape)  # 窗口内日收益率平方和
+        self.peaks = np.zeros(shape)           # 窗口内最高价
+        self.stale_peaks = np.zeros(shape, dtype=bool)  # 最高价已离开窗口、需要重新求的资产
+        self._synced = None  # 已同步到的 (历史epoch, 历史version)
+        self._advances = 0   # 上次整体重建之后增量更新的天数
+        self._columns = {}   # 本次同步后已算出的指标列
+
+    def sync(self):
+        """让指标跟上价格历史：只差一天时增量更新，否则整体重建"""
+        state = (self.store.epoch, self.store.version)
+        if state == self._synced:
+            return
+        if self._synced is not None and state == (self._synced[0], self._synced[1] + 1) and self._advances < self.span:
+            self._advance()
+            self._advances += 1
+        else:
+            self._rebuild()
+            self._advances = 0
+        self._synced = state
+        self._columns = {}
+
+    def _rebuild(self):
+        _, prices = self.store.window(self.span + 1)
+        for lo in range(0, prices.shape[1], INDICATOR_BLOCK):
+            block = prices[:, lo:lo + INDICATOR_BLOCK]
+            returns = daily_returns(block[:-1], block[1:])
+            for row, window in enumerate(self.windows):
+                recent = block[-window:]
+                self.price_sums[row, lo:lo + INDICATOR_BLOCK] = recent.sum(axis=0)
+                self.return_sums[row, lo:lo + INDICATOR_BLOCK] = returns[-window:].sum(axis=0)
+                self.return_squares[row, lo:lo + INDICATOR_BLOCK] = np.square(returns[-window:]).sum(axis=0)
+                self.peaks[row, lo:lo + INDICATOR_BLOCK] = recent.max(axis=0) if len(recent) else 0.0
+        self.stale_peaks[:] = False
+
+    def _advance(self):
+        _, prices = self.store.window(self.span + 2)
+        rows, latest = len(prices), prices[-1]
+        entering = daily_returns(prices[-2], latest) if rows >= 2 else np.zeros(len(latest))
+        for row, window in enumerate(self.windows):
+            self.price_sums[row] += latest
+            self.return_sums[row] += entering
+            self.return_squares[row] += np.square(entering)
+            if rows > window:
+                departed = prices[-window - 1]
+                self.price_sums[row] -= departed
+                self.stale_peaks[row] |= departed >= self.peaks[row]
+            if rows > window + 1:
+                leaving = daily_returns(prices[-window - 2], prices[-window - 1])
+                self.return_sums[row] -= leaving
+                self.return_squares[row] -= np.square(leaving)
+            np.maximum(self.peaks[row], latest, out=self.peaks[row])
+
+    def column(self, name):
+        """按名称取一列指标（如 momentum_20、price），历史不足窗口长度的资产为NaN"""
+        self.sync()
+        if name not in self._columns:
+            self._columns[name] = self._compute(name)
+        return self._columns[name]
+
+    def _compute(self, name):
+        _, latest = self.store.window(1)
+        latest = latest[-1] if len(latest) else np.zeros(len(self.store.counts))
+        if name == "price":
+            return latest.copy()
+        family, _, size = name.rpartition("_")
+        if family not in INDICATOR_FAMILIES or not size.isdigit() or int(size) not in self.windows:
+            raise ValueError(f"未知的指标：{name}（可用：price 以及 {'/'.join(INDICATOR_FAMILIES)} 加窗口 {'/'.join(map(str, self.windows))}）")
+        window = int(size)
+        row = self.windows.index(window)
+        valid = self.store.counts > window
+        values = np.full(len(latest), np.nan)
+        if family == "momentum":
+            _, prices = self.store.window(window + 1)
+            base = prices[0]
+            np.divide((latest - base) * 100, base, out=values, where=valid & (base > 0))
+        elif family == "volatility":
+            mean = self.return_sums[row] / window
+            variance = np.maximum(self.return_squares[row] / window - np.square(mean), 0.0) * window / (window - 1)
+            values[valid] = np.sqrt(variance[valid]) * 100
+        elif family == "ma":
+            average = self.price_sums[row] / window
+            np.divide((latest - average) * 100, average, out=values, where=valid & (average > 0))
+        else:
+            peaks = self._current_peaks(row, window)
+            np.divide((peaks - latest) * 100, peaks, out=values, where=valid & (peaks > 0))
+        return values
+
+    def _current_peaks(self, row, window):
+        """窗口内最高价；先重新求出已过期的资产（过期较多时整块按行扫描，比逐列取值快）"""
+        stale = np.flatnonzero(self.stale_peaks[row])
+        if len(stale):
+            _, prices = self.store.window(window)
+            if len(stale) * 16 > len(self.stale_peaks[row]):
+                self.peaks[row] = prices.max(axis=0)
+            else:
+                self.peaks[row, stale] = prices[:, stale].max(axis=0)
+            self.stale_peaks[row] = False
+        return self.peaks[row]
+
+    def screen(self, conditions=(), sort_by=DEFAULT_SCREEN_SORT, top=20, ascending=False):
+        """按 [(指标名, 运算符, 阈值)] 向量化过滤，再用部分排序取 sort_by 最大（ascending 时最小）的top个
+
+        返回 (按排序的资产行号数组, 满足条件的资产数)。
+        """
+        if top <= 0:
+            raise ValueError("显示数量必须大于0")
+        keys = self.column(sort_by)
+        mask = ~np.isnan(keys)
+        for name, op, value in conditions:
+            if op not in SCREEN_OPERATORS:
+                raise ValueError(f"不支持的运算符：{op}")
+            mask &= SCREEN_OPERATORS[op](self.column(name), value)  # NaN参与比较总是False
+        candidates = np.flatnonzero(mask)
+        matched = len(candidates)
+        keys = keys[candidates] if ascending else -keys[candidates]
+        if matched > top:
+            chosen = np.argpartition(keys, top - 1)[:top]
+            candidates, keys = candidates[chosen], keys[chosen]
+        return candidates[np.argsort(keys, kind="stable")], matched
+
+# ========== 分片模拟 ==========
+SHARD_BLOCK_SIZE = 4096  # 随机流按固定大小的资产块划分，与进程数无关
+SHARD_TIMEOUT = 60       # 等待分片进程完成一天的最长秒数
+
+def _shard_worker(names, n_assets, capacity, lo, hi, block_size, seed, floor_ratio, floor_min, clamp, barrier):
+    """分片进程：每天在屏障处等待指令，推进 [lo, hi) 资产的价格并写入共享的价格历史"""
+    blocks = {name: shared_memory.SharedMemory(name=name) for name in names.values()}
+    control = np.ndarray((4,), dtype=np.float64, buffer=blocks[names["control"]].buf)
+    prices = np.ndarray((n_assets,), dtype=np.float64, buffer=blocks[names["prices"]].buf)
+    base_prices = np.ndarray((n_assets,), dtype=np.float64, buffer=blocks[names["base_prices"]].buf)
+    volatility = np.ndarray((n_assets,), dtype=np.float64, buffer=blocks[names["volatility"]].buf)
+    history = np.ndarray((2 * capacity, n_assets), dtype=np.float64, buffer=blocks[names["history"]].buf)
+    try:
+        while True:
+            barrier.wait()
+            command, day, scale, pos = control.tolist()
+            if command == 0:
+                break
+            for start in range(lo, hi, block_size):
+                end = min(start + block_size, hi)
+                # 每个资产块每天使用由 (种子, 天数, 块号) 决定的独立随机流，结果与分片方式无关
+                rng = np.random.default_rng([seed, int(day), start // block_size])
+                floors = np.maximum(base_prices[start:end] * floor_ratio, floor_min)
+                prices[start:end] = step_prices(prices[start:end], rng.standard_normal(end - start),
+                                                volatility[start:end], scale, floors, clamp)
+            history[int(pos), lo:hi] = history[int(pos) + capacity, lo:hi] = prices[lo:hi]
+            barrier.wait()
+    finally:
+        del control, prices, base_prices, volatility, history
+        for block in blocks.values():
+            block.close()
+
+class ShardedSimulator:
+    """把一组资产按块划分给多个进程推进价格：价格、基础价格、波动性和价格历史放在共享内存中，
+    引擎和历史的数组直接替换为共享内存上的视图，主进程读取结果不需要复制"""
+    def __init__(self, engine, store, workers, seed=None, block_size=SHARD_BLOCK_SIZE):
+        if workers < 1:
+            raise ValueError("分片进程数必须大于0")
+        self.engine = engine
+        self.store = store
+        self.workers = workers
+        self.seed = int(seed) if seed is not None else int(np.random.SeedSequence().entropy % 2**32)
+        n_assets, capacity = len(engine), store.capacity
+        self._blocks = {}
+        self.control = self._share("control", np.zeros(4))
+        engine.prices = self._share("prices", engine.prices)
+        engine.base_prices = self._share("base_prices", engine.base_prices)
+        engine.volatility = self._share("volatility", engine.volatility)
+        store.prices = self._share("history", store.prices)
+
+        # 按资产块把连续区间分给各进程，进程数多于块数时只启动需要的进程
+        n_blocks = -(-n_assets // block_size)
+        bounds = [(int(chunk[0]) * block_size, min((int(chunk[-1]) + 1) * block_size, n_assets))
+                  for chunk in np.array_split(np.arange(n_blocks), min(workers, n_blocks)) if len(chunk)]
+        self.barrier = multiprocessing.Barrier(len(bounds) + 1)
+        names = {key: block.name for key, block in self._blocks.items()}
+        self.processes = [multiprocessing.Process(target=_shard_worker, daemon=True,
+                                                  args=(names, n_assets, capacity, lo, hi, block_size, self.seed,
+                                                        engine.floor_ratio, engine.floor_min, engine.clamp, self.barrier))
+                          for lo, hi in bounds]
+        for process in self.processes:
+            process.start()
+        atexit.register(self.close)
+
+    def _share(self, key, array):
+        """在共享内存中分配与array同形状的块，复制数据并返回共享内存上的视图"""
+        array = np.asarray(array, dtype=np.float64)
+        block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self._blocks[key] = block
+        view = np.ndarray(array.shape, dtype=np.float64, buffer=block.buf)
+        view[...] = array
+        return view
+
+    def step(self, scale, day):
+        """所有分片推进一天：写入指令后通过屏障放行，再等待全部分片完成"""
+        if not self.processes:
+            raise RuntimeError("分片模拟已关闭")
+        if self.store._loader is not None:
+            self.store._materialize()  # 读档后延迟加载的历史要先解码，否则会覆盖分片进程写入的行
+        self.control[:] = (1, day, scale, self.store._pos)
+        try:
+            self.barrier.wait(SHARD_TIMEOUT)
+            self.barrier.wait(SHARD_TIMEOUT)
+        except threading.BrokenBarrierError:
+            self.close()
+            raise RuntimeError("分片进程没有按时完成，分片模拟已关闭")
+        self.store.advance(day)
+        self.engine.version += 1
+        return self.engine.prices
+
+    def close(self):
+        """停止分片进程，把数组复制回普通内存后释放共享内存"""
+        if not self._blocks:
+            return
+        if self.processes:
+            self.control[0] = 0
+            try:
+                self.barrier.wait(SHARD_TIMEOUT)
+            except threading.BrokenBarrierError:
+                pass
+            for process in self.processes:
+                process.join(SHARD_TIMEOUT)
+                if process.is_alive():
+                    process.terminate()
+            self.processes = []
+        self.engine.prices = self.engine.prices.copy()
+        self.engine.base_prices = self.engine.base_prices.copy()
+        self.engine.volatility = self.engine.volatility.copy()
+        self.store.prices = self.store.prices.copy()
+        self.control = None
+        for block in self._blocks.values():
+            block.close()
+            block.unlink()
+        self._blocks = {}
+        atexit.unregister(self.close)
+
 # ========== 数据模型 ==========
 class Asset:
-    def __init__(self, code, name, base_price, volatility, income):
+    current_price = _engine_field("prices", "_current_price")
+    base_price = _engine_field("base_prices", "_base_price")
+    volatility = _engine_field("volatility", "_volatility")
+
+    def __init__(self, code, name, base_price, volatility, income, sector=None):
+        self._engine = None  # 所属价格引擎及行号，绑定后价格数据存放在引擎数组中
+        self._index = -1
         self.code = code
         self.name = name
+        self.sector = sector  # 所属行业，内置模板股票没有行业
         # 基础价格确保是数字且有效
         self.base_price = float(max(base_price, 10000))
         self.current_price = self.base_price
         self.volatility = volatility
         self.income = income
-        self.history = []  # 列表记录日期和价格字典
-        self.operation_history = []  # 新增操作记录
+        self.history = None  # 价格历史视图(AssetHistory)，由 FinancialMarket 绑定
 
 class Bond:
+    current_price = _engine_field("prices", "_current_price")
+    price = _engine_field("base_prices", "_price")
+
     def __init__(self, code, name, price, yield_rate, duration):
+        self._engine = None  # 所属价格引擎及行号
+        self._index = -1
         self.code = code
         self.name = name
         # 价格确保是数字且有效
@@ -28,8 +541,7 @@ class Bond:
         self.current_price = self.price
         self.yield_rate = yield_rate
         self.duration = duration
-        self.history = []  # 列表记录日期和价格字典
-        self.operation_history = []  # 新增操作记录
+        self.history = None  # 价格历史视图(AssetHistory)，由 FinancialMarket 绑定
 
     def update_price(self):
         """债券价格波动（带价格保护） - 价格历史记录移至 FinancialMarket"""
@@ -38,6 +550,335 @@ class Bond:
         # 价格波动和历史记录处理移至 FinancialMarket.update_bonds
         pass # 价格更新逻辑在 FinancialMarket 中实现
 
+class Holding:
+    """股票/债券持仓：数量和平均成本价"""
+    __slots__ = ("amount", "avg_price")
+
+    def __init__(self, amount, avg_price):
+        self.amount = amount
+        self.avg_price = avg_price
+
+    def add(self, amount, price):
+        """加仓，平均成本价按数量加权"""
+        total = self.amount + amount
+        self.avg_price = (self.avg_price * self.amount + price * amount) / total if total > 0 else 0.0
+        self.amount = total
+
+    def to_record(self):
+        """转换为存档使用的 {"amount", "avg_price"} 字典"""
+        return {"amount": self.amount, "avg_price": self.avg_price}
+
+    @classmethod
+    def from_record(cls, data):
+        """从存档数据构造持仓，格式错误时返回None"""
+        if not isinstance(data, dict) or not isinstance(data.get("amount"), (int, float)):
+            return None
+        avg_price = data.get("avg_price", 0.0)
+        return cls(float(data["amount"]), float(avg_price) if isinstance(avg_price, (int, float)) else 0.0)
+
+class ShortPosition:
+    """做空仓位：数量、借入价格和借入天数"""
+    __slots__ = ("amount", "price", "day")
+
+    def __init__(self, amount, price, day):
+        self.amount = amount
+        self.price = price
+        self.day = day
+
+    def add(self, amount, price, day):
+        """追加做空，借入价格按数量加权，借入天数更新为最新的"""
+        total = self.amount + amount
+        self.price = (self.price * self.amount + price * amount) / total if total > 0 else 0.0
+        self.amount = total
+        self.day = day
+
+    def to_record(self):
+        """转换为存档使用的 [数量, 借入价格, 借入天数] 列表"""
+        return [self.amount, self.price, self.day]
+
+    @classmethod
+    def from_record(cls, data):
+        """从存档数据构造做空仓位，格式错误时返回None"""
+        if not isinstance(data, list) or len(data) < 2:
+            return None
+        return cls(float(data[0]) if isinstance(data[0], (int, float)) else 0.0,  # 数量
+                   float(data[1]) if isinstance(data[1], (int, float)) else 0.0,  # 借入价格
+                   int(data[2]) if len(data) > 2 and isinstance(data[2], (int, float)) else 0)  # 借入天数
+
+POSITION_TYPES = {"stocks": Holding, "bonds": Holding, "shorts": ShortPosition}
+
+def load_positions(kind, records):
+    """读档时校验持仓记录并转换为持仓对象，格式错误的条目直接丢弃"""
+    if not isinstance(records, dict):
+        return {}
+    positions = {}
+    for code, record in records.items():
+        position = POSITION_TYPES[kind].from_record(record)
+        if position is not None:
+            positions[code] = position
+    return positions
+
+# ========== 股票池生成 ==========
+# 行业：(名称, 名称后缀, 占比, 波动性均值, 波动性标准差, 收益均值)
+STOCK_SECTORS = (
+    ("科技", "科技", 0.22, 0.28, 0.08, 380),
+    ("金融", "金融", 0.12, 0.12, 0.04, 260),
+    ("消费", "消费", 0.16, 0.15, 0.05, 220),
+    ("医药", "医药", 0.12, 0.22, 0.07, 320),
+    ("能源", "能源", 0.10, 0.20, 0.06, 240),
+    ("工业", "工业", 0.14, 0.16, 0.05, 200),
+    ("地产", "地产", 0.08, 0.20, 0.06, 180),
+    ("公用事业", "电力", 0.06, 0.08, 0.03, 150),
+)
+NAME_SYLLABLES = "华信中东恒泰安康瑞达宏远金银海天星云新盛元博凯正联通嘉和汇鼎丰光明德长城峰立诚辉"
+UNIVERSE_MAX_SIZE = 1_000_000
+UNIVERSE_VERSION = 1  # 股票池生成规则的版本，改变 generate_stock_universe 的结果时必须加1
+
+def normalize_universe(universe):
+    """校验股票池规格 {"size", "seed", "version", "checksum"}；未给种子时随机取一个，使存档能按规格重新生成同一个股票池
+
+    没有记录版本的规格（新建的规格和早期存档）按当前版本处理；checksum 是生成结果的校验值，股票池生成后填入，
+    读档重新生成时用它发现生成规则的变化。
+    """
+    if universe is None:
+        return None
+    size = int(universe["size"])
+    if not 1 <= size <= UNIVERSE_MAX_SIZE:
+        raise ValueError(f"股票池规模必须在1到{UNIVERSE_MAX_SIZE}之间")
+    version = int(universe.get("version", UNIVERSE_VERSION))
+    if version != UNIVERSE_VERSION:
+        raise ValueError(f"股票池由第{version}版生成规则创建，当前为第{UNIVERSE_VERSION}版，无法重新生成")
+    seed = universe.get("seed")
+    normalized = {"size": size, "seed": int(seed) if seed is not None else int(np.random.SeedSequence().entropy % 2**32),
+                  "version": version}
+    if universe.get("checksum") is not None:
+        normalized["checksum"] = int(universe["checksum"])
+    return normalized
+
+def universe_checksum(stocks):
+    """股票池生成结果（代码、基础价格和波动性）的CRC32校验值"""
+    checksum = zlib.crc32("\n".join(s.code for s in stocks).encode('utf-8'))
+    for values in (np.array([s.base_price for s in stocks]), np.array([s.volatility for s in stocks])):
+        checksum = zlib.crc32(values.astype('<f8').tobytes(), checksum)
+    return checksum
+
+def generate_stock_universe(size, seed):
+    """按种子一次性向量化生成size只股票：代码和名称唯一，行业决定波动性和收益的分布"""
+    rng = np.random.default_rng(seed)
+    sector_names, suffixes, weights, vol_mean, vol_std, income_mean = (np.array(column) for column in zip(*STOCK_SECTORS))
+    sectors = rng.choice(len(STOCK_SECTORS), size=size, p=weights / weights.sum())
+    volatility = np.round(np.clip(rng.normal(vol_mean[sectors], vol_std[sectors]), 0.03, 0.6), 2)
+    income = np.maximum(rng.lognormal(np.log(income_mean[sectors]), 0.35), 50).astype(np.int64)
+
+    # 波动越大公司越小、基础价格越低；模板股票的低价档在 Asset 的1万元价格下限之下（会被截成1万元），这里各档都在下限之上
+    low = np.select([volatility >= 0.25, volatility >= 0.15], [10000.0, 13000.0], 16000.0)
+    high = np.select([volatility >= 0.25, volatility >= 0.15], [12999.0, 15999.0], 24999.0)
+    base_prices = np.round(rng.uniform(low, high), 2)
+
+    # 代码：从 26^width 个字母组合中无放回抽取，再按位解码为大写字母
+    width = 4
+    while 26 ** width < 2 * size:
+        width += 1
+    values = rng.choice(26 ** width, size=size, replace=False)
+    letters = (values[:, None] // 26 ** np.arange(width - 1, -1, -1)) % 26 + ord("A")
+    codes = np.ascontiguousarray(letters.astype(np.uint8)).view(f"S{width}").ravel().astype(str)
+
+    # 名称：无放回抽取的序号按位映射为三个字，超出组合数的部分追加编号，保证唯一
+    radix = len(NAME_SYLLABLES)
+    ordinal = rng.choice(radix ** 3 * -(-size // radix ** 3), size=size, replace=False)
+    syllables = np.array(list(NAME_SYLLABLES))
+    names = syllables[ordinal // radix ** 2 % radix]
+    for place in (radix, 1):
+        names = np.char.add(names, syllables[ordinal // place % radix])
+    names = np.char.add(names, suffixes[sectors])
+    repeat = ordinal // radix ** 3
+    names = np.where(repeat > 0, np.char.add(names, repeat.astype(str)), names)
+
+    return [Asset(code, name, base, vol, inc, sector)
+            for code, name, base, vol, inc, sector in zip(codes.tolist(), names.tolist(), base_prices.tolist(),
+                                                          volatility.tolist(), income.tolist(), sector_names[sectors].tolist())]
+
+# ========== 交易账本 ==========
+class TradeLedger:
+    """规范化的交易账本：全部成交按列存入可增长的numpy数组，并按资产代码、类型、操作和日期建立索引
+
+    成交按游戏天数顺序追加，日期列天然有序，日期区间用二分查找定位；类型、代码和操作列存为字典编号，
+    每个取值另有一份有序的 (行号, 日期) 列表，查询从其中最短的一份开始，其余条件在数组上过滤。
+    """
+    FIELDS = ("day", "type", "code", "action", "amount", "price", "pnl")  # pnl 为该笔成交实现的盈亏
+    LABELS = ("type", "code", "action")  # 以字典编号存储的文本列
+    DTYPES = {"day": np.int64, "amount": np.float64, "price": np.float64, "pnl": np.float64}
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.length = 0
+        self._arrays = {field: np.zeros(self.INITIAL_CAPACITY, dtype=self.DTYPES.get(field, np.int32)) for field in self.FIELDS}
+        self._labels = {field: [] for field in self.LABELS}     # 编号 -> 文本
+        self._label_ids = {field: {} for field in self.LABELS}  # 文本 -> 编号
+        self._index = {field: {} for field in self.LABELS}      # 文本 -> (行号列表, 与之并行的日期列表)
+
+    def __len__(self):
+        return self.length
+
+    def __bool__(self):
+        return self.length > 0
+
+    def _reserve(self, rows):
+        if self.length + rows > len(self._arrays["day"]):
+            capacity = max(len(self._arrays["day"]) * 2, self.length + rows)
+            for field, array in self._arrays.items():
+                grown = np.zeros(capacity, dtype=array.dtype)
+                grown[:self.length] = array[:self.length]
+                self._arrays[field] = grown
+
+    def _label_id(self, field, value):
+        ids = self._label_ids[field]
+        if value not in ids:
+            ids[value] = len(self._labels[field])
+            self._labels[field].append(value)
+        return ids[value]
+
+    def append(self, record):
+        """追加一笔成交（字典），返回规范化后的记录"""
+        row = self.length
+        self._reserve(1)
+        day = int(record.get("day", 0))
+        self._arrays["day"][row] = day
+        for field in self.LABELS:
+            value = str(record.get(field, ""))
+            self._arrays[field][row] = self._label_id(field, value)
+            rows, days = self._index[field].setdefault(value, ([], []))
+            rows.append(row)
+            days.append(day)
+        for field in ("amount", "price"):
+            self._arrays[field][row] = float(record.get(field, 0.0))
+        self._arrays["pnl"][row] = float(record.get("pnl") or 0.0)
+        self.length += 1
+        return self.record(row)
+
+    def extend(self, records):
+        for record in records:
+            self.append(record)
+
+    def column(self, field):
+        """某一列的全部值（数值列为零拷贝视图，文本列解码为字符串数组）"""
+        values = self._arrays[field][:self.length]
+        if field in self.LABELS:
+            return np.array(self._labels[field] or [""], dtype=str)[values]
+        return values
+
+    def record(self, row):
+        """第row笔成交的字典形式"""
+        return self.records(row, row + 1)[0]
+
+    def records(self, start=0, stop=None):
+        """按顺序返回 [start, stop) 行的成交记录"""
+        return self._records(slice(start, self.length if stop is None else min(stop, self.length)))
+
+    def _records(self, rows):
+        """按行号（切片或行号数组）取出成交记录"""
+        columns = []
+        for field in self.FIELDS:
+            values = self._arrays[field][:self.length][rows].tolist()
+            if field in self.LABELS:
+                labels = self._labels[field]
+                values = [labels[value] for value in values]
+            columns.append(values)
+        return [dict(zip(self.FIELDS, values)) for values in zip(*columns)]
+
+    def load_records(self, records):
+        """从存档中的成交记录重建账本，格式错误的条目丢弃；按日期稳定排序以保证日期索引有序"""
+        self.clear()
+        valid = [r for r in records if isinstance(r, dict) and isinstance(r.get("day"), (int, float))
+                 and isinstance(r.get("amount"), (int, float)) and isinstance(r.get("price"), (int, float))]
+        self.extend(sorted(valid, key=lambda r: r["day"]))
+
+    def load_columns(self, columns):
+        """直接装入按列存储的成交（二进制存档），缺少的列用默认值补齐"""
+        self.clear()
+        length = len(columns.get("day", []))
+        days = np.asarray(columns.get("day", []), dtype=np.int64)
+        order = np.argsort(days, kind='stable')
+        self._reserve(length)
+        defaults = {"type": "", "code": "", "action": "", "amount": 0.0, "price": 0.0, "pnl": 0.0}
+        for field in self.FIELDS:
+            if field in self.LABELS:
+                values = np.asarray(columns[field], dtype=str) if field in columns else np.full(length, defaults[field])
+                labels, ids = np.unique(values, return_inverse=True)
+                self._labels[field] = labels.tolist()
+                self._label_ids[field] = {label: n for n, label in enumerate(self._labels[field])}
+                self._arrays[field][:length] = ids.reshape(-1)[order]
+            elif field in columns:
+                self._arrays[field][:length] = np.asarray(columns[field], dtype=self.DTYPES[field])[order]
+            else:
+                self._arrays[field][:length] = defaults[field]
+        self.length = length
+        sorted_days = self._arrays["day"][:length]
+        for field in self.LABELS:
+            # 按编号分组（稳定排序保持组内行号有序）
+            ids = self._arrays[field][:length]
+            rows = np.argsort(ids, kind='stable')
+            bounds = np.flatnonzero(np.diff(ids[rows])) + 1
+            for group in np.split(rows, bounds) if length else []:
+                self._index[field][self._labels[field][int(ids[group[0]])]] = (group.tolist(), sorted_days[group].tolist())
+
+    def _rows(self, code=None, type=None, action=None, start_day=None, end_day=None):
+        """按代码、类型、操作和日期区间（含两端）用索引定位行，返回切片或行号数组"""
+        conditions = [(field, value) for field, value in (("code", code), ("type", type), ("action", action)) if value is not None]
+        if not conditions:
+            days = self._arrays["day"][:self.length]
+            lo = int(np.searchsorted(days, start_day, side='left')) if start_day is not None else 0
+            hi = int(np.searchsorted(days, end_day, side='right')) if end_day is not None else self.length
+            return slice(lo, max(lo, hi))
+        candidates = []
+        for field, value in conditions:
+            if value not in self._index[field]:
+                return np.zeros(0, dtype=np.intp)
+            rows, days = self._index[field][value]
+            lo = bisect.bisect_left(days, start_day) if start_day is not None else 0
+            hi = bisect.bisect_right(days, end_day) if end_day is not None else len(days)
+            candidates.append((hi - lo, field, rows, lo, hi))
+        _, chosen, rows, lo, hi = min(candidates, key=lambda item: item[0])
+        rows = np.asarray(rows[lo:hi], dtype=np.intp)
+        for field, value in conditions:
+            if field != chosen:
+                rows = rows[self._arrays[field][rows] == self._label_ids[field][value]]
+        return rows
+
+    def query(self, code=None, type=None, action=None, start_day=None, end_day=None, page=1, page_size=30, newest_first=True):
+        """分页查询成交，返回 (本页记录, 符合条件的总笔数)；page从1开始，默认最新的在前"""
+        rows = self._rows(code, type, action, start_day, end_day)
+        if isinstance(rows, slice):
+            rows = np.arange(rows.start, rows.stop)
+        total = len(rows)
+        if newest_first:
+            rows = rows[::-1]
+        start = max(page - 1, 0) * page_size
+        return self._records(rows[start:start + page_size]), total
+
+    def aggregate(self, code=None, start_day=None, end_day=None, type=None, action=None):
+        """按代码汇总成交笔数、成交量、成交额和已实现盈亏，返回 {代码: 汇总}"""
+        rows = self._rows(code, type, action, start_day, end_day)
+        codes = self._arrays["code"][:self.length][rows]
+        if len(codes) == 0:
+            return {}
+        amounts = self._arrays["amount"][:self.length][rows]
+        turnover = amounts * self._arrays["price"][:self.length][rows]
+        pnl = self._arrays["pnl"][:self.length][rows]
+        keys, inverse = np.unique(codes, return_inverse=True)
+        counts = np.bincount(inverse)
+        sums = [np.bincount(inverse, weights=values) for values in (amounts, turnover, pnl)]
+        labels = self._labels["code"]
+        return {labels[key]: {"trades": int(n), "volume": float(v), "turnover": float(t), "realized_pnl": float(p)}
+                for key, n, v, t, p in zip(keys.tolist(), counts.tolist(), *(column.tolist() for column in sums))}
+
+    def turnover(self):
+        """全部成交的成交额"""
+        return float(np.dot(self._arrays["amount"][:self.length], self._arrays["price"][:self.length]))
+
 # ========== 游戏系统 ==========
 class SeasonSystem:
     SEASONS = [
@@ -56,13 +897,71 @@ class SeasonSystem:
         return self.SEASONS[day // 7 % 4]
 
 class FinancialMarket:
-    def __init__(self):
-        self.stocks = self.generate_random_stocks()
-        self.bonds = [Bond("GOV01", "国债-3月期", round(random.uniform(0.5, 1.5), 2), 0.03, 90),
-                      Bond("GOV02", "国债-1年期", round(random.uniform(9.0, 11.0), 2), 0.035, 365)] # 确保初始价格为浮点数
+    STOCK_MAX_CHANGE = 0.5     # 股票单日波动限制±50%
+    STOCK_FLOOR_RATIO = 0.2    # 股票价格不低于基础价格的20%
+    BOND_VOLATILITY = 0.05     # 债券日波动标准差
+    BOND_FLOOR = 5000.0        # 债券价格下限
+    HISTORY_DAYS = 365         # 价格历史保留一年数据
+
+    def __init__(self, seed=None, stocks=None, history_days=None, universe=None):
+        self.random = random.Random(seed)  # 生成初始市场用的随机源，给定seed时整个市场可复现
+        if history_days is not None:
+            self.HISTORY_DAYS = history_days  # 可按实例调整价格历史保留天数（基准测试等）
+        # 股票池规格 {"size", "seed", "version", "checksum"}，为None时使用内置的模板股票；规格记录在存档中，读档时按它重新生成股票池
+        self.universe = normalize_universe(universe)
+        if stocks is not None:
+            self.stocks = stocks
+        elif self.universe is not None:
+            self.stocks = generate_stock_universe(self.universe["size"], self.universe["seed"])
+            checksum = universe_checksum(self.stocks)
+            if self.universe.setdefault("checksum", checksum) != checksum:
+                # 生成规则或随机数库改变后，重新生成的股票池与存档建立时不同，不能用它继续这个存档
+                raise ValueError("按存档的规格重新生成的股票池与存档建立时不一致（生成规则已改变），拒绝读取")
+        else:
+            self.stocks = self.generate_random_stocks()
+        self.bonds = [Bond("GOV01", "国债-3月期", round(self.random.uniform(0.5, 1.5), 2), 0.03, 90),
+                      Bond("GOV02", "国债-1年期", round(self.random.uniform(9.0, 11.0), 2), 0.035, 365)] # 确保初始价格为浮点数
+        # 价格状态集中存放在连续数组中，股票和债券对象只是其中的视图
+        seeds = np.random.SeedSequence(seed).spawn(3)
+        self.stock_engine = PriceEngine(self.stocks, [s.base_price for s in self.stocks], [s.volatility for s in self.stocks],
+                                        floor_ratio=self.STOCK_FLOOR_RATIO, clamp=self.STOCK_MAX_CHANGE, seed=seeds[0])
+        self.bond_engine = PriceEngine(self.bonds, [b.price for b in self.bonds], [self.BOND_VOLATILITY] * len(self.bonds),
+                                       floor_min=self.BOND_FLOOR, seed=seeds[1])
+        # 价格历史按列存放在环形缓冲区中，资产的 history 属性只是其中一列的视图
+        self.stock_history = PriceHistory(len(self.stocks), self.HISTORY_DAYS)
+        self.bond_history = PriceHistory(len(self.bonds), self.HISTORY_DAYS)
+        for idx, stock in enumerate(self.stocks):
+            stock.history = AssetHistory(self.stock_history, idx)
+        for idx, bond in enumerate(self.bonds):
+            bond.history = AssetHistory(self.bond_history, idx)
         self.stock_dict = {s.code: s for s in self.stocks}
         self.bond_dict = {b.code: b for b in self.bonds}
         self.day = 0
+        self.sharded = None  # 多进程分片推进股票价格（ShardedSimulator），为None时在本进程内推进
+        # 分片推进的随机种子：由市场种子或股票池规格派生，都没有时随机取一个；记录在存档中，读档后分片价格路径不变
+        if seed is not None:
+            source = seeds[2]
+        elif self.universe is not None:
+            source = np.random.SeedSequence([self.universe["seed"], self.universe["size"]])
+        else:
+            source = np.random.SeedSequence()
+        self.shard_seed = int(source.generate_state(1)[0])
+        self.archive = None  # 存档旁的多年价格归档（PriceArchive），内存游戏没有归档
+        # 每天随价格历史增量更新的滚动指标，供多条件筛选
+        self.indicators = {"stocks": RollingIndicators(self.stock_history), "bonds": RollingIndicators(self.bond_history)}
+
+    def start_sharding(self, workers, seed=None):
+        """把股票价格的推进分给workers个进程；价格路径只由种子（默认 shard_seed）决定，与进程数无关"""
+        self.stop_sharding()
+        if seed is not None:
+            self.shard_seed = int(seed)
+        self.sharded = ShardedSimulator(self.stock_engine, self.stock_history, workers, self.shard_seed)
+
+    def stop_sharding(self):
+        """停止分片进程，价格和历史数组回到本进程内存"""
+        if self.sharded is not None:
+            self.sharded.close()
+            self.sharded = None
 
     def set_day(self, day):
         self.day = day
@@ -105,63 +1004,1561 @@ class FinancialMarket:
             # 根据波动性设置不同的基础价格范围
             if vol >= 0.25:
                 # 小型公司 (3000-7999)
-                base_price = round(random.uniform(3000.0, 7999.0), 2)
+                base_price = round(self.random.uniform(3000.0, 7999.0), 2)
             elif vol >= 0.15 and vol < 0.25:
                 # 中型公司 (7000-9999)
-                base_price = round(random.uniform(7000.0, 9999.0), 2)
+                base_price = round(self.random.uniform(7000.0, 9999.0), 2)
             else:
                 # 大型公司 (10000-15999)
-                base_price = round(random.uniform(10000.0, 15999.0), 2)
+                base_price = round(self.random.uniform(10000.0, 15999.0), 2)
 
             # 确保基础价格有效
             base_price = float(max(base_price, 3000.0)) # 确保价格不低于最低范围的下限
             stocks.append(Asset(code, name, base_price, vol, income))
         return stocks
 
+    def load_market_records(self, stock_records, bond_records):
+        """用存档中的市场数据恢复价格历史和当前价格（旧存档中各资产的操作记录与交易账本重复，直接忽略）"""
+        for lookup, engine, store, records in ((self.stock_dict, self.stock_engine, self.stock_history, stock_records),
+                                               (self.bond_dict, self.bond_engine, self.bond_history, bond_records)):
+            histories = [[] for _ in range(len(engine))]
+            for asset_data in records if isinstance(records, list) else []:
+                asset = lookup.get(asset_data.get("code")) if isinstance(asset_data, dict) else None  # 使用.get避免KeyError
+                if asset:
+                    histories[asset._index] = asset_data.get("history", [])
+            store.load_records(histories)
+            # 从历史记录中恢复当前价格，没有历史的资产回到基础价格
+            _, latest = store.window(1)
+            engine.set_prices(np.where(store.counts > 0, latest[-1], engine.base_prices) if len(latest) else engine.base_prices)
+
+    def load_binary_records(self, archive, meta):
+        """从二进制存档恢复当前价格；价格历史登记为延迟加载"""
+        for prefix, lookup, engine, store in (("stock", self.stock_dict, self.stock_engine, self.stock_history),
+                                              ("bond", self.bond_dict, self.bond_engine, self.bond_history)):
+            # 存档中的列顺序映射到当前市场的行号（缺失的资产保持默认）
+            saved_codes = meta.get(f"{prefix}_codes", [])
+            pairs = [(col, lookup[code]._index) for col, code in enumerate(saved_codes) if code in lookup]
+            columns = np.array([col for col, _ in pairs], dtype=np.intp)
+            rows = np.array([row for _, row in pairs], dtype=np.intp)
+            prices = engine.base_prices.copy()
+            prices[rows] = archive[f"{prefix}_prices"][columns]
+            engine.set_prices(prices)
+            counts = np.zeros(len(engine), dtype=np.int64)
+            counts[rows] = archive[f"{prefix}_history_counts"][columns]
+            length = int(meta.get(f"{prefix}_history_length", 0)) if counts.any() else 0
+
+            def loader(prefix=prefix, columns=columns, rows=rows, counts=counts, n_assets=len(engine)):
+                days = archive[f"{prefix}_history_days"]
+                matrix = np.zeros((len(days), n_assets), dtype=np.float64)
+                matrix[:, rows] = archive[f"{prefix}_history_prices"][:, columns]
+                return days, matrix, counts
+            store.defer(length, counts, loader)
+
+    def load_tick_series(self, series):
+        """从SQLite存档的 {代码: [天, (日期, 价格)] 数组} 恢复价格历史和当前价格"""
+        for lookup, engine, store in ((self.stock_dict, self.stock_engine, self.stock_history),
+                                      (self.bond_dict, self.bond_engine, self.bond_history)):
+            known = [(lookup[code]._index, rows) for code, rows in series.items() if code in lookup and len(rows)]
+            axis = np.unique(np.concatenate([rows[:, 0] for _, rows in known])).astype(np.int64) if known else np.zeros(0, dtype=np.int64)
+            matrix = np.zeros((len(axis), len(engine)), dtype=np.float64)
+            counts = np.zeros(len(engine), dtype=np.int64)
+            for index, rows in known:
+                matrix[np.searchsorted(axis, rows[:, 0].astype(np.int64)), index] = rows[:, 1]
+                counts[index] = len(rows)  # 各资产的记录对齐到最后一天，记录数即行数
+            store.load_matrix(axis, matrix, counts)
+            engine.set_prices(np.where(store.counts > 0, matrix[-1], engine.base_prices) if len(axis) else engine.base_prices)
+
+    def apply_ticks(self, days, stock_rows, bond_rows):
+        """按日追加已知的价格行（用于日志重放），并把当前价格更新为最后一行"""
+        for day, stock_row, bond_row in zip(days, stock_rows, bond_rows):
+            self.stock_history.append(day, stock_row)
+            self.bond_history.append(day, bond_row)
+            self.sync_indicators()
+        if days:
+            self.stock_engine.set_prices(stock_rows[-1])
+            self.bond_engine.set_prices(bond_rows[-1])
+
+    def simulate_prices(self, stock_scales, bond_scales):
+        """按每天的波动系数批量生成未来的股票和债券价格矩阵 (天数, 资产数)，一次抽取全部随机冲击，不改变当前价格"""
+        paths = []
+        for engine, scales in ((self.stock_engine, stock_scales), (self.bond_engine, bond_scales)):
+            shocks = engine.draw_shocks(len(scales))
+            floors = engine.floors()
+            rows = np.empty((len(scales), len(engine)))
+            prices = engine.prices
+            for day, scale in enumerate(scales):
+                prices = rows[day] = step_prices(prices, shocks[day], engine.volatility, scale, floors, engine.clamp)
+            paths.append(rows)
+        return paths[0], paths[1]
+
+    def period_changes(self, assets, store, days):
+        """计算一组资产近days天的涨幅(%)，只包含历史数据足够的资产"""
+        _, window = store.window(days)
+        if len(window) < days or days <= 0:
+            return []
+        start, end = window[0], window[-1]
+        valid = (store.counts >= days) & (start > 0)
+        change = np.zeros(len(start))
+        np.divide((end - start) * 100, start, out=change, where=valid)
+        return [(assets[idx], float(change[idx])) for idx in np.flatnonzero(valid)]
+
     def update_stocks(self, season_mod, current_day):
         """更新股票价格（带波动限制和价格保护）"""
-        for stock in self.stocks:
-            # 计算基础波动
-            base_change = random.gauss(0, 1) * stock.volatility * season_mod
+        if self.sharded is not None:
+            # 各分片进程推进自己的资产并直接写入共享的价格历史
+            self.sharded.step(season_mod, current_day)
+        else:
+            # 一次性批量抽取所有股票的随机冲击，限幅、取整和价格保护都在数组上完成
+            self.stock_engine.step(season_mod)
+            # 维护价格历史（环形缓冲区，自动保留最近一年）
+            self.stock_history.append(current_day, self.stock_engine.prices)
+        if self.archive is not None:
+            self.archive.append("stocks", current_day, self.stock_engine.prices)  # 一年之前的价格保留在归档中
+        self.indicators["stocks"].sync()
 
-            # 限制波动幅度在±50%之间
-            clamped_change = max(min(base_change, 0.5), -0.5)
+    def update_bonds(self, season_mod, current_day):
+        # 债券价格波动（带价格保护），与股票共用向量化价格引擎
+        self.bond_engine.step(season_mod["bond_yield"])
+        self.bond_history.append(current_day, self.bond_engine.prices)
+        if self.archive is not None:
+            self.archive.append("bonds", current_day, self.bond_engine.prices)
+        self.indicators["bonds"].sync()
+
+    def sync_indicators(self):
+        """让股票和债券的滚动指标跟上价格历史"""
+        for indicators in self.indicators.values():
+            indicators.sync()
+
+    def screen_assets(self, kind, conditions=(), sort_by=DEFAULT_SCREEN_SORT, top=20, ascending=False):
+        """按滚动指标筛选一类资产，返回 ([(资产, {指标名: 值})], 满足条件的资产数)；指标包含排序列和各条件列"""
+        indicators = self.indicators[kind]
+        assets = self.stocks if kind == "stocks" else self.bonds
+        rows, matched = indicators.screen(conditions, sort_by, top, ascending)
+        names = list(dict.fromkeys([sort_by] + [name for name, _, _ in conditions]))
+        columns = {name: indicators.column(name)[rows].tolist() for name in names}
+        return [(assets[row], {name: columns[name][i] for name in names}) for i, row in enumerate(rows.tolist())], matched
+
+    def price_source(self, kind):
+        """长期价格数据源：有归档时是归档（不限天数），否则是内存中的一年窗口；两者都提供 window() 和 counts"""
+        if self.archive is not None:
+            return self.archive.groups[kind]
+        return self.stock_history if kind == "stocks" else self.bond_history
+
+# ========== 持仓估值 ==========
+class PortfolioValuation:
+    """按资产类别增量维护持仓市值和浮动盈亏：持仓变动时只改一行，价格变动后只重算一次，菜单刷新直接读缓存"""
+    KINDS = ("stocks", "bonds")
+
+    def __init__(self, market):
+        self.market = market
+        self._groups = {}
+        for kind, engine, lookup in (("stocks", market.stock_engine, market.stock_dict),
+                                     ("bonds", market.bond_engine, market.bond_dict)):
+            self._groups[kind] = {
+                "engine": engine,
+                "lookup": lookup,
+                "amounts": np.zeros(len(engine)),  # 与价格引擎行号对齐的持仓数量
+                "avg_prices": np.zeros(len(engine)),
+                "costs": np.zeros(len(engine)),    # 持仓成本 = 数量 × 平均成本价
+                "order": {},                       # 持仓代码 -> 行号（保持持仓字典的插入顺序）
+                "cost": 0.0,
+                "value": 0.0,
+                "version": None,                   # 已计入市值的价格版本
+                "breakdown": None,
+            }
 
-            # 计算新价格，确保是浮点数运算
-            new_price = stock.current_price * (1.0 + clamped_change)
-            new_price = float(int(new_price)) # 保持价格为整数元，但存储为浮点以便计算
+    def reload(self, player):
+        """按玩家持仓整体重建（读档、重放日志后调用）"""
+        for kind in self.KINDS:
+            group = self._groups[kind]
+            group["amounts"][:] = 0.0
+            group["avg_prices"][:] = 0.0
+            group["costs"][:] = 0.0
+            group["cost"] = 0.0
+            group["order"] = {}
+            for code, holding in player[kind].items():
+                self.update(kind, code, holding)
+
+    def update(self, kind, code, holding):
+        """同步单个持仓(Holding)的变动；holding为None表示已清仓"""
+        group = self._groups[kind]
+        asset = group["lookup"].get(code)
+        if asset is None:
+            return
+        idx = asset._index
+        amount, avg_price = (holding.amount, holding.avg_price) if holding else (0.0, 0.0)
+        group["cost"] += amount * avg_price - group["costs"][idx]
+        group["amounts"][idx] = amount
+        group["avg_prices"][idx] = avg_price
+        group["costs"][idx] = amount * avg_price
+        if amount > 0:
+            group["order"][code] = idx
+        else:
+            group["order"].pop(code, None)
+        group["version"] = None  # 持仓变了，下次读取时重算市值
+        group["breakdown"] = None
+
+    def _refresh(self, kind):
+        """价格或持仓变动后重算该类别的市值（每次变动只算一次）"""
+        group = self._groups[kind]
+        engine = group["engine"]
+        if group["version"] != engine.version:
+            idx = self.held(kind)[0]
+            group["value"] = float(engine.prices[idx] @ group["amounts"][idx])
+            group["version"] = engine.version
+            group["breakdown"] = None
+        return group
+
+    def held(self, kind):
+        """返回 (持仓行号数组, 数量数组)，用于向量化估值"""
+        group = self._groups[kind]
+        idx = np.fromiter(group["order"].values(), dtype=np.intp, count=len(group["order"]))
+        return idx, group["amounts"][idx]
+
+    def value(self, kind=None):
+        """持仓市值；kind为None时返回股票和债券合计"""
+        if kind is None:
+            return sum(self.value(k) for k in self.KINDS)
+        return self._refresh(kind)["value"]
+
+    def profit_loss(self, kind=None):
+        """浮动盈亏（市值 - 持仓成本）"""
+        if kind is None:
+            return sum(self.profit_loss(k) for k in self.KINDS)
+        group = self._refresh(kind)
+        return group["value"] - group["cost"]
+
+    def breakdown(self, kind):
+        """各持仓市值拼接成的 "a+b+c" 字符串（缓存到价格或持仓下次变动）"""
+        group = self._refresh(kind)
+        if group["breakdown"] is None:
+            idx, amounts = self.held(kind)
+            values = group["engine"].prices[idx] * amounts
+            group["breakdown"] = '+'.join(f"{v:.2f}" for v in values.tolist()) if len(values) else '0.00'
+        return group["breakdown"]
+
+    def positions(self, kind):
+        """逐个持仓的 (代码, 资产, 数量, 平均成本, 当前价, 市值, 盈亏)，供持仓列表显示"""
+        group = self._groups[kind]
+        idx, amounts = self.held(kind)
+        prices = group["engine"].prices[idx]
+        values = prices * amounts
+        costs = group["costs"][idx]
+        avg_prices = group["avg_prices"][idx]
+        return [(code, group["lookup"][code], amount, avg_price, price, value, value - cost)
+                for code, amount, avg_price, price, value, cost in zip(
+                    group["order"], amounts.tolist(), avg_prices.tolist(), prices.tolist(), values.tolist(), costs.tolist())]
+
+# ========== 条件单 ==========
+# 条件单类型：(显示名称, 成交时执行的操作, 触发方向)；below 表示价格跌到触发价及以下时成交，above 表示涨到触发价及以上时成交
+ORDER_TYPES = {
+    "limit_buy": ("限价买入", "buy", "below"),
+    "limit_sell": ("限价卖出", "sell", "above"),
+    "stop_loss": ("止损卖出", "sell", "below"),
+    "take_profit": ("止盈卖出", "sell", "above"),
+    "limit_short": ("限价做空", "short", "above"),
+    "stop_cover": ("止损平空", "cover", "above"),
+    "take_profit_cover": ("止盈平空", "cover", "below"),
+}
+BOND_ORDER_TYPES = ("limit_buy", "limit_sell", "stop_loss", "take_profit")
+
+class Order:
+    """一笔挂单：价格触及触发价后按当日价格成交"""
+    __slots__ = ("id", "kind", "code", "type", "amount", "trigger", "day")
+
+    def __init__(self, id, kind, code, type, amount, trigger, day):
+        self.id = id
+        self.kind = kind        # "stocks" 或 "bonds"
+        self.code = code
+        self.type = type        # ORDER_TYPES 中的键
+        self.amount = amount
+        self.trigger = trigger  # 触发价格
+        self.day = day          # 挂单日
+
+    @property
+    def label(self):
+        return ORDER_TYPES[self.type][0]
+
+    @property
+    def action(self):
+        return ORDER_TYPES[self.type][1]
+
+    def to_record(self):
+        """转换为存档使用的字典"""
+        return {"id": self.id, "kind": self.kind, "code": self.code, "type": self.type,
+                "amount": self.amount, "trigger": self.trigger, "day": self.day}
+
+    @classmethod
+    def from_record(cls, data):
+        """从存档数据构造挂单，格式错误时返回None"""
+        try:
+            order = cls(int(data["id"]), data["kind"], data["code"], data["type"],
+                        float(data["amount"]), float(data["trigger"]), int(data.get("day", 0)))
+        except (KeyError, TypeError, ValueError):
+            return None
+        return order if order.type in ORDER_TYPES and order.kind in PortfolioValuation.KINDS else None
+
+class OrderBook:
+    """挂单簿：每个资产按触发方向各维护一个堆，堆顶触发价同步到数组中，价格更新后一次向量比较即可找出被触发的资产"""
+    def __init__(self, market):
+        self.orders = {}   # 挂单编号 -> (挂单, 资产行号)
+        self.next_id = 1
+        self._books = {}
+        for kind, lookup in (("stocks", market.stock_dict), ("bonds", market.bond_dict)):
+            n_assets = len(lookup)
+            self._books[kind] = {
+                "lookup": lookup,
+                # 堆元素为 (键, 编号)：below 堆以负触发价为键（最高触发价在堆顶），above 堆以触发价为键
+                "below": [[] for _ in range(n_assets)],
+                "above": [[] for _ in range(n_assets)],
+                "best_below": np.full(n_assets, -np.inf),  # 每个资产最先触发的 below 价格
+                "best_above": np.full(n_assets, np.inf),   # 每个资产最先触发的 above 价格
+            }
 
-            # 价格保护：不低于基准价的20%，确保是浮点数比较
-            price_floor = stock.base_price * 0.2
-            stock.current_price = max(new_price, price_floor)
+    def __len__(self):
+        return len(self.orders)
+
+    def __iter__(self):
+        """按挂单编号顺序遍历所有有效挂单"""
+        return iter(sorted((order for order, _ in self.orders.values()), key=lambda o: o.id))
+
+    def clear(self):
+        for order_id in list(self.orders):
+            self.cancel(order_id)
+        self.next_id = 1
+
+    def add(self, order):
+        """登记一笔挂单（编号由调用方或 place 分配）"""
+        book = self._books[order.kind]
+        idx = book["lookup"][order.code]._index
+        direction = ORDER_TYPES[order.type][2]
+        key = -order.trigger if direction == "below" else order.trigger
+        heapq.heappush(book[direction][idx], (key, order.id))
+        self.orders[order.id] = (order, idx)
+        self.next_id = max(self.next_id, order.id + 1)
+        self._refresh(book, idx)
+        return order
+
+    def place(self, kind, code, type, amount, trigger, day):
+        """新建挂单并分配编号"""
+        return self.add(Order(self.next_id, kind, code, type, amount, trigger, day))
+
+    def cancel(self, order_id):
+        """撤销挂单；堆中的元素延迟到浮到堆顶时再丢弃"""
+        entry = self.orders.pop(order_id, None)
+        if entry is None:
+            return None
+        order, idx = entry
+        self._refresh(self._books[order.kind], idx)
+        return order
+
+    def _refresh(self, book, idx):
+        """丢弃堆顶已撤销的挂单，并把堆顶触发价同步到数组"""
+        for direction, best, sign, empty in (("below", "best_below", -1.0, -np.inf), ("above", "best_above", 1.0, np.inf)):
+            heap = book[direction][idx]
+            while heap and heap[0][1] not in self.orders:
+                heapq.heappop(heap)
+            book[best][idx] = sign * heap[0][0] if heap else empty
+
+    def triggered(self, kind, prices):
+        """取出按当前价格被触发的挂单（按编号排序）；只访问被触发的资产和挂单"""
+        book = self._books[kind]
+        fired = []
+        hits = np.flatnonzero((prices <= book["best_below"]) | (prices >= book["best_above"]))
+        for idx in hits.tolist():
+            price = float(prices[idx])
+            for direction, bound in (("below", -price), ("above", price)):
+                heap = book[direction][idx]
+                while heap and heap[0][0] <= bound:
+                    _, order_id = heapq.heappop(heap)
+                    entry = self.orders.pop(order_id, None)
+                    if entry is not None:
+                        fired.append(entry[0])
+            self._refresh(book, idx)
+        fired.sort(key=lambda o: o.id)
+        return fired
+
+    def to_records(self):
+        return [order.to_record() for order in self]
+
+    def load_records(self, records):
+        """用存档中的挂单整体替换当前挂单簿，代码已不存在的挂单被丢弃"""
+        self.clear()
+        for record in records if isinstance(records, list) else []:
+            order = Order.from_record(record) if isinstance(record, dict) else None
+            if order is not None and order.code in self._books[order.kind]["lookup"]:
+                self.add(order)
+
+# ========== 批量订单 ==========
+STOCK_ORDER_ACTIONS = ("buy", "sell", "short", "cover")
+BOND_ORDER_ACTIONS = ("buy", "sell")
+
+def read_order_file(path):
+    """读取批量订单文件：CSV（表头 code,action,amount）或 JSON（订单列表或 {"orders": [...]}）"""
+    if path.lower().endswith('.json'):
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        orders = data.get("orders") if isinstance(data, dict) else data
+        if not isinstance(orders, list):
+            raise ValueError("JSON订单文件应为订单列表")
+        return orders
+    with open(path, 'r', newline='', encoding='utf-8-sig') as f:
+        return list(csv.DictReader(f))
+
+def print_batch_report(report):
+    """打印批量订单的逐笔成交/拒绝报告"""
+    print("行 | 代码 | 操作 | 数量 | 结果 | 成交价(元)/原因")
+    print("-" * 70)
+    for entry in report:
+        if entry["status"] == "filled":
+            print(f"{entry['line']} | {entry['code']} | {entry['action']} | {entry['amount']} | {Fore.GREEN}成交{Style.RESET_ALL} | {entry['price']:.2f}")
+        else:
+            print(f"{entry['line']} | {entry['code']} | {entry['action']} | {entry['amount']} | {Fore.RED}拒绝{Style.RESET_ALL} | {entry['reason']}")
+    filled = sum(1 for entry in report if entry["status"] == "filled")
+    print(f"\n共 {len(report)} 笔订单：成交 {filled} 笔，拒绝 {len(report) - filled} 笔")
+
+# ========== 情景模拟 ==========
+MONTE_CARLO_CHUNK = 500       # 每个任务模拟的路径数（固定大小，保证结果与进程数无关）
+MONTE_CARLO_BLOCK = 4_000_000 # 每次批量抽取的随机数上限（路径×资产×天）
+
+def _simulate_wealth_chunk(job):
+    """进程池任务：模拟一批独立的市场路径，返回每条路径期末的总资产
+
+    只需要模拟持有的资产：各资产的价格演化相互独立，未持有的资产不影响总资产。
+    随机冲击按 (路径 × 资产 × 天) 的块批量生成，再逐日做向量化演化。
+    """
+    seed, paths, horizon, start_day, cash, groups = job
+    rng = np.random.default_rng(seed)
+    season_system = SeasonSystem()
+    seasons = [season_system.current_season(start_day + offset + 1) for offset in range(horizon)]
+    states = [np.broadcast_to(g["prices"], (paths, len(g["prices"]))).copy() for g in groups]
+    for state, group in zip(states, groups):
+        n_assets = state.shape[1]
+        if n_assets == 0:
+            continue
+        block_days = max(1, min(horizon, MONTE_CARLO_BLOCK // (paths * n_assets)))
+        for block_start in range(0, horizon, block_days):
+            block_len = min(block_days, horizon - block_start)
+            shocks = rng.standard_normal((paths, n_assets, block_len))
+            for t in range(block_len):
+                season = seasons[block_start + t]
+                scale = season[group["season_key"]]
+                state[:] = step_prices(state, shocks[:, :, t], group["volatility"], scale, group["floors"], group["clamp"])
+    wealth = np.full(paths, cash, dtype=np.float64)
+    for state, group in zip(states, groups):
+        wealth += state @ group["amounts"]
+    return wealth
+
+def simulate_wealth_distribution(game, horizon=365, paths=10000, workers=None, seed=None):
+    """从当前存档状态出发模拟大量未来市场路径，统计期末总资产的分布"""
+    market = game.market
+    groups = []
+    for engine, kind, season_key in ((market.stock_engine, "stocks", "stock_vol"),
+                                     (market.bond_engine, "bonds", "bond_yield")):
+        idx, amounts = game.valuation.held(kind)
+        groups.append({
+            "prices": engine.prices[idx].copy(),
+            "volatility": engine.volatility[idx].copy(),
+            "floors": engine.floors()[idx],
+            "clamp": engine.clamp,
+            "amounts": amounts,
+            "season_key": season_key,
+        })
+    cash = game.player["cash"]
+    current = game.calculate_total_assets()
+
+    # 路径切分为固定大小的任务，每个任务一个独立随机流
+    chunk_sizes = [min(MONTE_CARLO_CHUNK, paths - start) for start in range(0, paths, MONTE_CARLO_CHUNK)]
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+    jobs = [(chunk_seed, size, horizon, game.day, cash, groups) for chunk_seed, size in zip(seeds, chunk_sizes)]
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(jobs) <= 1:
+        results = [_simulate_wealth_chunk(job) for job in jobs]
+    else:
+        with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+            results = list(pool.map(_simulate_wealth_chunk, jobs))
+    terminal = np.concatenate(results) if results else np.array([current])
+
+    percentiles = (5, 25, 50, 75, 95)
+    return {
+        "horizon": horizon,
+        "paths": int(len(terminal)),
+        "current": current,
+        "expected": float(terminal.mean()),
+        "std": float(terminal.std()),
+        "percentiles": dict(zip(percentiles, np.percentile(terminal, percentiles).tolist())),
+        "prob_loss": float(np.mean(terminal < current)),
+    }
+
+# ========== 策略回测 ==========
+class Strategy:
+    """回测策略接口：每个交易日价格更新后收到当日价格和当前持仓，返回订单列表
+
+    订单格式与批量订单文件相同：{"code": 代码, "action": buy/sell/short/cover, "amount": 数量}，
+    由 StockTycoon.execute_order_batch 按与手动交易相同的现金、保证金和土豪模式规则执行。
+    """
+    name = "空策略"
+
+    def __init__(self, **params):
+        self.params = params
+        self.market = None
+
+    def on_start(self, game):
+        """回测开始前调用，可在此读取市场信息"""
+        self.market = game.market
+
+    def on_day(self, day, prices, portfolio):
+        """prices 为 {"stocks": 股票价格数组, "bonds": 债券价格数组}（与 market.stocks/bonds 顺序一致），portfolio 为玩家数据"""
+        return []
+
+class BuyAndHoldStrategy(Strategy):
+    """第一天把一定比例的现金平均买入全部股票，之后一直持有"""
+    name = "买入持有"
+
+    def on_day(self, day, prices, portfolio):
+        if portfolio["stocks"]:
+            return []
+        budget = portfolio["cash"] * self.params.get("weight", 0.5) / len(self.market.stocks)
+        return [{"code": stock.code, "action": "buy", "amount": int(budget // price)}
+                for stock, price in zip(self.market.stocks, prices["stocks"].tolist()) if budget >= price]
+
+class MomentumStrategy(Strategy):
+    """每隔 rebalance 天持有近 lookback 天涨幅最大的 top 只股票，等权分配 weight 比例的资金"""
+    name = "动量"
+
+    def on_day(self, day, prices, portfolio):
+        lookback = self.params.get("lookback", 20)
+        top = self.params.get("top", 3)
+        if day % self.params.get("rebalance", 5):
+            return []
+        changes = self.market.period_changes(self.market.stocks, self.market.stock_history, lookback)
+        if not changes:
+            return []
+        changes.sort(key=lambda x: x[1], reverse=True)
+        targets = {stock.code for stock, change in changes[:top] if change > 0}
+        # 先卖出不在目标中的持仓，再买入新目标（批量校验时卖出所得可用于之后的买入）
+        orders = [{"code": code, "action": "sell", "amount": int(holding.amount)}
+                  for code, holding in portfolio["stocks"].items() if code not in targets]
+        budget = portfolio["cash"] * self.params.get("weight", 0.5) / top
+        for code in targets - set(portfolio["stocks"]):
+            amount = int(budget // self.market.stock_dict[code].current_price)
+            if amount > 0:
+                orders.append({"code": code, "action": "buy", "amount": amount})
+        return orders
+
+BACKTEST_STRATEGIES = {cls.__name__: cls for cls in (BuyAndHoldStrategy, MomentumStrategy)}
+
+def backtest_metrics(equity, traded_value):
+    """由逐日总资产曲线向量化计算收益率、夏普比率（按365天年化）、最大回撤和换手率"""
+    equity = np.asarray(equity, dtype=np.float64)
+    returns = np.diff(equity) / equity[:-1]
+    std = returns.std() if len(returns) > 1 else 0.0
+    peaks = np.maximum.accumulate(equity)
+    return {
+        "total_return": float(equity[-1] / equity[0] - 1.0),
+        "sharpe": float(returns.mean() / std * np.sqrt(365)) if std > 0 else 0.0,
+        "max_drawdown": float(np.max(1.0 - equity / peaks)),
+        "turnover": float(traded_value / equity.mean()),
+    }
+
+def run_backtest(strategy, days=365, seed=None, tycoon_mode=False):
+    """在不读写存档的内存游戏中运行策略days天：先批量生成整段价格路径，再逐日撮合策略订单"""
+    game = StockTycoon(None, background_save=False, seed=seed)
+    game.tycoon_mode = tycoon_mode
+    market = game.market
+    seasons = [game.season.current_season(game.day + offset + 1) for offset in range(days)]
+    stock_rows, bond_rows = market.simulate_prices([s["stock_vol"] for s in seasons], [s["bond_yield"] for s in seasons])
+    strategy.on_start(game)
+    equity = np.empty(days + 1)
+    equity[0] = game.calculate_total_assets()
+    rejected = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        for offset in range(days):
+            game.day += 1
+            market.set_day(game.day)
+            market.apply_ticks([game.day], stock_rows[offset:offset + 1], bond_rows[offset:offset + 1])
+            orders = strategy.on_day(game.day, {"stocks": market.stock_engine.prices, "bonds": market.bond_engine.prices}, game.player)
+            if orders:
+                report = game.execute_order_batch(orders)
+                rejected += sum(1 for entry in report if entry["status"] != "filled")
+            equity[offset + 1] = game.calculate_total_assets()
+    traded_value = game.ledger.turnover()
+    result = {"strategy": strategy.name, "params": strategy.params, "days": days,
+              "final_assets": float(equity[-1]), "trades": len(game.ledger), "rejected": rejected}
+    result.update(backtest_metrics(equity, traded_value))
+    return result
+
+def _run_backtest_job(job):
+    strategy_name, params, days, seed, tycoon_mode = job
+    return run_backtest(BACKTEST_STRATEGIES[strategy_name](**params), days, seed, tycoon_mode)
+
+def run_backtests(combos, days=365, seed=None, workers=None, tycoon_mode=False):
+    """并行回测多组 (策略类名, 参数)；所有组合使用同一个种子，即同一个市场和价格路径，结果可直接比较"""
+    if seed is None:
+        seed = int(np.random.SeedSequence().generate_state(1)[0])
+    jobs = [(name, params, days, seed, tycoon_mode) for name, params in combos]
+    workers = workers or os.cpu_count() or 1
+    if workers <= 1 or len(jobs) <= 1:
+        return [_run_backtest_job(job) for job in jobs]
+    with ProcessPoolExecutor(max_workers=min(workers, len(jobs))) as pool:
+        return list(pool.map(_run_backtest_job, jobs))
+
+def default_backtest_grid():
+    """内置的策略/参数组合"""
+    combos = [("BuyAndHoldStrategy", {})]
+    for lookback in (5, 10, 20, 40):
+        for top in (1, 3, 5):
+            combos.append(("MomentumStrategy", {"lookback": lookback, "top": top}))
+    return combos
+
+def print_backtest_results(results):
+    """按夏普比率排序打印回测结果"""
+    print("策略 | 参数 | 收益率 | 夏普比率 | 最大回撤 | 换手率 | 成交笔数")
+    print("-" * 90)
+    for result in sorted(results, key=lambda r: r["sharpe"], reverse=True):
+        params = ",".join(f"{key}={value}" for key, value in result["params"].items()) or "-"
+        color = Fore.GREEN if result["total_return"] > 0 else (Fore.RED if result["total_return"] < 0 else Style.RESET_ALL)
+        print(f"{result['strategy']} | {params} | {color}{result['total_return'] * 100:.2f}%{Style.RESET_ALL} | "
+              f"{result['sharpe']:.2f} | {result['max_drawdown'] * 100:.2f}% | {result['turnover']:.2f} | {result['trades']}")
+
+# ========== 存档日志 ==========
+class SaveJournal:
+    """追加写入的存档日志：每次交易或结算只追加一条紧凑记录，定期由完整快照压缩"""
+    def __init__(self, path):
+        self.path = path
+        self.seq = 0      # 最后一条记录的序号
+        self.records = 0  # 上次快照以来的记录数
+        self.has_snapshot = False  # 对应的完整快照是否已存在（或已提交写入）
+
+    def prepare(self, record):
+        """为记录分配序号并编码为一行紧凑JSON（实际写入由存档线程完成）"""
+        self.seq += 1
+        self.records += 1
+        record["seq"] = self.seq
+        return json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n"
+
+    def replay(self, after_seq):
+        """按顺序读出序号大于after_seq的记录；末尾写了一半的记录会被截掉，避免后续追加接在残行后面"""
+        self.seq = after_seq
+        self.records = 0
+        try:
+            with open(self.path, 'r+b') as f:
+                good_offset = 0
+                for line in f:
+                    try:
+                        record = json.loads(line.decode('utf-8')) if line.endswith(b"\n") else None
+                    except (UnicodeDecodeError, json.JSONDecodeError):
+                        record = None
+                    if not isinstance(record, dict) or not isinstance(record.get("seq"), int):
+                        f.truncate(good_offset)
+                        break
+                    good_offset += len(line)
+                    if record["seq"] <= after_seq:
+                        continue  # 已经包含在快照中的旧记录
+                    self.seq = record["seq"]
+                    self.records += 1
+                    yield record
+        except FileNotFoundError:
+            return
 
-            # 维护价格历史
-            stock.history.append({
-                "day": current_day,
-                "price": stock.current_price
-            })
-            if len(stock.history) > 365:  # 保留一年数据
-                stock.history.pop(0)
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+# ========== 后台存档 ==========
+def _fsync_path(path):
+    """把已写入的文件（或目录）同步到磁盘"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass  # 部分平台不支持对目录fsync
+    finally:
+        os.close(fd)
+
+def atomic_write(filepath, mode, write, fsync=False):
+    """先写临时文件再重命名替换，保证存档文件要么是旧版本要么是完整的新版本"""
+    tmp_path = filepath + '.tmp'
+    with open(tmp_path, mode) as f:
+        write(f)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, filepath)
+    if fsync:
+        _fsync_path(os.path.dirname(filepath) or '.')
+
+class BackgroundSaver:
+    """后台存档线程：界面线程只提交不可变的状态快照，连续的存档请求合并后一次写入磁盘
+
+    fsync策略：always 每次写入都同步到磁盘；flush 只在退出/切换存档等显式flush时同步；never 从不同步。
+    存档摘要（存档旁的摘要文件和存档目录索引）只在写完整快照和flush时更新，平时的日志追加和SQLite事务不重写它们。
+    """
+    COALESCE_SECONDS = 0.05  # 收到请求后等待片刻，把突发的多次存档合并为一次写入
+    FSYNC_POLICIES = ("always", "flush", "never")
+
+    def __init__(self, fsync_policy="flush", threaded=True, catalog=None):
+        if fsync_policy not in self.FSYNC_POLICIES:
+            raise ValueError(f"未知的fsync策略：{fsync_policy}")
+        self.fsync_policy = fsync_policy
+        self.catalog = catalog  # 写入后需要更新的存档目录索引
+        self.threaded = threaded
+        self.error = None
+        self._jobs = []
+        self._busy = False
+        self._flush_requested = False
+        self._unsynced = set()  # flush策略下尚未同步到磁盘的文件
+        self._summaries = {}    # 存档路径 -> 尚未写出的最新摘要
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def submit(self, kind, save_path, payload, summary=None):
+        """提交存档任务：kind为"snapshot"/"sqlite"时payload是写快照/写数据库事务的函数，为"journal"时是日志行；summary用于更新存档目录"""
+        if not self.threaded:
+            try:
+                self._write_batch([(kind, save_path, payload, summary)], self.fsync_policy == "always")
+            except Exception as e:
+                self.error = e  # 与后台线程一致：错误留到下次保存或flush时报告
+            return
+        with self._cond:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="save-writer", daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+            self._jobs.append((kind, save_path, payload, summary))
+            self._cond.notify_all()
+
+    def flush(self):
+        """等待已提交的存档全部写完，并按策略同步到磁盘；返回写入过程中的错误（如果有）"""
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            while self._jobs or self._busy:
+                self._cond.wait()
+            self._flush_requested = False
+            try:
+                self._write_summaries(list(self._summaries))
+            except Exception as e:
+                self.error = e
+        if self.fsync_policy == "flush":
+            for path in self._unsynced:
+                _fsync_path(path)
+            self._unsynced.clear()
+        return self.pop_error()
+
+    def pop_error(self):
+        error, self.error = self.error, None
+        return error
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._jobs:
+                    self._cond.wait()
+                if not self._flush_requested:
+                    self._cond.wait(self.COALESCE_SECONDS)
+                jobs, self._jobs = self._jobs, []
+                self._busy = True
+            try:
+                self._write_batch(jobs, self.fsync_policy == "always")
+            except Exception as e:
+                self.error = e
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    def _write_batch(self, jobs, fsync):
+        """合并写入一批任务：每个存档只写最后一份快照，快照之后的日志行一次性追加"""
+        last_snapshot = {path: idx for idx, (kind, path, _, _) in enumerate(jobs) if kind == "snapshot"}
+        lines = {}
+        for idx, (kind, save_path, payload, summary) in enumerate(jobs):
+            if summary is not None:
+                self._summaries[save_path] = summary
+            if idx < last_snapshot.get(save_path, -1):
+                continue  # 已被之后的完整快照覆盖
+            if kind == "snapshot":
+                payload(fsync)
+                with open(save_path + '.journal', 'w', encoding='utf-8'):
+                    pass  # 快照已包含全部日志内容
+                lines.pop(save_path, None)
+                if not fsync:
+                    self._unsynced.add(save_path)
+            elif kind == "sqlite":
+                payload(fsync)  # 每个请求一个事务，按提交顺序写入
+                if not fsync:
+                    self._unsynced.add(save_path + '-wal')
+            else:
+                lines.setdefault(save_path, []).append(payload)
+        for save_path, chunk in lines.items():
+            journal_path = save_path + '.journal'
+            with open(journal_path, 'a', encoding='utf-8') as f:
+                f.write(''.join(chunk))
+                if fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            if not fsync:
+                self._unsynced.add(journal_path)
+        self._write_summaries(last_snapshot)
+
+    def _write_summaries(self, paths):
+        """写出这些存档的待写摘要：摘要文件附带写入时存档的签名，并更新存档目录索引"""
+        summaries = {path: self._summaries.pop(path) for path in paths if path in self._summaries}
+        for save_path, summary in summaries.items():
+            # 摘要同时写在存档旁，存档目录索引过期时直接读取，不必解析存档
+            summary = dict(summary, signature=save_signature(save_path))
+            atomic_write(save_path + SAVE_SUMMARY_SUFFIX, 'w', lambda f: json.dump(summary, f, ensure_ascii=False))
+        if self.catalog is not None and summaries:
+            self.catalog.update({os.path.basename(path): summary for path, summary in summaries.items()})
+
+# ========== 二进制存档 ==========
+SAVE_EXTENSIONS = ('.json', '.npz', '.db')
+SAVE_CATALOG_FILENAME = 'catalog.json'
+SAVE_SUMMARY_SUFFIX = '.summary'  # 存档旁的摘要文件（天数、总资产、等级、土豪模式、格式）
+BINARY_SAVE_EXTENSION = '.npz'
+BINARY_SAVE_VERSION = 1
+TRADE_FIELDS = TradeLedger.FIELDS
+
+def list_save_files(directory='saves'):
+    """列出目录中的存档文件（JSON、二进制和SQLite格式，不含存档目录索引）"""
+    return sorted(f for f in os.listdir(directory) if f.endswith(SAVE_EXTENSIONS) and f != SAVE_CATALOG_FILENAME)
+
+def capture_binary_save(game):
+    """截取二进制存档所需的全部数组（均为副本，可交给后台线程写入）"""
+    market = game.market
+    meta = {
+        "version": BINARY_SAVE_VERSION,
+        "player": game.player_record(),
+        "day": game.day,
+        "tycoon_mode": game.tycoon_mode,
+        "journal_seq": game.journal.seq,
+        "stock_codes": [s.code for s in market.stocks],
+        "bond_codes": [b.code for b in market.bonds],
+        "orders": game.order_book.to_records(),
+        "universe": market.universe,
+        "shard_seed": market.shard_seed,
+    }
+    arrays = {}
+    for prefix, engine, store in (("stock", market.stock_engine, market.stock_history),
+                                  ("bond", market.bond_engine, market.bond_history)):
+        days, prices = store.window()
+        meta[f"{prefix}_history_length"] = len(days)
+        arrays[f"{prefix}_prices"] = engine.prices.copy()
+        arrays[f"{prefix}_history_days"] = days.copy()
+        arrays[f"{prefix}_history_prices"] = prices.copy()
+        arrays[f"{prefix}_history_counts"] = store.counts.copy()
+    arrays["total_assets_history"] = np.asarray(game.total_assets_history, dtype=np.float64)
+    arrays["stocks_bonds_value_history"] = np.asarray(game.stocks_bonds_value_history, dtype=np.float64)
+    for field in TRADE_FIELDS:
+        arrays[f"trade_{field}"] = game.ledger.column(field).copy()
+    arrays["meta"] = np.frombuffer(json.dumps(meta, ensure_ascii=False).encode('utf-8'), dtype=np.uint8)
+    return arrays
+
+def write_binary_save(filepath, arrays, fsync=False):
+    """把版本化的二进制存档写成 .npz 容器：价格历史和交易记录按列存为类型化数组"""
+    atomic_write(filepath, 'wb', lambda f: np.savez(f, **arrays), fsync)
+
+def read_binary_save(filepath):
+    """读取二进制存档：只解码玩家数据块和当前价格，价格历史留在容器中等到第一次访问再解码"""
+    archive = np.load(filepath, allow_pickle=False)
+    meta = json.loads(archive["meta"].tobytes().decode('utf-8'))
+    if meta.get("version") != BINARY_SAVE_VERSION:
+        raise ValueError(f"不支持的二进制存档版本：{meta.get('version')}")
+    # 交易账本按列读取；早期存档没有 pnl 列，由账本补齐
+    columns = {field: archive[f"trade_{field}"].tolist() for field in TRADE_FIELDS if f"trade_{field}" in archive.files}
+    return {
+        "player": meta.get("player", {}),
+        "day": meta.get("day", 0),
+        "tycoon_mode": meta.get("tycoon_mode", False),
+        "journal_seq": meta.get("journal_seq", 0),
+        "orders": meta.get("orders", []),
+        "universe": meta.get("universe"),
+        "shard_seed": meta.get("shard_seed"),
+        "trade_columns": columns,
+        "total_assets_history": archive["total_assets_history"].tolist(),
+        "stocks_bonds_value_history": archive["stocks_bonds_value_history"].tolist(),
+        "market_archive": (archive, meta),
+    }
+
+def migrate_json_saves(extension=BINARY_SAVE_EXTENSION, directory='saves'):
+    """一次性把JSON存档（连同其日志）迁移为二进制或SQLite存档，原文件保留为 .json.bak"""
+    migrated = []
+    for name in list_save_files(directory):
+        if not name.endswith('.json'):
+            continue
+        target = name[:-len('.json')] + extension
+        if os.path.exists(os.path.join(directory, target)):
+            print(f"{Fore.YELLOW}跳过 {name}：{target} 已存在{Style.RESET_ALL}")
+            continue
+        game = StockTycoon(name, background_save=False)  # 读取快照并重放日志
+        game.current_save = target
+        game.save_game(snapshot=True)
+        game.close_sqlite()
+        game.close_archive()
+        source = os.path.join(directory, name)
+        os.replace(source, source + '.bak')
+        SaveJournal(source + '.journal').remove()
+        if os.path.exists(source + SAVE_SUMMARY_SUFFIX):
+            os.remove(source + SAVE_SUMMARY_SUFFIX)
+        shutil.rmtree(source + ARCHIVE_SUFFIX, ignore_errors=True)  # 价格归档已随存档复制
+        migrated.append((name, target))
+    return migrated
+
+# ========== SQLite存档 ==========
+SQLITE_SAVE_EXTENSION = '.db'
+SQLITE_SCHEMA_VERSION = 1
+
+def remove_save_files(path):
+    """删除存档文件及其日志、SQLite的WAL和共享内存文件、摘要文件以及价格归档"""
+    for suffix in ('', '.journal', '-wal', '-shm', SAVE_SUMMARY_SUFFIX):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+    shutil.rmtree(path + ARCHIVE_SUFFIX, ignore_errors=True)
+
+class SqliteSave:
+    """SQLite存档（WAL模式）：玩家状态、持仓、逐资产价格和成交分表存放，每次保存在一个事务里只写入变化的行
+
+    价格按 (代码, 日期) 存放并保留全部历史，读档时只取最近 history_days 天装入内存，更早的价格按需查询。
+    连接只由存档线程写入；读档前会先等待存档线程写完。
+    """
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+        CREATE TABLE IF NOT EXISTS player (key TEXT PRIMARY KEY, value REAL NOT NULL);
+        CREATE TABLE IF NOT EXISTS positions (kind TEXT NOT NULL, code TEXT NOT NULL, amount REAL NOT NULL,
+                                              price REAL NOT NULL, day INTEGER, PRIMARY KEY (kind, code)) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS ticks (code TEXT NOT NULL, day INTEGER NOT NULL, price REAL NOT NULL,
+                                          PRIMARY KEY (code, day)) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS daily (day INTEGER PRIMARY KEY, total_assets REAL NOT NULL, stocks_bonds_value REAL NOT NULL);
+        CREATE TABLE IF NOT EXISTS trades (id INTEGER PRIMARY KEY, day INTEGER NOT NULL, type TEXT NOT NULL, code TEXT NOT NULL,
+                                           action TEXT NOT NULL, amount REAL NOT NULL, price REAL NOT NULL, pnl REAL NOT NULL DEFAULT 0);
+        CREATE INDEX IF NOT EXISTS trades_code_day ON trades (code, day);
+        CREATE INDEX IF NOT EXISTS trades_day ON trades (day);
+    """
+    STATE_TABLES = ("meta", "player", "positions", "trades")  # 整体重写时清空的表；价格和每日资产只做覆盖写入，保留更早的历史
+
+    def __init__(self, path):
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(self.SCHEMA)
+        # 数据库中是否已有完整状态（相当于日志存档的 has_snapshot）
+        self.has_state = self.conn.execute("SELECT 1 FROM meta WHERE key = 'day'").fetchone() is not None
+
+    def close(self):
+        self.conn.close()
+
+    def write(self, record, stock_codes, bond_codes, full, fsync=False):
+        """在一个事务中写入一条变化记录（与存档日志格式相同）；full为True时先清空玩家状态，整体重写"""
+        self.conn.execute(f"PRAGMA synchronous={'FULL' if fsync else 'NORMAL'}")
+        with self.conn:
+            if full:
+                for table in self.STATE_TABLES:
+                    self.conn.execute(f"DELETE FROM {table}")
+            meta = {"version": SQLITE_SCHEMA_VERSION, "day": record["day"], "tycoon_mode": record["tycoon_mode"]}
+            for key in ("orders", "universe", "shard_seed"):
+                if key in record:
+                    meta[key] = record[key]
+            self.conn.executemany("INSERT OR REPLACE INTO meta VALUES (?, ?)",
+                                  [(key, json.dumps(value, ensure_ascii=False)) for key, value in meta.items()])
+            self.conn.executemany("INSERT OR REPLACE INTO player VALUES (?, ?)", list(record["player"].items()))
+            for kind, entries in record.get("positions", {}).items():
+                for code, value in entries.items():
+                    position = POSITION_TYPES[kind].from_record(value) if value is not None else None
+                    if position is None:
+                        self.conn.execute("DELETE FROM positions WHERE kind = ? AND code = ?", (kind, code))
+                    elif isinstance(position, ShortPosition):
+                        self.conn.execute("INSERT OR REPLACE INTO positions VALUES (?, ?, ?, ?, ?)",
+                                          (kind, code, position.amount, position.price, position.day))
+                    else:
+                        self.conn.execute("INSERT OR REPLACE INTO positions VALUES (?, ?, ?, ?, NULL)",
+                                          (kind, code, position.amount, position.avg_price))
+            self.conn.executemany("INSERT INTO trades (day, type, code, action, amount, price, pnl) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                  [tuple(trade.get(field, 0.0) for field in TradeLedger.FIELDS) for trade in record.get("trades", [])])
+            ticks = record.get("ticks")
+            if ticks:
+                for key, codes in (("stocks", stock_codes), ("bonds", bond_codes)):
+                    days = np.asarray(ticks.get(f"{key}_days", ticks["days"]), dtype=np.int64)
+                    rows = np.asarray(ticks[key], dtype=np.float64).reshape(len(days), len(codes))
+                    # 快照中记录数不足窗口长度的资产，窗口前部是空位，不写入
+                    counts = np.asarray(ticks.get(f"{key}_counts", [len(days)] * len(codes)))
+                    row_idx, col_idx = np.nonzero(counts[None, :] > np.arange(len(days) - 1, -1, -1)[:, None])
+                    self.conn.executemany("INSERT OR REPLACE INTO ticks VALUES (?, ?, ?)",
+                                          zip(np.asarray(codes)[col_idx].tolist(), days[row_idx].tolist(), rows[row_idx, col_idx].tolist()))
+                # 每日资产快照与最近的天数对齐
+                count = min(len(ticks["total_assets"]), len(ticks["stocks_bonds_value"]))
+                first = record["day"] - count + 1
+                self.conn.executemany("INSERT OR REPLACE INTO daily VALUES (?, ?, ?)",
+                                      [(first + idx, total, value) for idx, (total, value) in
+                                       enumerate(zip(ticks["total_assets"][-count:] if count else [],
+                                                     ticks["stocks_bonds_value"][-count:] if count else []))])
+        self.has_state = True
+
+    def read(self, history_days):
+        """读取完整状态，格式与JSON/二进制快照一致；价格只取最近history_days天。数据库为空时抛出FileNotFoundError"""
+        meta = {key: json.loads(value) for key, value in self.conn.execute("SELECT key, value FROM meta")}
+        if "day" not in meta:
+            raise FileNotFoundError(self.path)
+        day = int(meta["day"])
+        player = dict(self.conn.execute("SELECT key, value FROM player"))
+        for kind in POSITION_TYPES:
+            player[kind] = {}
+        for kind, code, amount, price, held_day in self.conn.execute("SELECT kind, code, amount, price, day FROM positions"):
+            if kind in POSITION_TYPES:
+                player[kind][code] = [amount, price, held_day] if kind == "shorts" else {"amount": amount, "avg_price": price}
+        trades = self.conn.execute("SELECT day, type, code, action, amount, price, pnl FROM trades ORDER BY id").fetchall()
+        daily = self.conn.execute("SELECT total_assets, stocks_bonds_value FROM daily WHERE day > ? ORDER BY day",
+                                  (day - history_days,)).fetchall()
+        # 逐个资产按主键区间读取，每个资产得到一个 [天, (日期, 价格)] 数组
+        ticks = {code: np.array(self.conn.execute("SELECT day, price FROM ticks WHERE code = ? AND day > ? ORDER BY day",
+                                                  (code, day - history_days)).fetchall(), dtype=np.float64).reshape(-1, 2)
+                 for (code,) in self.conn.execute("SELECT DISTINCT code FROM ticks").fetchall()}
+        return {
+            "player": player,
+            "day": day,
+            "tycoon_mode": bool(meta.get("tycoon_mode", False)),
+            "journal_seq": 0,
+            "orders": meta.get("orders", []),
+            "universe": meta.get("universe"),
+            "shard_seed": meta.get("shard_seed"),
+            "trade_columns": {field: list(column) for field, column in zip(TradeLedger.FIELDS, zip(*trades))},
+            "total_assets_history": [row[0] for row in daily],
+            "stocks_bonds_value_history": [row[1] for row in daily],
+            "market_ticks": ticks,
+        }
 
-    def update_bonds(self, season_mod, current_day):
-        for bond in self.bonds:
-            # 债券价格波动（带价格保护）
-            change = random.gauss(0, 0.05) * season_mod["bond_yield"]
-            new_price = bond.current_price * (1.0 + change) # 确保浮点数运算
-            new_price = float(int(new_price)) # 保持价格为整数元
-            bond.current_price = max(new_price, 5000.0) # 确保浮点数比较
-            # 维护价格历史
-            bond.history.append({
-                "day": current_day,
-                "price": bond.current_price
-            })
-            if len(bond.history) > 365:
-                bond.history.pop(0)
+    def price_history(self, code, start_day=None, end_day=None):
+        """按主键区间查询单个资产的价格历史（包括内存窗口之外的更早数据），返回 [(日期, 价格)]"""
+        return self.conn.execute("SELECT day, price FROM ticks WHERE code = ? AND day >= ? AND day <= ? ORDER BY day",
+                                 (code, start_day if start_day is not None else -2**62,
+                                  end_day if end_day is not None else 2**62)).fetchall()
+
+# ========== 价格归档 ==========
+ARCHIVE_SUFFIX = '.archive'
+ARCHIVE_VERSION = 1
+ARCHIVE_INITIAL_ROWS = 1024  # 归档文件初始容量（天），写满后容量翻倍
+# 走势图的分辨率（名称, 每行天数）：日K直接读原始价格，其余在归档中随每日价格增量聚合
+ROLLUP_RESOLUTIONS = (("日", 1), ("周", 7), ("月", 30), ("季度", 91), ("年", 365))
+
+def _map_rows(path, dtype, capacity, row_shape=()):
+    """把文件扩展到capacity行（稀疏文件，不实际占用磁盘）并返回可读写的内存映射"""
+    row_bytes = np.dtype(dtype).itemsize * int(np.prod(row_shape, dtype=np.int64))
+    with open(path, 'ab') as f:
+        if f.tell() < capacity * row_bytes:
+            f.truncate(capacity * row_bytes)
+    return np.memmap(path, dtype=dtype, mode='r+', shape=(capacity,) + tuple(row_shape))
+
+def rollup_ohlc(days, prices, span, first=None):
+    """把按天排列的价格矩阵[天, 资产]聚合为每span天一根K线，返回 (桶编号, [桶, 开高低收, 资产])
+
+    桶编号为 (日期-1)//span；first 是各资产第一条有效记录的行号，之前的空位不参与聚合。
+    """
+    days = np.asarray(days, dtype=np.int64)
+    prices = np.asarray(prices, dtype=np.float64)
+    if not len(days):
+        return np.zeros(0, dtype=np.int64), np.zeros((0, 4, prices.shape[1]))
+    ids = (days - 1) // span
+    starts = np.flatnonzero(np.r_[True, ids[1:] != ids[:-1]])
+    ends = np.r_[starts[1:], len(days)]
+    if first is not None and np.any(first > 0):
+        prices = np.where(np.arange(len(days))[:, None] >= first[None, :], prices, np.nan)
+    ohlc = np.empty((len(starts), 4, prices.shape[1]))
+    ohlc[:, 1] = np.fmax.reduceat(prices, starts, axis=0)
+    ohlc[:, 2] = np.fmin.reduceat(prices, starts, axis=0)
+    ohlc[:, 3] = prices[ends - 1]
+    if first is None:
+        ohlc[:, 0] = prices[starts]
+    else:
+        # 开盘价取各资产在桶内的第一条有效记录
+        open_rows = np.maximum(starts[:, None], first[None, :])
+        ohlc[:, 0] = np.where(open_rows < ends[:, None],
+                              prices[np.minimum(open_rows, len(days) - 1), np.arange(prices.shape[1])], np.nan)
+    return ids[starts], ohlc
+
+class OhlcRollup:
+    """一组资产每span天一根的K线[桶, 开高低收, 资产]，存为内存映射文件，随每日价格增量更新
+
+    桶编号列存的是编号+1，未使用的行为0（与日期列相同的约定）。
+    """
+    def __init__(self, directory, key, span, n_assets):
+        self.span = span
+        self.n_assets = n_assets
+        self.ids_path = os.path.join(directory, f"{key}.ohlc{span}.ids")
+        self.values_path = os.path.join(directory, f"{key}.ohlc{span}.values")
+        size = os.path.getsize(self.ids_path) if os.path.exists(self.ids_path) else 0
+        self._map(max(size // 8, ARCHIVE_INITIAL_ROWS // span + 1))
+        self.length = int(np.count_nonzero(self.ids))
+
+    def _map(self, capacity):
+        self.capacity = capacity
+        self.ids = _map_rows(self.ids_path, np.int64, capacity)
+        self.values = _map_rows(self.values_path, np.float64, capacity, (4, self.n_assets))
+
+    def _reserve(self, rows):
+        if self.length + rows > self.capacity:
+            self.flush()
+            self._map(max(self.capacity * 2, self.length + rows))
+
+    @property
+    def last_bucket(self):
+        return int(self.ids[self.length - 1]) - 1 if self.length else -1
+
+    def add(self, day, prices, gaps=False):
+        """把一天的价格并入所在的桶，O(资产数)；gaps为True时价格中可能有空位(NaN)"""
+        bucket = (day - 1) // self.span
+        if bucket == self.last_bucket:
+            row = self.values[self.length - 1]
+            np.fmax(row[1], prices, out=row[1])
+            np.fmin(row[2], prices, out=row[2])
+            row[3] = prices
+            if gaps:
+                np.copyto(row[0], prices, where=np.isnan(row[0]))  # 桶内才出现第一条记录的资产
+        else:
+            self._reserve(1)
+            self.values[self.length] = prices
+            self.ids[self.length] = bucket + 1
+            self.length += 1
+
+    def truncate(self, bucket):
+        """丢弃编号不小于bucket的桶"""
+        length = int(np.searchsorted(self.ids[:self.length], bucket + 1, side='left'))
+        self.ids[length:self.length] = 0
+        self.length = length
+
+    def extend(self, ids, values):
+        self._reserve(len(ids))
+        self.ids[self.length:self.length + len(ids)] = ids + 1
+        self.values[self.length:self.length + len(ids)] = values
+        self.length += len(ids)
+
+    def read(self, index, start_day, end_day):
+        """返回单个资产覆盖 [start_day, end_day] 的各桶 (起始日期, [桶, 开高低收])，K线为零拷贝视图"""
+        ids = self.ids[:self.length]
+        lo = int(np.searchsorted(ids, (start_day - 1) // self.span + 1, side='left'))
+        hi = int(np.searchsorted(ids, (end_day - 1) // self.span + 1, side='right'))
+        return (ids[lo:hi] - 1) * self.span + 1, self.values[lo:hi, :, index]
+
+    def flush(self):
+        self.ids.flush()
+        self.values.flush()
+
+class ArchiveGroup:
+    """一组资产（股票或债券）的长期价格归档：日期列和价格矩阵[天, 资产]各是一个内存映射文件
+
+    未使用的行日期为0，因此记录数可以直接从日期列得到，不需要另外保存；
+    first 是各资产第一条有效记录所在的行（归档建立时历史不足一年的资产前面是空位）。
+    每种分辨率的K线（rollups）随每日价格增量聚合。
+    """
+    def __init__(self, directory, key, n_assets, first):
+        self.days_path = os.path.join(directory, f"{key}.days")
+        self.prices_path = os.path.join(directory, f"{key}.prices")
+        self.n_assets = n_assets
+        self.first = np.asarray(first, dtype=np.int64)
+        self._gap_rows = int(self.first.max()) if len(self.first) else 0  # 这之前的行中有空位
+        size = os.path.getsize(self.days_path) if os.path.exists(self.days_path) else 0
+        self._map(max(size // 8, ARCHIVE_INITIAL_ROWS))
+        self.length = int(np.count_nonzero(self.days))
+        self.rollups = {span: OhlcRollup(directory, key, span, n_assets) for _, span in ROLLUP_RESOLUTIONS if span > 1}
+
+    def _map(self, capacity):
+        self.capacity = capacity
+        self.days = _map_rows(self.days_path, np.int64, capacity)
+        self.prices = _map_rows(self.prices_path, np.float64, capacity, (self.n_assets,))
+
+    def append(self, day, prices):
+        """追加一天所有资产的价格（一次连续的行写入），并并入各分辨率的K线"""
+        if self.length == self.capacity:
+            self.flush()
+            self._map(self.capacity * 2)
+        self.prices[self.length] = prices
+        self.days[self.length] = day
+        if self.length < self._gap_rows:
+            prices = np.where(self.length >= self.first, prices, np.nan)
+        for rollup in self.rollups.values():
+            rollup.add(day, prices, self._gap_rows > 0)
+        self.length += 1
+
+    def truncate(self, day):
+        """丢弃日期晚于day的记录（读档回到较早的进度时），并让K线与原始价格一致"""
+        length = int(np.searchsorted(self.days[:self.length], day, side='right'))
+        self.days[length:self.length] = 0
+        self.length = length
+        self._sync_rollups()
+
+    def _sync_rollups(self):
+        """从原始价格重新聚合最后一个（可能不完整的）桶之后的K线；K线文件缺失时整体重建"""
+        for span, rollup in self.rollups.items():
+            last_raw = (self.last_day - 1) // span if self.length else -1
+            bucket = min(rollup.last_bucket, last_raw) if rollup.length else 0
+            rollup.truncate(bucket)
+            lo = int(np.searchsorted(self.days[:self.length], bucket * span + 1, side='left'))
+            if lo < self.length:
+                ids, values = rollup_ohlc(self.days[lo:self.length], self.prices[lo:self.length], span,
+                                          np.maximum(self.first - lo, 0))
+                rollup.extend(ids, values)
+
+    @property
+    def last_day(self):
+        return int(self.days[self.length - 1]) if self.length else 0
+
+    @property
+    def counts(self):
+        """每个资产的有效记录数（与 PriceHistory.counts 含义相同）"""
+        return np.maximum(self.length - self.first, 0)
+
+    def window(self, n=None):
+        """返回最近n天的 (日期, 价格矩阵[天, 资产]) 零拷贝视图"""
+        n = self.length if n is None else max(0, min(int(n), self.length))
+        return self.days[self.length - n:self.length], self.prices[self.length - n:self.length]
+
+    def series(self, index, start_day=None, end_day=None):
+        """返回单个资产在 [start_day, end_day] 内的 (日期, 价格) 零拷贝视图"""
+        days = self.days[:self.length]
+        lo = int(np.searchsorted(days, start_day, side='left')) if start_day is not None else 0
+        hi = int(np.searchsorted(days, end_day, side='right')) if end_day is not None else self.length
+        lo = max(lo, int(self.first[index]))
+        hi = max(hi, lo)
+        return self.days[lo:hi], self.prices[lo:hi, index]
+
+    def flush(self):
+        self.days.flush()
+        self.prices.flush()
+        for rollup in self.rollups.values():
+            rollup.flush()
+
+class PriceArchive:
+    """存档旁的多年价格归档（<存档名>.archive/ 目录）：每日价格在推进时追加，不随内存中的一年窗口丢弃，也不写入存档文件
+
+    打开时与内存中的市场对齐：丢弃晚于当前天数的记录，归档落后于当前天数时才从价格窗口补上缺少的天数；股票池变化时重建。
+    玩家每天的 [总资产, 股票+债券市值] 作为两列的 "assets" 组一并归档。
+    """
+    GROUPS = ("stocks", "bonds")
+
+    def __init__(self, path, market, day, daily_assets=()):
+        self.path = path
+        stores = {"stocks": market.stock_history, "bonds": market.bond_history}
+        codes = {"stocks": [s.code for s in market.stocks], "bonds": [b.code for b in market.bonds]}
+        meta_path = os.path.join(path, 'meta.json')
+        try:
+            with open(meta_path, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            meta = None
+        if not isinstance(meta, dict) or meta.get("version") != ARCHIVE_VERSION or meta.get("codes") != codes:
+            # 新建归档：内存窗口中记录不足的资产，其第一条记录所在的行
+            shutil.rmtree(path, ignore_errors=True)
+            os.makedirs(path)
+            first = {key: (store.length - np.minimum(store.counts, store.length)).tolist() for key, store in stores.items()}
+            meta = {"version": ARCHIVE_VERSION, "codes": codes, "first": first}
+            atomic_write(meta_path, 'w', lambda f: json.dump(meta, f, ensure_ascii=False))
+        self.groups = {key: ArchiveGroup(path, key, len(codes[key]), meta["first"][key]) for key in self.GROUPS}
+        for key, group in self.groups.items():
+            group.truncate(day)
+            if group.last_day >= day or not stores[key].length:
+                continue  # 归档已覆盖到当前天，不读取价格窗口（二进制存档的历史保持延迟加载）
+            days, prices = stores[key].window()
+            for idx in np.flatnonzero(days > group.last_day).tolist():
+                group.append(int(days[idx]), prices[idx])
+        # 每日资产：daily_assets 为内存中的 (总资产历史, 股票+债券市值历史)，最后一项是当天
+        self.assets = self.groups["assets"] = ArchiveGroup(path, "assets", 2, [0, 0])
+        self.assets.truncate(day)
+        totals, values = daily_assets or ([], [])
+        for offset in range(min(len(totals), len(values), max(0, day - self.assets.last_day)), 0, -1):
+            self.assets.append(day - offset + 1, np.array([totals[-offset], values[-offset]], dtype=np.float64))
+
+    def append(self, key, day, prices):
+        self.groups[key].append(day, prices)
+
+    def flush(self):
+        """把已追加的价格同步到文件（随存档调用）"""
+        for group in self.groups.values():
+            group.flush()
+
+# ========== 存档目录 ==========
+class SaveCatalog:
+    """存档目录索引：saves/catalog.json 记录每个存档的摘要，选择存档时无需解析完整存档文件
+
+    每个条目附带存档和日志文件的(修改时间, 大小)签名；签名不一致说明条目已过期，会重新解析该存档。
+    """
+    FILENAME = SAVE_CATALOG_FILENAME
+    VERSION = 1
+    SORT_KEYS = {
+        "name": lambda item: item[0],
+        "day": lambda item: item[1].get("day", 0),
+        "assets": lambda item: item[1].get("total_assets", 0.0),
+        "level": lambda item: item[1].get("level", 1),
+        "modified": lambda item: item[1].get("modified", 0.0),
+    }
+
+    def __init__(self, directory='saves'):
+        self.directory = directory
+        self.path = os.path.join(directory, self.FILENAME)
+        self._lock = threading.Lock()
+
+    def _read(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get("version") == self.VERSION and isinstance(data.get("saves"), dict):
+                return data["saves"]
+        except (FileNotFoundError, json.JSONDecodeError, AttributeError):
+            pass
+        return {}
+
+    def _write(self, saves):
+        payload = {"version": self.VERSION, "saves": saves}
+        atomic_write(self.path, 'w', lambda f: json.dump(payload, f, ensure_ascii=False, indent=1))
+
+    def signature(self, name):
+        return save_signature(os.path.join(self.directory, name))
+
+    def update(self, summaries):
+        """写入存档后更新对应条目：summaries 为 {存档名: 摘要}"""
+        with self._lock:
+            saves = self._read()
+            for name, summary in summaries.items():
+                signature = self.signature(name)
+                saves[name] = dict(summary, signature=signature, modified=max(signature[0], signature[2]) / 1e9)
+            self._write(saves)
+
+    def entries(self, sort_key="modified", keyword=None, tycoon_only=False):
+        """返回 [(存档名, 摘要)]；缺失或过期的条目会重新解析存档补齐，已删除的存档会被移除"""
+        with self._lock:
+            saves = self._read()
+            names = list_save_files(self.directory) if os.path.isdir(self.directory) else []
+            changed = set(saves) - set(names)
+            for name in changed:
+                del saves[name]
+            for name in names:
+                entry = saves.get(name)
+                if entry is None or entry.get("signature") != self.signature(name):
+                    saves[name] = self._rebuild(name)
+                    changed.add(name)
+            if changed:
+                self._write(saves)
+        items = [(name, saves[name]) for name in names]
+        if keyword:
+            items = [item for item in items if keyword.lower() in item[0].lower()]
+        if tycoon_only:
+            items = [item for item in items if item[1].get("tycoon_mode")]
+        return sorted(items, key=self.SORT_KEYS[sort_key], reverse=(sort_key != "name"))
+
+    def _rebuild(self, name):
+        """重新读取单个存档的摘要（不构造游戏对象，也不打开价格归档）"""
+        signature = self.signature(name)
+        try:
+            summary = read_save_summary(os.path.join(self.directory, name))
+        except (OSError, ValueError, KeyError, sqlite3.Error):
+            summary = {"day": 0, "total_assets": 0.0, "level": 1, "tycoon_mode": False, "format": save_format(name)}  # 与读档失败时的默认值一致
+        return dict(summary, signature=signature, modified=max(signature[0], signature[2]) / 1e9)
+
+def save_format(name):
+    """存档格式名称（按扩展名）"""
+    if name.endswith(BINARY_SAVE_EXTENSION):
+        return "binary"
+    return "sqlite" if name.endswith(SQLITE_SAVE_EXTENSION) else "json"
+
+def save_signature(path):
+    """存档文件和日志文件（SQLite存档为WAL文件）的 [修改时间ns, 大小, 修改时间ns, 大小]"""
+    signature = []
+    for path in (path, path + ('-wal' if path.endswith(SQLITE_SAVE_EXTENSION) else '.journal')):
+        try:
+            stat = os.stat(path)
+            signature += [stat.st_mtime_ns, stat.st_size]
+        except FileNotFoundError:
+            signature += [0, 0]
+    return signature
+
+def read_save_summary(path):
+    """读取存档摘要：摘要文件记录的签名与存档一致时直接采用；否则（早期存档没有摘要文件，或摘要写出后存档又有变化）
+    只读快照的玩家数据和日志记录
+
+    这种情况下总资产取最后一天的每日资产快照。
+    """
+    try:
+        with open(path + SAVE_SUMMARY_SUFFIX, 'r', encoding='utf-8') as f:
+            summary = json.load(f)
+        if isinstance(summary, dict) and summary.pop("signature", None) == save_signature(path):
+            return summary
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+    if path.endswith(BINARY_SAVE_EXTENSION):
+        with np.load(path, allow_pickle=False) as archive:  # 只解码元数据和每日资产两个成员
+            data = json.loads(archive["meta"].tobytes().decode('utf-8'))
+            totals = archive["total_assets_history"].tolist()
+    elif path.endswith(SQLITE_SAVE_EXTENSION):
+        conn = sqlite3.connect(path)
+        try:
+            data = {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM meta")}
+            data["player"] = dict(conn.execute("SELECT key, value FROM player WHERE key = 'level'"))
+            totals = [row[0] for row in conn.execute("SELECT total_assets FROM daily ORDER BY day DESC LIMIT 1")]
+        finally:
+            conn.close()
+    else:
+        with open(path, 'r') as f:
+            data = json.load(f)
+        totals = data.get("total_assets_history", [])
+    summary = {"day": int(data.get("day", 0)), "total_assets": float(totals[-1]) if totals else 0.0,
+               "level": int(data.get("player", {}).get("level", 1)), "tycoon_mode": bool(data.get("tycoon_mode", False)),
+               "format": save_format(path)}
+    journal_path = path + '.journal'
+    if os.path.exists(journal_path):
+        # 只读扫描日志（不像读档那样截掉写了一半的末行，存档线程可能正在追加）
+        with open(journal_path, 'rb') as f:
+            records = []
+            for line in f:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    break
+        for record in records:
+            if not isinstance(record, dict) or not isinstance(record.get("seq"), int) or record["seq"] <= int(data.get("journal_seq", 0)):
+                continue
+            summary["day"] = int(record.get("day", summary["day"]))
+            summary["level"] = int(record.get("player", {}).get("level", summary["level"]))
+            summary["tycoon_mode"] = bool(record.get("tycoon_mode", summary["tycoon_mode"]))
+            if record.get("ticks", {}).get("total_assets"):
+                summary["total_assets"] = float(record["ticks"]["total_assets"][-1])
+    return summary
+
+def print_save_table(items):
+    """以表格列出存档及其摘要信息"""
+    print("序号 | 存档 | 天数 | 总资产(元) | 等级 | 土豪模式 | 最后修改")
+    print("-" * 80)
+    for idx, (name, entry) in enumerate(items):
+        modified = datetime.fromtimestamp(entry.get("modified", 0)).strftime("%Y-%m-%d %H:%M")
+        print(f"{idx+1}. {name} | {entry.get('day', 0)} | {entry.get('total_assets', 0.0):.2f} | "
+              f"{entry.get('level', 1)} | {'开启' if entry.get('tycoon_mode') else '关闭'} | {modified}")
+
+def browse_saves(catalog, extra_options):
+    """列出存档并支持排序/筛选，返回选中的存档名或 extra_options 中对应的值"""
+    sort_key, keyword, tycoon_only = "modified", None, False
+    while True:
+        items = catalog.entries(sort_key, keyword, tycoon_only)
+        print_save_table(items)
+        for key, (label, _) in extra_options.items():
+            print(f"{key}. {label}")
+        print("s. 排序  f. 筛选  r. 清除筛选")
+        choice = input("请输入选择: ").strip().lower()
+        if choice in extra_options:
+            return extra_options[choice][1]
+        if choice == 's':
+            keys = list(SaveCatalog.SORT_KEYS)
+            key_choice = input(f"排序字段（{'/'.join(keys)}）: ").strip().lower()
+            if key_choice in keys:
+                sort_key = key_choice
+            else:
+                print(f"{Fore.RED}无效的排序字段{Style.RESET_ALL}")
+        elif choice == 'f':
+            keyword = input("存档名包含（回车跳过）: ").strip() or None
+            tycoon_only = input("只显示土豪模式存档？(y/n): ").lower() == 'y'
+        elif choice == 'r':
+            keyword, tycoon_only = None, False
+        elif choice.isdigit() and 1 <= int(choice) <= len(items):
+            return items[int(choice) - 1][0]
+        else:
+            print("输入无效，请重新输入")
+
+# ========== 图表渲染 ==========
+CHART_CACHE_SIZE = 64  # 缓存的图表帧数
+
+class ChartCache:
+    """渲染好的整帧图表缓存，键包含资产、当天和终端宽度；超过容量时淘汰最久未用的帧"""
+    def __init__(self, size=CHART_CACHE_SIZE):
+        self.size = size
+        self._frames = {}  # dict保持插入顺序，命中时移到末尾即为LRU
+
+    def get(self, key):
+        frame = self._frames.pop(key, None)
+        if frame is not None:
+            self._frames[key] = frame
+        return frame
+
+    def put(self, key, frame):
+        self._frames.pop(key, None)
+        self._frames[key] = frame
+        while len(self._frames) > self.size:
+            del self._frames[next(iter(self._frames))]
+
+    def clear(self):
+        self._frames.clear()
+
+def bar_lengths(values, low, value_range, width, minimum=0):
+    """各行横条的长度（按数值在 [low, low+value_range] 中的相对位置）"""
+    return np.maximum(((np.asarray(values) - low) / value_range * width).astype(int), minimum).tolist()
+
+def bar_colors(values):
+    """各行横条的颜色：比上一行高为绿、低为红，持平和首行为默认色"""
+    change = np.sign(np.diff(np.asarray(values), prepend=values[0])).astype(int)
+    return np.array([Style.RESET_ALL, Fore.GREEN, Fore.RED], dtype=object)[change].tolist()  # -1 取到最后一个（红色）
+
+def legend_lines(subject, resolution="日"):
+    """走势图的图例说明"""
+    period = "当日" if resolution == "日" else f"当{resolution}"
+    return [f"\n{Fore.YELLOW}图例说明：{Style.RESET_ALL}",
+            f"{Fore.GREEN}███绿色：{period}{subject}上涨{Style.RESET_ALL}",
+            f"{Fore.RED}███红色：{period}{subject}下跌{Style.RESET_ALL}",
+            f"███白色：{period}{subject}无变化或首{resolution}",
+            f"柱状长度反映相对{subject}区间，非绝对涨跌幅",
+            "（注意：由于终端字符限制，图表精度有限）"]
+
+def write_frame(frame):
+    """整帧一次写入终端，避免逐行print在慢速终端和SSH上的闪烁和延迟"""
+    sys.stdout.write(frame)
+    sys.stdout.flush()
+
+# ========== 图表导出 ==========
+CHART_EXPORT_DIRECTORY = 'exports'         # 导出目录，每个存档一个子目录
+CHART_EXPORT_MANIFEST = 'manifest.json'    # 记录每张图表对应的历史签名，用于增量导出
+CHART_EXPORT_FONTS = ["Noto Sans CJK SC", "WenQuanYi Micro Hei", "SimHei", "Microsoft YaHei", "PingFang SC", "DejaVu Sans"]
+TOTAL_ASSETS_CHART = "total_assets"
+
+def history_signature(days, values):
+    """价格历史的签名（首日、末日、天数、数值校验和），签名不变的图表不需要重画"""
+    if not len(days):
+        return None
+    checksum = zlib.crc32(np.ascontiguousarray(values, dtype=np.float64).tobytes())
+    return [int(days[0]), int(days[-1]), len(days), checksum]
+
+@contextlib.contextmanager
+def matplotlib_fonts():
+    """优先使用常见的中文字体，都没有时回退到matplotlib自带的DejaVu Sans"""
+    import matplotlib
+    with matplotlib.rc_context({"font.sans-serif": CHART_EXPORT_FONTS, "axes.unicode_minus": False}):
+        yield
+
+def _render_chart_png(job):
+    """把一条历史序列画成PNG（在进程池的子进程中执行）
+
+    matplotlib只在导出时才导入，不拖慢游戏启动；使用无界面的Agg后端和面向对象接口，不依赖显示器，也不经过pyplot的全局状态。
+    """
+    import warnings
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    path, title, days, values, ylabel = job
+    with warnings.catch_warnings(), matplotlib_fonts():
+        warnings.simplefilter("ignore")  # 系统没有中文字体时只会缺字，不影响导出
+        figure = Figure(figsize=(10, 4), dpi=100)
+        FigureCanvasAgg(figure)
+        axes = figure.add_subplot()
+        axes.plot(days, values, linewidth=1, color="tab:blue")
+        axes.set_title(title)
+        axes.set_xlabel("天")
+        axes.set_ylabel(ylabel)
+        axes.grid(alpha=0.3)
+        figure.tight_layout()
+        atomic_write(path, 'wb', lambda f: figure.savefig(f, format="png"))
+    return path
 
 # ========== 核心游戏类 ==========
 class StockTycoon:
-    def __init__(self, save_name='default_save.json'):
-        self.current_save = save_name
+    JOURNAL_SNAPSHOT_INTERVAL = 200  # 每追加多少条日志记录做一次完整快照
+    TRADE_PAGE_SIZE = 30             # 交易历史每页显示的笔数
+
+    def __init__(self, save_name='default_save.json', background_save=True, fsync_policy="flush", seed=None, market=None, universe=None):
+        self.current_save = save_name  # 为None时是不读写存档的内存游戏（用于回测）
         self.player = {
             "cash": 10_000_000_000_000.0,
             "debt": 1_000_000_000_000.0,
@@ -172,14 +2569,25 @@ class StockTycoon:
             "exp": 0,    # 新增经验属性
             "exp_to_next_level": 100  # 升级所需经验
         }
-        self.market = FinancialMarket()
+        # universe 只决定新存档的股票池；已有存档按其中记录的规格重新生成
+        self.market = market if market is not None else FinancialMarket(seed, universe=universe)
+        self.valuation = PortfolioValuation(self.market)
+        self.order_book = OrderBook(self.market)
         self.season = SeasonSystem()
         self.day = 0
         self.total_assets_history = []
-        self.trade_history = []
+        self.ledger = TradeLedger()  # 全部成交（按代码和日期索引）
         self.stocks_bonds_value_history = []
         self.tycoon_mode = False
-        self.load_game()
+        self.journal = None
+        self.sqlite = None  # 当前SQLite存档的连接（只在使用 .db 存档时打开）
+        self.chart_cache = ChartCache()  # 当天已渲染的走势图，读档和进入下一天后自然失效
+        self.catalog = SaveCatalog('saves')
+        self.saver = BackgroundSaver(fsync_policy, threaded=background_save, catalog=self.catalog)
+        self._reset_pending_changes()
+        self.load_error = None  # 最近一次读档失败的原因；存档存在但无法读取时不为None
+        if save_name is not None:
+            self.load_game()
         self.market.set_day(self.day)
 
     def toggle_tycoon_mode(self):
@@ -196,176 +2604,405 @@ class StockTycoon:
         return True
 
     def load_game(self):
-        """根据当前存档名称加载游戏"""
+        """根据当前存档名称加载游戏：先读取最近的完整快照，再重放其后的日志记录"""
+        self.flush_saves()  # 确保读取前所有待写入的存档已落盘
+        self.close_archive()  # 重放日志时不能写入之前存档的归档
+        self.chart_cache.clear()  # 读入的存档可能与缓存的图表同一天
         filepath = os.path.join('saves', self.current_save)
+        self.load_error = None
+        # SQLite存档每次保存都直接写入数据库，没有日志
+        self.journal = None if filepath.endswith(SQLITE_SAVE_EXTENSION) else SaveJournal(filepath + '.journal')
         try:
-            with open(filepath, 'r') as f:
-                data = json.load(f)
-                # 加载基础数据
-                self.player["cash"] = float(data.get("player", {}).get("cash", self.player["cash"])) if isinstance(data.get("player", {}).get("cash", self.player["cash"]), (int, float)) else 0.0
-                self.player["debt"] = float(data.get("player", {}).get("debt", self.player["debt"])) if isinstance(data.get("player", {}).get("debt", self.player["debt"]), (int, float)) else 0.0
-                # 加载等级和经验
-                self.player["level"] = int(data.get("player", {}).get("level", 1))
-                self.player["exp"] = int(data.get("player", {}).get("exp", 0))
-                self.player["exp_to_next_level"] = int(data.get("player", {}).get("exp_to_next_level", 100))
-                # 持仓信息，确保是字典，并加载包含平均成本的数据结构
-                loaded_stocks = data.get("player", {}).get("stocks", {})
-                if isinstance(loaded_stocks, dict):
-                     # 确保加载的持仓数据格式正确
-                     self.player["stocks"] = {
-                         code: {"amount": float(h.get("amount", 0.0)), "avg_price": float(h.get("avg_price", 0.0))}
-                         for code, h in loaded_stocks.items() if isinstance(h, dict)
-                     }
-                else:
-                     self.player["stocks"] = {} # 如果加载数据格式错误，则初始化为空字典
-
-                loaded_bonds = data.get("player", {}).get("bonds", {})
-                if isinstance(loaded_bonds, dict):
-                     # 确保加载的持仓数据格式正确
-                     self.player["bonds"] = {
-                         code: {"amount": float(h.get("amount", 0.0)), "avg_price": float(h.get("avg_price", 0.0))}
-                         for code, h in loaded_bonds.items() if isinstance(h, dict)
-                     }
-                else:
-                    self.player["bonds"] = {} # 如果加载数据格式错误，则初始化为空字典
-
-
-                # 做空持仓 {代码: [数量(float), 借入价格(float), 借入天数(int)]}
-                loaded_shorts = data.get("player", {}).get("shorts", {})
-                if isinstance(loaded_shorts, dict):
-                     # 确保加载的做空数据格式正确
-                     self.player["shorts"] = {
-                         code: [float(d[0]) if len(d) > 0 and isinstance(d[0], (int, float)) else 0.0, # 数量
-                                float(d[1]) if len(d) > 1 and isinstance(d[1], (int, float)) else 0.0, # 借入价格
-                                int(d[2]) if len(d) > 2 and isinstance(d[2], (int, float)) else 0] # 借入天数
-                         for code, d in loaded_shorts.items() if isinstance(d, list) and len(d) >= 2
-                     }
-                else:
-                     self.player["shorts"] = {} # 如果加载数据格式错误，则初始化为空字典
-
-                self.day = int(data.get("day", 0))
-                # 确保加载的历史记录是列表
-                self.trade_history = data.get("trade_history", [])
-                if not isinstance(self.trade_history, list): self.trade_history = []
-
-                self.total_assets_history = data.get("total_assets_history", []) # 加载总资产历史
-                if not isinstance(self.total_assets_history, list): self.total_assets_history = []
-
-                # 加载股票+债券总价值历史
-                self.stocks_bonds_value_history = data.get("stocks_bonds_value_history", [])
-                if not isinstance(self.stocks_bonds_value_history, list): self.stocks_bonds_value_history = []
-
-
-                # 加载市场数据
-                market_data = data.get("market", {})
-                # 加载股票数据
-                # 需要先生成默认市场数据，再用存档覆盖历史记录等
-                # self.market = FinancialMarket() # 不在这里重新初始化市场
-                for stock_data in market_data.get("stocks", []):
-                    stock = self.market.stock_dict.get(stock_data.get("code")) # 使用.get避免KeyError
-                    if stock:
-                        # stock.base_price = float(stock_data.get("base_price", stock.base_price)) # 基础价格不应该从存档加载
-                        # 确保加载的历史和操作历史是列表
-                        stock.history = stock_data.get("history", [])
-                        if not isinstance(stock.history, list): stock.history = []
-                        stock.operation_history = stock_data.get("operations", [])
-                        if not isinstance(stock.operation_history, list): stock.operation_history = []
-
-                        # 从历史记录中恢复当前价格，确保是浮点数
-                        stock.current_price = float(stock.history[-1].get("price", stock.base_price)) if stock.history and isinstance(stock.history[-1], dict) and isinstance(stock.history[-1].get("price"), (int, float)) else float(stock.base_price)
-
-                # 加载债券数据
-                for bond_data in market_data.get("bonds", []):
-                    bond = self.market.bond_dict.get(bond_data.get("code")) # 使用.get避免KeyError
-                    if bond:
-                        # bond.price = float(bond_data.get("price", bond.price)) # 基础价格不应该从存档加载
-                         # 确保加载的历史和操作历史是列表
-                        bond.history = bond_data.get("history", [])
-                        if not isinstance(bond.history, list): bond.history = []
-                        bond.operation_history = bond_data.get("operations", [])
-                        if not isinstance(bond.operation_history, list): bond.operation_history = []
-
-                         # 从历史记录中恢复当前价格，确保是浮点数
-                        bond.current_price = float(bond.history[-1].get("price", bond.price)) if bond.history and isinstance(bond.history[-1], dict) and isinstance(bond.history[-1].get("price"), (int, float)) else float(bond.price)
-
-            print(f"{Fore.GREEN}存档加载成功！{Style.RESET_ALL}")
+            data = self._read_snapshot(filepath)
+            self._use_universe(data.get("universe"), data.get("shard_seed"))
+            # 加载基础数据
+            self.player["cash"] = float(data.get("player", {}).get("cash", self.player["cash"])) if isinstance(data.get("player", {}).get("cash", self.player["cash"]), (int, float)) else 0.0
+            self.player["debt"] = float(data.get("player", {}).get("debt", self.player["debt"])) if isinstance(data.get("player", {}).get("debt", self.player["debt"]), (int, float)) else 0.0
+            # 加载等级和经验
+            self.player["level"] = int(data.get("player", {}).get("level", 1))
+            self.player["exp"] = int(data.get("player", {}).get("exp", 0))
+            self.player["exp_to_next_level"] = int(data.get("player", {}).get("exp_to_next_level", 100))
+            # 持仓在此统一校验并转换为持仓对象，之后的交易和估值不再做类型检查
+            for kind in POSITION_TYPES:
+                self.player[kind] = load_positions(kind, data.get("player", {}).get(kind, {}))
+
+            self.day = int(data.get("day", 0))
+            self.tycoon_mode = bool(data.get("tycoon_mode", False))
+            # 交易账本：二进制存档按列装入，JSON存档逐条校验
+            if "trade_columns" in data:
+                self.ledger.load_columns(data["trade_columns"])
+            else:
+                trades = data.get("trade_history", [])
+                self.ledger.load_records(trades if isinstance(trades, list) else [])
+
+            self.total_assets_history = data.get("total_assets_history", []) # 加载总资产历史
+            if not isinstance(self.total_assets_history, list): self.total_assets_history = []
+
+            # 加载股票+债券总价值历史
+            self.stocks_bonds_value_history = data.get("stocks_bonds_value_history", [])
+            if not isinstance(self.stocks_bonds_value_history, list): self.stocks_bonds_value_history = []
+
+
+            # 加载市场数据
+            market_data = data.get("market", {})
+            # 需要先生成默认市场数据，再用存档覆盖历史记录等
+            # self.market = FinancialMarket() # 不在这里重新初始化市场
+            # stock.base_price = float(stock_data.get("base_price", stock.base_price)) # 基础价格不应该从存档加载
+            if "market_archive" in data:
+                self.market.load_binary_records(*data["market_archive"])
+            elif "market_ticks" in data:
+                self.market.load_tick_series(data["market_ticks"])
+            else:
+                self.market.load_market_records(market_data.get("stocks", []), market_data.get("bonds", []))
+            self.order_book.load_records(data.get("orders", []))
+            snapshot_seq = int(data.get("journal_seq", 0))
+
+            # 在快照之上重放之后追加的日志记录
+            replayed = 0
+            if self.journal is not None:
+                self.journal.has_snapshot = True
+                replayed = self._replay_journal(snapshot_seq)
+            self.market.set_day(self.day)
+            print(f"{Fore.GREEN}存档加载成功！{Style.RESET_ALL}" + (f"（重放 {replayed} 条日志）" if replayed else ""))
         except FileNotFoundError:
             print(f"新建存档 {self.current_save}，使用默认值开始游戏")
-        except json.JSONDecodeError:
-             print("存档文件损坏，使用默认值开始游戏")
+        except json.JSONDecodeError as e:
+            self.load_error = f"存档文件损坏：{e}"
+            print("存档文件损坏，使用默认值开始游戏")
         except Exception as e:
+            self.load_error = str(e)
             print(f"{Fore.RED}存档加载失败：{str(e)}{Style.RESET_ALL}")
+        self.valuation.reload(self.player)
+        self._reset_pending_changes()
+        if os.path.exists(filepath) and self.load_error is None:
+            self._attach_archive(filepath)  # 读档失败时不能用默认市场改写原存档的价格归档
+
+    def _use_universe(self, universe, shard_seed=None):
+        """存档记录的股票池规格与当前市场不同时，按存档的规格重新生成市场；并换用存档记录的分片种子（早期存档没有时沿用市场的种子）"""
+        universe = normalize_universe(universe)
+        sharded = self.market.sharded
+        current = self.market.universe
+        if universe is not None and current is not None:
+            current = {key: current.get(key) for key in universe}  # 早期存档的规格没有校验值，只比较其中记录了的字段
+        if universe != current:
+            self.market.stop_sharding()
+            self.market = FinancialMarket(universe=universe, history_days=self.market.HISTORY_DAYS)
+            self.valuation = PortfolioValuation(self.market)
+            self.order_book = OrderBook(self.market)
+        if shard_seed is not None:
+            self.market.shard_seed = int(shard_seed)
+        if sharded is not None and (self.market.sharded is None or self.market.sharded.seed != self.market.shard_seed):
+            self.market.start_sharding(sharded.workers)  # 沿用原来的进程数
+
+    def _read_snapshot(self, filepath):
+        """按扩展名读取存档快照（JSON、二进制或SQLite）"""
+        if filepath.endswith(BINARY_SAVE_EXTENSION):
+            return read_binary_save(filepath)
+        if filepath.endswith(SQLITE_SAVE_EXTENSION):
+            if not os.path.exists(filepath):
+                raise FileNotFoundError(filepath)  # 不为不存在的存档创建空数据库
+            return self._sqlite_store(filepath).read(self.market.HISTORY_DAYS)
+        with open(filepath, 'r') as f:
+            return json.load(f)
+
+    def _replay_journal(self, after_seq):
+        """按顺序把日志记录应用到刚加载的快照上，返回重放的记录数"""
+        replayed = 0
+        keep = self.market.HISTORY_DAYS
+        for record in self.journal.replay(after_seq):
+            self.player.update(record.get("player", {}))
+            for kind, entries in record.get("positions", {}).items():
+                for code, value in entries.items():
+                    position = POSITION_TYPES[kind].from_record(value)
+                    if position is None:
+                        self.player[kind].pop(code, None)
+                    else:
+                        self.player[kind][code] = position
+            self.ledger.extend(record.get("trades", []))
+            if "orders" in record:
+                self.order_book.load_records(record["orders"])
+            ticks = record.get("ticks")
+            if ticks:
+                self.market.apply_ticks(ticks["days"], ticks["stocks"], ticks["bonds"])
+                self.total_assets_history = (self.total_assets_history + ticks["total_assets"])[-keep:]
+                self.stocks_bonds_value_history = (self.stocks_bonds_value_history + ticks["stocks_bonds_value"])[-keep:]
+            self.day = int(record.get("day", self.day))
+            self.tycoon_mode = bool(record.get("tycoon_mode", self.tycoon_mode))
+            replayed += 1
+        return replayed
+
+    def save_game(self, snapshot=False):
+        """保存当前进度：平时只向日志追加本次变化，每隔一定条数或退出时写完整快照（由后台线程写盘）"""
+        if self.current_save is None:
+            self._reset_pending_changes()  # 内存游戏不落盘
+            return
+        filepath = os.path.join('saves', self.current_save)
+        try:
+            error = self.saver.pop_error()
+            if error:
+                print(f"{Fore.RED}上次存档保存失败：{str(error)}{Style.RESET_ALL}")
+            if not os.path.exists('saves'):
+                os.makedirs('saves')
+            self._attach_archive(filepath)
+            if filepath.endswith(SQLITE_SAVE_EXTENSION):
+                self._save_sqlite(filepath)
+                self._reset_pending_changes()
+                print("游戏进度已保存")
+                return
+            journal_path = filepath + '.journal'
+            if self.journal is None or self.journal.path != journal_path:
+                # 另存为/切换存档后换用新存档的日志，并先写一份完整快照
+                self.journal = SaveJournal(journal_path)
+            changes = None if snapshot else self._collect_changes()
+            if (changes is None or not self.journal.has_snapshot
+                    or self.journal.records >= self.JOURNAL_SNAPSHOT_INTERVAL):
+                self.saver.submit("snapshot", filepath, self._capture_snapshot(filepath), self.save_summary())
+                self.journal.has_snapshot = True
+                self.journal.records = 0
+            else:
+                self.saver.submit("journal", filepath, self.journal.prepare(changes), self.save_summary())
+            self._reset_pending_changes()
+            print("游戏进度已保存")
+        except Exception as e:
+             print(f"{Fore.RED}存档保存失败：{str(e)}{Style.RESET_ALL}")
+
+    def save_summary(self):
+        """存档目录中显示的摘要信息"""
+        return {
+            "day": self.day,
+            "total_assets": self.calculate_total_assets(),
+            "level": self.player["level"],
+            "tycoon_mode": self.tycoon_mode,
+            "format": save_format(self.current_save),
+        }
 
-    def save_game(self):
-        """保存到当前存档文件"""
-        data = {
-            "player": {
-                "cash": self.player["cash"],
-                "debt": self.player["debt"],
-                "stocks": self.player["stocks"],
-                "bonds": self.player["bonds"],
-                "shorts": self.player["shorts"],
-                "level": self.player["level"],  # 保存等级
-                "exp": self.player["exp"],      # 保存经验
-                "exp_to_next_level": self.player["exp_to_next_level"]  # 保存升级所需经验
+    def _sqlite_store(self, filepath):
+        """返回存档对应的SQLite连接，切换到其他数据库时关闭旧连接"""
+        if self.sqlite is None or self.sqlite.path != filepath:
+            self.close_sqlite()
+            self.sqlite = SqliteSave(filepath)
+        return self.sqlite
+
+    def close_sqlite(self):
+        """等待写入完成后关闭SQLite连接（删除存档、结束迁移时调用）"""
+        if self.sqlite is not None:
+            self.flush_saves()
+            self.sqlite.close()
+            self.sqlite = None
+
+    def price_ohlc(self, asset, max_rows, start_day=None, end_day=None):
+        """按能放下max_rows行的最细分辨率返回 (分辨率, 各行起始日期, [行, 开高低收])
+
+        有价格归档时直接读取预先聚合的K线，跨度再长读取的行数也不超过max_rows；否则从内存中的价格窗口临时聚合。
+        """
+        days, prices = self.price_history(asset, start_day, end_day)
+        if not len(days):
+            return ROLLUP_RESOLUTIONS[0][0], days, np.zeros((0, 4))
+        first_day, last_day = int(days[0]), int(days[-1])
+        for resolution, span in ROLLUP_RESOLUTIONS:
+            if (last_day - 1) // span - (first_day - 1) // span < max_rows:
+                break
+        if span == 1:
+            return resolution, days, np.repeat(np.asarray(prices)[:, None], 4, axis=1)
+        if self.market.archive is not None:
+            group = self.market.archive.groups["stocks" if isinstance(asset, Asset) else "bonds"]
+            starts, ohlc = group.rollups[span].read(asset._index, first_day, last_day)
+        else:
+            ids, values = rollup_ohlc(days, np.asarray(prices)[:, None], span)
+            starts, ohlc = ids * span + 1, values[:, :, 0]
+        return resolution, starts[-max_rows:], ohlc[-max_rows:]  # 年K线仍放不下时只显示最近的部分
+
+    def _attach_archive(self, filepath):
+        """打开存档旁的价格归档；另存为新存档时先复制原来的归档，保留更早的价格"""
+        path = filepath + ARCHIVE_SUFFIX
+        archive = self.market.archive
+        if archive is not None and archive.path == path:
+            return
+        if archive is not None and not os.path.exists(path):
+            archive.flush()
+            shutil.copytree(archive.path, path)
+        self.close_archive()
+        self.market.archive = PriceArchive(path, self.market, self.day,
+                                           (self.total_assets_history, self.stocks_bonds_value_history))
+
+    def close_archive(self):
+        """同步并断开价格归档（读档、删除和迁移存档前调用）"""
+        if self.market.archive is not None:
+            self.market.archive.flush()
+            self.market.archive = None
+
+    def asset_history(self, start_day=None, end_day=None):
+        """每日总资产在 [start_day, end_day] 内的 (日期数组, 总资产数组)
+
+        有价格归档时返回归档的零拷贝视图（多年记录）；否则取内存中的一年窗口，最后一项是当天。
+        """
+        if self.market.archive is not None:
+            return self.market.archive.assets.series(0, start_day, end_day)
+        totals = np.array([value for value in self.total_assets_history if isinstance(value, (int, float))], dtype=np.float64)
+        days = np.arange(self.day - len(totals) + 1, self.day + 1)
+        lo = int(np.searchsorted(days, start_day, side='left')) if start_day is not None else 0
+        hi = int(np.searchsorted(days, end_day, side='right')) if end_day is not None else len(days)
+        return days[lo:hi], totals[lo:hi]
+
+    def price_history(self, asset, start_day=None, end_day=None):
+        """资产在 [start_day, end_day] 内的 (日期数组, 价格数组)
+
+        有价格归档时返回归档的零拷贝视图（不限于最近一年）；SQLite存档查询数据库；否则取内存中的一年窗口。
+        """
+        if self.market.archive is not None:
+            return self.market.archive.groups["stocks" if isinstance(asset, Asset) else "bonds"].series(asset._index, start_day, end_day)
+        if self.sqlite is not None and self.sqlite.path == os.path.join('saves', self.current_save or ''):
+            self.flush_saves()  # 先让待写入的价格落盘
+            rows = np.array(self.sqlite.price_history(asset.code, start_day, end_day), dtype=np.float64).reshape(-1, 2)
+            return rows[:, 0].astype(np.int64), rows[:, 1]
+        days, prices = asset.history.last()
+        lo = int(np.searchsorted(days, start_day, side='left')) if start_day is not None else 0
+        hi = int(np.searchsorted(days, end_day, side='right')) if end_day is not None else len(days)
+        return days[lo:max(hi, lo)], prices[lo:max(hi, lo)]
+
+    def _save_sqlite(self, filepath):
+        """SQLite存档：只把自上次保存以来的变化作为一个事务写入；新数据库或无法增量表示时写入完整状态"""
+        reopened = self.sqlite is None or self.sqlite.path != filepath
+        store = self._sqlite_store(filepath)
+        changes = None if reopened or not store.has_state else self._collect_changes()
+        full = changes is None
+        if full:
+            changes = self._full_change_record()
+        stock_codes = [s.code for s in self.market.stocks]
+        bond_codes = [b.code for b in self.market.bonds]
+        self.saver.submit("sqlite", filepath, lambda fsync: store.write(changes, stock_codes, bond_codes, full, fsync),
+                          self.save_summary())
+
+    def _full_change_record(self):
+        """以日志记录的格式表示完整状态（全部持仓、成交和内存中的价格窗口），供SQLite存档整体写入"""
+        player = self.player_record()
+        record = {
+            "day": self.day,
+            "tycoon_mode": self.tycoon_mode,
+            "player": {key: player[key] for key in ("cash", "debt", "level", "exp", "exp_to_next_level")},
+            "positions": {kind: player[kind] for kind in POSITION_TYPES},
+            "trades": self.ledger.records(),
+            "orders": self.order_book.to_records(),
+            "universe": self.market.universe,
+            "shard_seed": self.market.shard_seed,
+            "ticks": {
+                "days": [],
+                "total_assets": list(self.total_assets_history),
+                "stocks_bonds_value": list(self.stocks_bonds_value_history),
             },
+        }
+        for key, store in (("stocks", self.market.stock_history), ("bonds", self.market.bond_history)):
+            days, prices = store.window()
+            record["ticks"][f"{key}_days"] = days.tolist()
+            record["ticks"][key] = prices.tolist()
+            record["ticks"][f"{key}_counts"] = store.counts.tolist()
+        return record
+
+    def flush_saves(self):
+        """等待后台存档全部写入磁盘（退出、读档、切换存档前调用）"""
+        error = self.saver.flush()
+        if error:
+            print(f"{Fore.RED}存档保存失败：{str(error)}{Style.RESET_ALL}")
+        # 归档是共享内存映射，写入后进程崩溃也不会丢失，只在这里按fsync策略同步到磁盘
+        if self.market.archive is not None and self.saver.fsync_policy != "never":
+            self.market.archive.flush()
+
+    def _capture_snapshot(self, filepath):
+        """在界面线程上截取不可变的完整状态，返回交给后台线程执行的写入函数"""
+        if filepath.endswith(BINARY_SAVE_EXTENSION):
+            arrays = capture_binary_save(self)
+            return lambda fsync: write_binary_save(filepath, arrays, fsync)
+        data = self._json_snapshot_data()
+        return lambda fsync: atomic_write(filepath, 'w', lambda f: json.dump(data, f, indent=2), fsync)
+
+    def _json_snapshot_data(self):
+        """JSON格式的完整快照数据（与当前状态不共享可变对象）"""
+        return {
+            "player": self.player_record(),
             "day": self.day,
-            "trade_history": self.trade_history,
-            "total_assets_history": self.total_assets_history, # 保存总资产历史
-            "stocks_bonds_value_history": self.stocks_bonds_value_history, # 保存股票+债券总价值历史
+            "tycoon_mode": self.tycoon_mode,
+            "journal_seq": self.journal.seq, # 快照已包含的最后一条日志序号
+            "orders": self.order_book.to_records(), # 未成交的条件单
+            "universe": self.market.universe, # 股票池规格，为None时是内置模板股票
+            "shard_seed": self.market.shard_seed, # 分片推进股票价格的随机种子
+            "trade_history": self.ledger.records(),
+            "total_assets_history": list(self.total_assets_history), # 保存总资产历史
+            "stocks_bonds_value_history": list(self.stocks_bonds_value_history), # 保存股票+债券总价值历史
             "market": {
                 "stocks": [{
                     "code": s.code,
                     "base_price": s.base_price,
                     "volatility": s.volatility, # 保存波动性和收益以便读档时完整恢复
                     "income": s.income,
-                    "history": s.history,
-                    "operations": s.operation_history
+                    "history": s.history.to_records()
                 } for s in self.market.stocks],
                 "bonds": [{
                     "code": b.code,
                     "price": b.price,
                     "yield_rate": b.yield_rate, # 保存收益率和期限以便读档时完整恢复
                     "duration": b.duration,
-                    "history": b.history,
-                    "operations": b.operation_history
+                    "history": b.history.to_records()
                 } for b in self.market.bonds]
             }
         }
-        filepath = os.path.join('saves', self.current_save)
-        try:
-            if not os.path.exists('saves'):
-                os.makedirs('saves')
-            with open(filepath, 'w') as f:
-                json.dump(data, f, indent=2)
-            print("游戏进度已保存")
-        except Exception as e:
-             print(f"{Fore.RED}存档保存失败：{str(e)}{Style.RESET_ALL}")
+
+    def player_record(self):
+        """玩家数据的存档形式（持仓对象转换为字典/列表，与当前状态不共享可变对象）"""
+        return {
+            "cash": self.player["cash"],
+            "debt": self.player["debt"],
+            "stocks": {code: h.to_record() for code, h in self.player["stocks"].items()},
+            "bonds": {code: h.to_record() for code, h in self.player["bonds"].items()},
+            "shorts": {code: p.to_record() for code, p in self.player["shorts"].items()},
+            "level": self.player["level"],  # 保存等级
+            "exp": self.player["exp"],      # 保存经验
+            "exp_to_next_level": self.player["exp_to_next_level"]  # 保存升级所需经验
+        }
+
+    def _reset_pending_changes(self):
+        """把当前内存状态标记为已保存"""
+        self._touched_positions = set()  # 自上次保存以来变动过的持仓 (类别, 代码)
+        self._orders_changed = False     # 自上次保存以来挂单簿是否有变化
+        self._persisted_trades = len(self.ledger)
+        self._persisted_day = self.day
+
+    def _collect_changes(self):
+        """收集自上次保存以来的变化作为一条日志记录；无法增量表示时返回None（改写完整快照）"""
+        new_days = self.day - self._persisted_day
+        if new_days < 0 or new_days > self.market.stock_history.capacity:
+            return None
+        record = {
+            "day": self.day,
+            "tycoon_mode": self.tycoon_mode,
+            "player": {key: self.player[key] for key in ("cash", "debt", "level", "exp", "exp_to_next_level")},
+        }
+        if self._touched_positions:
+            positions = {}
+            for kind, code in self._touched_positions:
+                position = self.player[kind].get(code)
+                positions.setdefault(kind, {})[code] = position.to_record() if position else None
+            record["positions"] = positions
+        if len(self.ledger) > self._persisted_trades:
+            record["trades"] = self.ledger.records(self._persisted_trades)
+        if self._orders_changed:
+            record["orders"] = self.order_book.to_records()  # 挂单数量很少，变化时整体记录
+        if new_days:
+            days, stock_rows = self.market.stock_history.window(new_days)
+            _, bond_rows = self.market.bond_history.window(new_days)
+            record["ticks"] = {
+                "days": days.tolist(),
+                "stocks": stock_rows.tolist(),
+                "bonds": bond_rows.tolist(),
+                "total_assets": self.total_assets_history[-new_days:],
+                "stocks_bonds_value": self.stocks_bonds_value_history[-new_days:],
+            }
+        return record
 
 
     def calculate_total_assets(self):
         """计算玩家总资产"""
-        # 确保从player字典获取的值是数字类型，默认为0.0
-        cash = self.player.get('cash')
-        total = float(cash) if isinstance(cash, (int, float)) else 0.0
-        # 计算股票价值
-        stocks_dict = self.player.get('stocks', {})
-        # 确保stocks_dict是字典类型，避免.items()错误
-        if isinstance(stocks_dict, dict):
-            for code, holding_data in stocks_dict.items():
-                if isinstance(holding_data, dict) and isinstance(holding_data.get("amount"), (int, float)):
-                    stock = self.market.stock_dict.get(code)
-                    if stock:
-                        total += float(stock.current_price) * float(holding_data["amount"])
-        # 计算债券价值
-        bonds_dict = self.player.get('bonds', {})
-        if isinstance(bonds_dict, dict):
-            for code, holding_data in bonds_dict.items():
-                if isinstance(holding_data, dict) and isinstance(holding_data.get("amount"), (int, float)):
-                    bond = self.market.bond_dict.get(code)
-                    if bond:
-                        total += float(bond.current_price) * float(holding_data["amount"])
-        return total
+        # 股票和债券市值由估值组件增量维护
+        return self.player['cash'] + self.valuation.value()
 
     def show_stock_market(self):
         """显示股票市场信息"""
@@ -375,11 +3012,12 @@ class StockTycoon:
         season = self.season.current_season(self.day)
         print(f"当前季节：{season['name']} (股票波动：{season['stock_vol']:.1f}x)")
         # 价格显示单位修正为元
-        print("代码 | 名称 | 当前价格(元) | 波动性")
-        print("-" * 40)
-        for stock in self.market.stocks:
-            price_yuan = stock.current_price
-            print(f"{stock.code} | {stock.name} | {price_yuan:.2f} | {stock.volatility:.2f}") # 格式化价格为2位小数
+        print("代码 | 名称 | 行业 | 当前价格(元) | 波动性")
+        print("-" * 50)
+        # 价格和波动性直接从引擎数组读取，整张表拼接后一次输出（大股票池时逐行print很慢）
+        engine = self.market.stock_engine
+        print("\n".join(f"{stock.code} | {stock.name} | {stock.sector or '-'} | {price:.2f} | {vol:.2f}" # 格式化价格为2位小数
+                        for stock, price, vol in zip(self.market.stocks, engine.prices.tolist(), engine.volatility.tolist())))
 
     def show_bond_market(self):
         """显示债券市场信息"""
@@ -403,51 +3041,7 @@ class StockTycoon:
         if not bond:
             print("无效的债券代码")
             return
-
-        try:
-            amount = int(input("请输入购买数量："))
-            if amount <= 0:
-                raise ValueError("数量必须大于0")
-            amount = float(amount)
-            # 验证土豪模式
-            if not self.validate_tycoon_purchase(amount):
-                return
-        except ValueError:
-            print("无效的数量")
-            return
-
-        total_cost = bond.current_price * amount
-        cash = self.player.get('cash')
-        current_cash = float(cash) if isinstance(cash, (int, float)) else 0.0
-        if total_cost > current_cash:
-            print("资金不足")
-            return
-
-        self.player['cash'] = current_cash - total_cost
-        bonds = self.player.get('bonds', {})
-        if not isinstance(bonds, dict):
-            bonds = {}
-
-        if code in bonds and isinstance(bonds[code], dict):
-            existing_amount = float(bonds[code].get("amount", 0.0))
-            existing_avg_price = float(bonds[code].get("avg_price", 0.0))
-            new_total_amount = existing_amount + amount
-            new_avg_price = ((existing_avg_price * existing_amount) + (bond.current_price * amount)) / new_total_amount if new_total_amount > 0 else 0.0
-            bonds[code] = {"amount": new_total_amount, "avg_price": new_avg_price}
-        else:
-            bonds[code] = {"amount": amount, "avg_price": bond.current_price}
-
-        self.player['bonds'] = bonds
-        print(f"成功购买 {int(amount)} 单位 {bond.name}")
-        bond.operation_history.append({
-            "day": self.day,
-            "action": "买入",
-            "amount": int(amount),
-            "price": bond.current_price
-        })
-        self.record_trade("债券", code, "买入", amount, bond.current_price)
-        self.add_exp(10)  # 购买债券增加10点经验
-        self.save_game()
+        self.buy_bonds_for_asset(bond, quick=False)
 
     def sell_bonds(self):
         """卖出债券功能"""
@@ -460,60 +3054,62 @@ class StockTycoon:
             return
 
         # 获取持仓信息
-        bonds = self.player.get("bonds", {})
-        if not isinstance(bonds, dict) or code not in bonds or not isinstance(bonds[code], dict) or "amount" not in bonds[code]:
-             print(f"{Fore.RED}错误：没有该债券持仓或数据异常{Style.RESET_ALL}")
-             return
-
-        holding_data = bonds[code]
-        current_amount = float(holding_data.get("amount", 0.0)) # 确保持仓数量是浮点数
-        avg_price = float(holding_data.get("avg_price", 0.0)) # 确保平均成本价是浮点数
-
-        if current_amount <= 0:
+        holding = self.player["bonds"].get(code)
+        if not holding:
             print(f"{Fore.RED}错误：没有该债券持仓{Style.RESET_ALL}")
             return
 
-        # 初始化 amount 变量
-        sell_amount = 0.0
-
         try:
-            sell_amount = int(input(f"请输入卖出数量（当前持仓：{int(current_amount)}）：")) # 数量显示为整数
-            if sell_amount <= 0 or sell_amount > current_amount:
-                raise ValueError
-            sell_amount = float(sell_amount) # 将卖出数量转换为浮点数
+            sell_amount = int(input(f"请输入卖出数量（当前持仓：{int(holding.amount)}）：")) # 数量显示为整数
+            if sell_amount <= 0 or sell_amount > holding.amount:
+                raise ValueError("无效或超过持仓数量")
+            self.execute_bond_order(bond, "sell", float(sell_amount))
         except ValueError as e:
             print(f"{Fore.RED}错误：{e}{Style.RESET_ALL}")
             return
+        self.save_game()
 
-        # 计算收益
-        total_income = bond.current_price * sell_amount
-        profit_loss = (bond.current_price - avg_price) * sell_amount # 计算盈亏
-        self.player["cash"] = float(self.player.get("cash", 0.0)) + total_income if isinstance(self.player.get("cash", 0.0), (int, float)) else total_income # 确保现金是浮点数
-
-        # 更新持仓
-        new_holding_amount = current_amount - sell_amount
-        if new_holding_amount <= 0.0: # 使用<=0.0处理浮点误差
-            del bonds[code]
+    def execute_bond_order(self, bond, action, amount, quick=False):
+        """按当前价格执行一笔债券交易（不含输入和存档），条件不满足时抛出ValueError，成功返回交易记录
+
+        quick为True时按快捷交易（筛选结果中直接购买）的经验规则：只有盈利的卖出获得经验。
+        """
+        code = bond.code
+        price = bond.current_price
+        if action == "buy":
+            total_cost = price * amount
+            if total_cost > self.player['cash']:
+                raise ValueError(f"资金不足，需要{total_cost:.2f}元")
+            self.player['cash'] -= total_cost
+            holding = self.player['bonds'].get(code)
+            if holding:
+                holding.add(amount, price)  # 加仓按数量加权平均成本
+            else:
+                self.player['bonds'][code] = Holding(amount, price)
+            print(f"成功购买 {int(amount)} 单位 {bond.name}")
+            operation, exp, pnl = "买入", 10, 0.0  # 购买债券增加10点经验
+        elif action == "sell":
+            holding = self.player["bonds"].get(code)
+            current_amount = holding.amount if holding else 0.0
+            if current_amount < amount:
+                raise ValueError(f"持仓不足，当前持有 {int(current_amount)} 单位")
+            # 计算收益
+            total_income = price * amount
+            profit_loss = (price - holding.avg_price) * amount # 计算盈亏
+            self.player["cash"] += total_income
+            # 更新持仓，只更新数量，平均成本价不变
+            holding.amount -= amount
+            if holding.amount <= 0.0: # 使用<=0.0处理浮点误差
+                del self.player["bonds"][code]
+            print(f"{Fore.GREEN}成功卖出 {int(amount)} 单位 {bond.name}，获得{total_income:.2f}元{Style.RESET_ALL}") # 数量显示为整数，格式化收益为2位小数
+            print(f"{Fore.GREEN}本次交易盈亏：{profit_loss:.2f}元{Style.RESET_ALL}") # 格式化盈亏为2位小数
+            operation, exp, pnl = "卖出", int(profit_loss / 1000), profit_loss  # 盈利每1000元增加1点经验
         else:
-            # 只更新数量，平均成本价不变
-            holding_data["amount"] = new_holding_amount
-            bonds[code] = holding_data # 更新剩余数量 (浮点)
+            raise ValueError(f"债券不支持的操作：{action}")
 
-        self.player["bonds"] = bonds
-
-        print(f"{Fore.GREEN}成功卖出 {int(sell_amount)} 单位 {bond.name}，获得{total_income:.2f}元{Style.RESET_ALL}") # 数量显示为整数，格式化收益为2位小数
-        print(f"{Fore.GREEN}本次交易盈亏：{profit_loss:.2f}元{Style.RESET_ALL}") # 格式化盈亏为2位小数
-
-        # 新增操作记录
-        bond.operation_history.append({
-            "day": self.day,
-            "action": "卖出",
-            "amount": int(sell_amount), # 操作记录数量保存为整数
-            "price": bond.current_price
-        })
-        self.record_trade("债券", code, "卖出", sell_amount, bond.current_price) # 交易记录数量保存为浮点数
-        self.add_exp(int(profit_loss / 1000))  # 盈利每1000元增加1点经验
-        self.save_game()
+        record = self.record_trade("债券", code, operation, amount, price, pnl) # 交易记录数量保存为浮点数
+        self._add_trade_exp(action, exp, quick)
+        return record
 
     def short_stock(self):
         """股票做空功能 (已整合到bulk_stock_trade)"""
@@ -526,164 +3122,120 @@ class StockTycoon:
     def show_portfolio(self):
         """显示玩家投资组合（增加做空仓位显示）"""
         print(f"{Fore.CYAN}=== 我的持仓 ==={Style.RESET_ALL}")
-        # 确保从player字典获取的值是数字类型，默认为0.0
-        cash = float(self.player.get('cash', 0.0)) if isinstance(self.player.get('cash', 0.0), (int, float)) else 0.0
-        debt = float(self.player.get('debt', 0.0)) if isinstance(self.player.get('debt', 0.0), (int, float)) else 0.0
+        cash = self.player['cash']
+        debt = self.player['debt']
 
         print(f"现金：{cash:.2f}元") # 格式化为2位小数
         print(f"债务：{debt:.2f}元") # 格式化为2位小数
 
-        total_stock_value = 0.0 # 确保总价值为浮点数
-        print("\n股票持仓：")
-        # 添加平均成本列
-        print("代码 | 名称 | 数量 | 平均成本(元) | 当前价(元) | 总价值(元) | 总盈亏(元)") # 添加盈亏列
-        print("-" * 90) # 调整分隔线长度
-        stocks = self.player.get('stocks', {})
-        if isinstance(stocks, dict):
-            # 确保items()返回字典视图
-            for code, holding_data in stocks.items():
-                stock = self.market.stock_dict.get(code)
-                # 确保holding_data是字典且包含必要键，数量和平均价格是数字
-                if stock and isinstance(holding_data, dict) and isinstance(holding_data.get("amount"), (int, float)) and isinstance(holding_data.get("avg_price"), (int, float)):
-                    amount = float(holding_data["amount"])
-                    avg_price = float(holding_data["avg_price"])
-                    current_price = float(stock.current_price)
-                    value = current_price * amount # 确保浮点数运算
-                    total_stock_value += value
-                    profit_loss = (current_price - avg_price) * amount # 计算总盈亏
-
-                    # 根据盈亏确定颜色
-                    color = Fore.GREEN if profit_loss > 0 else (Fore.RED if profit_loss < 0 else Style.RESET_ALL)
-
-                    print(f"{code} | {stock.name} | {int(amount)} | {avg_price:.2f} | {current_price:.2f} | {value:.2f} | {color}{profit_loss:.2f}{Style.RESET_ALL}") # 格式化并显示所有信息，数量显示为整数，盈亏带颜色
-                else:
-                    print(f"错误：股票持仓 {code} 数据异常")
-
-        # 检查stocks是否为空或非字典
-        if not stocks or not isinstance(stocks, dict) or not stocks:
-            print("(空)")
-
-        total_bond_value = 0.0 # 确保总价值为浮点数
-        print("\n债券持仓：")
-        print("代码 | 名称 | 数量 | 平均成本(元) | 当前价(元) | 总价值(元) | 总盈亏(元)") # 添加盈亏列
-        print("-" * 90) # 调整分隔线长度
-        bonds = self.player.get('bonds', {})
-        if isinstance(bonds, dict):
-             # 确保items()返回字典视图
-            for code, holding_data in bonds.items():
-                bond = self.market.bond_dict.get(code)
-                 # 确保holding_data是字典且包含必要键，数量和平均价格是数字
-                if bond and isinstance(holding_data, dict) and isinstance(holding_data.get("amount"), (int, float)) and isinstance(holding_data.get("avg_price"), (int, float)):
-                    amount = float(holding_data["amount"])
-                    avg_price = float(holding_data["avg_price"])
-                    current_price = float(bond.current_price)
-                    value = current_price * amount # 确保浮点数运算
-                    total_bond_value += value
-                    profit_loss = (current_price - avg_price) * amount # 计算总盈亏
-
-                    # 根据盈亏确定颜色
-                    color = Fore.GREEN if profit_loss > 0 else (Fore.RED if profit_loss < 0 else Style.RESET_ALL)
-
-                    print(f"{code} | {bond.name} | {int(amount)} | {avg_price:.2f} | {current_price:.2f} | {value:.2f} | {color}{profit_loss:.2f}{Style.RESET_ALL}") # 格式化并显示所有信息，数量显示为整数，盈亏带颜色
-                else:
-                    print(f"错误：债券持仓 {code} 数据异常")
-
-         # 检查bonds是否为空或非字典
-        if not bonds or not isinstance(bonds, dict) or not bonds:
-            print("(空)")
+        # 逐个持仓的市值和盈亏由估值组件一次性向量化算出
+        for kind, title in (("stocks", "股票持仓"), ("bonds", "债券持仓")):
+            print(f"\n{title}：")
+            # 添加平均成本列
+            print("代码 | 名称 | 数量 | 平均成本(元) | 当前价(元) | 总价值(元) | 总盈亏(元)") # 添加盈亏列
+            print("-" * 90) # 调整分隔线长度
+            positions = self.valuation.positions(kind)
+            for code, asset, amount, avg_price, current_price, value, profit_loss in positions:
+                # 根据盈亏确定颜色
+                color = Fore.GREEN if profit_loss > 0 else (Fore.RED if profit_loss < 0 else Style.RESET_ALL)
+                print(f"{code} | {asset.name} | {int(amount)} | {avg_price:.2f} | {current_price:.2f} | {value:.2f} | {color}{profit_loss:.2f}{Style.RESET_ALL}") # 格式化并显示所有信息，数量显示为整数，盈亏带颜色
+            if not positions:
+                print("(空)")
 
         # 显示做空仓位
         print(f"\n{Fore.RED}=== 做空仓位 (理论盈亏) ==={Style.RESET_ALL}") # 标注为理论盈亏
-        shorts = self.player.get("shorts", {})
-        if not isinstance(shorts, dict) or not shorts:
+        shorts = self.player["shorts"]
+        if not shorts:
             print("当前没有做空仓位")
         else:
             print("代码 | 名称 | 数量 | 借入价格(元) | 当前价格(元) | 理论盈亏(元)") # 添加盈亏列
             print("-" * 90) # 调整分隔线长度
-             # 确保items()返回字典视图
-            for code, data in shorts.items():
+            for code, position in shorts.items():
                 stock = self.market.stock_dict.get(code)
-                # 确保data是列表且包含足够元素，元素是数字
-                if isinstance(data, list) and len(data) >= 2 and isinstance(data[0], (int, float)) and isinstance(data[1], (int, float)):
-                    current_price = float(stock.current_price) if stock else 0.0
-                    borrow_price = float(data[1])
-                    amount = float(data[0])
-                    # 做空盈亏 = (借入价格 - 当前价格) * 数量
-                    profit = (borrow_price - current_price) * amount
-
-                    # 根据盈亏确定颜色
-                    color = Fore.GREEN if profit > 0 else (Fore.RED if profit < 0 else Style.RESET_ALL)
-
-                    print(f"{code} | {stock.name if stock else '未知'} | {int(amount)} | {borrow_price:.2f} | {current_price:.2f} | {color}{profit:.2f}{Style.RESET_ALL}") # 格式化并显示所有信息，数量显示为整数，盈亏带颜色
-                else:
-                    print(f"错误：做空仓位 {code} 数据异常")
+                current_price = stock.current_price if stock else 0.0
+                # 做空盈亏 = (借入价格 - 当前价格) * 数量
+                profit = (position.price - current_price) * position.amount
+
+                # 根据盈亏确定颜色
+                color = Fore.GREEN if profit > 0 else (Fore.RED if profit < 0 else Style.RESET_ALL)
+
+                print(f"{code} | {stock.name if stock else '未知'} | {int(position.amount)} | {position.price:.2f} | {current_price:.2f} | {color}{profit:.2f}{Style.RESET_ALL}") # 格式化并显示所有信息，数量显示为整数，盈亏带颜色
 
         # 计算总资产和净资产，确保所有组成部分都是浮点数
-        total_assets = cash + total_stock_value + total_bond_value
+        total_assets = cash + self.valuation.value()
         net_assets = total_assets - debt
 
         print(f"\n总资产：{total_assets:.2f}元") # 格式化总资产
         print(f"净资产：{net_assets:.2f}元") # 格式化净资产
 
-    def show_asset_trend(self):
-        """显示资产趋势 (使用总资产历史) """
-        print(f"{Fore.CYAN}=== 资产趋势 ==={Style.RESET_ALL}")
-        if not self.total_assets_history:
-            print("暂无历史数据")
-            return
-
-        max_days = min(30, len(self.total_assets_history))
-        history = self.total_assets_history[-max_days:]
-        # 确保历史数据是数字
-        history_numeric = [float(h) for h in history if isinstance(h, (int, float))]
+    def show_asset_trend(self, days=30):
+        """显示资产趋势 (使用总资产历史)；天数超过屏幕行数时按周/月/季度聚合，每行为该周期末的总资产"""
+        term_size = shutil.get_terminal_size()
+        self._show_chart(("trend", self.day, term_size.columns, term_size.lines, days),
+                         lambda: self._asset_trend_frame(days, term_size))
 
-        if not history_numeric:
-             print("历史数据格式错误")
-             return
+    def show_total_assets_trend(self):
+        """交互式总资产趋势图：输入显示的天数，跨度超过屏幕行数时自动改用周/月/季度/年聚合"""
+        span = input("显示最近多少天（回车为30天，可输入365、3650等）：").strip()
+        try:
+            days = int(span) if span else 30
+        except ValueError:
+            print(f"{Fore.RED}天数必须是整数，显示最近30天{Style.RESET_ALL}")
+            days = 30
+        if days <= 0:
+            print(f"{Fore.RED}天数必须大于0，显示最近30天{Style.RESET_ALL}")
+            days = 30
+        self.show_asset_trend(days)
+
+    def _show_chart(self, key, build):
+        """同一天内以相同参数重新打开图表时直接输出缓存的整帧，否则构建整帧后一次写出"""
+        frame = self.chart_cache.get(key)
+        if frame is None:
+            frame = build()
+            self.chart_cache.put(key, frame)
+        write_frame(frame)
+
+    def _asset_trend_frame(self, days, term_size):
+        """构建资产趋势图的整帧文本"""
+        lines = [f"{Fore.CYAN}=== 资产趋势 ==={Style.RESET_ALL}"]
+        if not self.total_assets_history:
+            return "\n".join(lines + ["暂无历史数据"]) + "\n"
+
+        # 有价格归档时可以看到一年以前的每日资产
+        day_numbers, history = self.asset_history(self.day - days + 1, self.day)
+        if not len(history):
+            return "\n".join(lines + ["历史数据格式错误"]) + "\n"
+        max_days = len(history)
+        max_rows = max(30, term_size.lines - 10)
+        for resolution, span in ROLLUP_RESOLUTIONS:
+            if (day_numbers[-1] - 1) // span - (day_numbers[0] - 1) // span < max_rows:
+                break
+        if span == 1:
+            history_numeric = history.tolist()
+        elif self.market.archive is not None:  # 直接读取预先聚合的K线
+            day_numbers, ohlc = self.market.archive.assets.rollups[span].read(0, int(day_numbers[0]), int(day_numbers[-1]))
+            history_numeric = ohlc[:, 3].tolist()
+        else:
+            ids, values = rollup_ohlc(day_numbers, history[:, None], span)
+            day_numbers, history_numeric = ids * span + 1, values[:, 3, 0].tolist()
 
         min_val = min(history_numeric)
         max_val = max(history_numeric)
         if max_val == min_val:
             max_val = min_val + 1.0 # Prevent division by zero if all values are the same, ensure float
 
-        term_width = shutil.get_terminal_size().columns
         # Adjust chart width calculation for clarity and prevent excessive width
-        chart_width = min(80, term_width - 25) # Leave space for day and value labels
-
-        print(f"近 {max_days} 天总资产趋势 (单位：元)")
-        print(f"范围：{min_val:.2f}元 ~ {max_val:.2f}元") # 格式化范围
-
-        for i, val in enumerate(history_numeric): # 使用numeric历史数据
-            # Calculate relative position within the chart range
-            norm_val = (val - min_val) / (max_val - min_val)
-            bar_len = int(norm_val * chart_width)
-
-            # Determine color based on change from previous day
-            color = Style.RESET_ALL
-            if i > 0:
-                # 确保前一天数据是数字
-                prev_val = history_numeric[i-1]
-                if val > prev_val:
-                    color = Fore.GREEN
-                elif val < prev_val:
-                    color = Fore.RED
-
-            # Format day and value labels
-            day_num = self.day - len(history_numeric) + i + 1 # 使用numeric历史数据长度
-            day_label = f"第{day_num:3d}天 |"
-            # Format with comma separator, replace with underscore to avoid f-string issues
-            value_label = f"{val:,.2f}元".replace(",", "_") .rjust(12) # 右对齐并格式化价值
-
-            # Print the bar and labels
-            # Use ljust to pad the line to terminal width for alignment, though perfect alignment is tricky with variable width chars
-            print(f"{day_label} {color}{'█' * bar_len}{Style.RESET_ALL} {value_label}")
-        # Add legend for clarity
-        print(f"\n{Fore.YELLOW}图例说明：{Style.RESET_ALL}")
-        print(f"{Fore.GREEN}███绿色：当日总资产上涨{Style.RESET_ALL}")
-        print(f"{Fore.RED}███红色：当日总资产下跌{Style.RESET_ALL}")
-        print("███白色：当日总资产无变化或首日")
-        print("柱状长度反映相对总资产区间，非绝对涨跌幅")
-        print("（注意：由于终端字符限制，图表精度有限）")
+        chart_width = min(80, term_size.columns - 25) # Leave space for day and value labels
+
+        lines.append(f"近 {max_days} 天总资产趋势 (单位：元)" + ("" if span == 1 else f"，每行为一{resolution}末"))
+        lines.append(f"范围：{min_val:.2f}元 ~ {max_val:.2f}元") # 格式化范围
+        # 横条长度和涨跌颜色整列计算；数值用下划线分隔千位并右对齐
+        lengths = bar_lengths(history_numeric, min_val, max_val - min_val, chart_width)
+        lines += [f"第{day:3d}天 | {color}{'█' * length}{Style.RESET_ALL} {f'{val:,.2f}元'.replace(',', '_').rjust(12)}"
+                  for day, color, length, val in zip(np.asarray(day_numbers).tolist(), bar_colors(history_numeric),
+                                                     lengths, history_numeric)]
+        lines += legend_lines("总资产", resolution)
+        return "\n".join(lines) + "\n"
 
     def show_horizontal_chart(self):
         """优化后的水平走势图显示（完整修复版）"""
@@ -695,76 +3247,14 @@ class StockTycoon:
         if not asset or not asset.history:
             print("无效资产代码或没有历史数据")
             return
-
-        # 动态终端适配
-        term_width, _ = shutil.get_terminal_size()
-        # Adjust max_bar_width calculation for clarity and prevent excessive width
-        max_bar_width = max(30, term_width - 35)  # 为价格标签留出空间
-        # Limit displayed days based on available history and chart width
-        max_days_to_show = min(len(asset.history), max_bar_width) # Display at most chart_width days
-
-        # 获取历史数据（最近 max_days_to_show 天）
-        history_to_show = asset.history[-max_days_to_show:]
-        day_count = len(history_to_show)
-        start_day_display = self.day - day_count + 1
-
-        # 计算显示参数
-        # Extract prices from the history list of dicts, ensure they are numbers
-        prices_to_show = [float(entry["price"]) for entry in history_to_show if isinstance(entry.get("price"), (int, float))]
-
-        if not prices_to_show:
-            print("历史价格数据格式错误")
-            return
-
-        min_price = min(prices_to_show) if prices_to_show else 0.0 # Ensure float default
-        max_price = max(prices_to_show) if prices_to_show else (min_price + 1.0) # Prevent division by zero, ensure float
-        price_range = max(max_price - min_price, 1.0)  # 防止除零，确保浮点数
-
-        # 打印头部信息
-        print(f"\n{asset.name} ({code}) 近期价格走势".center(term_width))
-        print(f"当前第 {self.day} 天 | 显示最近 {day_count} 个交易日".center(term_width))
-        print(f"历史价格范围：{min_price:.2f}元 ~ {max_price:.2f}元".center(term_width)) # 格式化范围
-
-        # 绘制走势图
-        for idx in range(day_count):
-            current_entry = history_to_show[idx]
-            # 确保当前价格是数字
-            current_price = float(current_entry.get("price", 0.0)) if isinstance(current_entry.get("price"), (int, float)) else 0.0
-
-            # Get previous day's price from history_to_show if available, ensure number
-            prev_price = float(history_to_show[idx-1].get("price", 0.0)) if idx > 0 and isinstance(history_to_show[idx-1].get("price"), (int, float)) else current_price
-
-            # Calculate relative position within the chart range
-            # Avoid division by zero if price_range is 0
-            norm_val = (current_price - min_price) / price_range if price_range > 0 else 0.0
-            bar_width = max(1, int(norm_val * max_bar_width))  # 确保最小显示宽度
-
-            # Determine color
-            color = Style.RESET_ALL # Default color
-            if idx > 0:
-                if current_price > prev_price:
-                    color = Fore.GREEN
-                elif current_price < prev_price:
-                    color = Fore.RED
-
-            # Build bar and labels
-            bar = f"{color}{'█' * bar_width}"
-            # Format price label with fixed width
-            # Format price label with fixed width and comma separators
-            price_label = f"{Style.RESET_ALL}{current_price:,.2f}元".replace(",", "_").rjust(12) # Right justify price label
-            day_label = f" (第{start_day_display + idx}天)" if idx % 5 == 0 or idx == day_count-1 else ""
-
-            # Print the line, padding to terminal width
-            line = f"{bar}{price_label}{day_label}"
-            print(line.ljust(term_width))
-
-        # 图例说明
-        print(f"\n{Fore.YELLOW}图例说明：{Style.RESET_ALL}")
-        print(f"{Fore.GREEN}███绿色：当日价格上涨{Style.RESET_ALL}")
-        print(f"{Fore.RED}███红色：当日价格下跌{Style.RESET_ALL}")
-        print("███白色：当日价格无变化或首日")
-        print("柱状长度反映相对价格区间，非绝对涨跌幅")
-        print("（注意：由于终端字符限制，图表精度有限）")
+        # 跨度超过屏幕能放下的行数时自动改用周/月/季度/年K线
+        span = input("显示最近多少天（回车为适应屏幕宽度，可输入365、3650等）：").strip()
+        try:
+            days = int(span) if span else None
+        except ValueError:
+            print(f"{Fore.RED}天数必须是整数，显示适应屏幕宽度的天数{Style.RESET_ALL}")
+            days = None
+        self.show_horizontal_chart_for_asset(asset, days)
 
     def bulk_stock_trade(self):
         """整合股票交易和做空功能"""
@@ -776,249 +3266,388 @@ class StockTycoon:
             print(f"{Fore.RED}错误：无效的股票代码{Style.RESET_ALL}")
             return
 
-        stock = self.market.stock_dict[code]
-        action = input("请选择操作 (1.买入 / 2.卖出 / 3.做空 / 4.平仓做空): ")
+        self.bulk_stock_trade_for_asset(self.market.stock_dict[code], quick=False)
 
-        # 定义amount变量并初始化，确保在try块外已定义并为数字类型
-        amount = 0.0
-
-        # 获取并验证交易数量 (买入、卖出、做空需要数量输入)
-        if action in ["1", "2", "3"]:
-            try:
-                amount = int(input(f"操作数量（当前价：{stock.current_price:.2f}元/股）："))
-                if amount <= 0:
-                    raise ValueError("数量必须为正整数")
-                amount = float(amount)
-                # 验证土豪模式
-                if action in ["1", "3"] and not self.validate_tycoon_purchase(amount):
-                    return
-            except ValueError as e:
-                print(f"{Fore.RED}错误：{e}{Style.RESET_ALL}")
-                return
+    def execute_stock_order(self, stock, action, amount, quick=False):
+        """按当前价格执行一笔股票交易（不含输入和存档），条件不满足时抛出ValueError，成功返回交易记录
 
+        quick为True时按快捷交易（筛选结果中直接交易）的经验规则：买入、做空和平仓不加经验，只有盈利的卖出获得经验。
+        """
+        code = stock.code
+        price = stock.current_price
         # 买入逻辑
-        if action == "1":
-            total_cost = stock.current_price * amount
-            current_cash = float(self.player.get("cash", 0.0)) if isinstance(self.player.get("cash", 0), (int, float)) else 0.0 # 确保现金是浮点数
-            if total_cost > current_cash:
-                print(f"{Fore.RED}错误：资金不足，需要{total_cost:.2f}元{Style.RESET_ALL}") # 使用.2f格式化金额
+        if action == "buy":
+            total_cost = price * amount
+            if total_cost > self.player["cash"]:
+                raise ValueError(f"资金不足，需要{total_cost:.2f}元") # 使用.2f格式化金额
+            self.player["cash"] -= total_cost
+            holding = self.player["stocks"].get(code)
+            if holding:
+                holding.add(amount, price)  # 加仓按数量加权平均成本
             else:
-                self.player["cash"] = current_cash - total_cost
-                stocks = self.player.get("stocks", {})
-                if isinstance(stocks, dict):
-                    current_holding = float(stocks.get(code, 0.0)) if isinstance(stocks.get(code), dict) and isinstance(stocks.get(code).get("amount"), (int, float)) else 0.0 # 确保持仓是浮点数并检查结构
-                    stocks[code] = {"amount": current_holding + amount, "avg_price": float(stocks.get(code, {}).get("avg_price", stock.current_price))}
-                    self.player["stocks"] = stocks
-                print(f"{Fore.GREEN}成功买入 {int(amount)} 股 {stock.name}{Style.RESET_ALL}") # 数量显示为整数
-                # 新增操作记录
-                stock.operation_history.append({
-                    "day": self.day,
-                    "action": "买入",
-                    "amount": int(amount), # 操作记录数量保存为整数
-                    "price": stock.current_price
-                })
-                self.record_trade("股票", code, "买入", amount, stock.current_price) # 交易记录数量保存为浮点数
-                self.add_exp(20)  # 购买股票增加20点经验
-                self.save_game()
-                        
-        # 卖出逻辑
-        elif action == "2":
-            stocks = self.player.get("stocks", {})
-            # 确保持仓是字典且包含该股票代码，然后获取amount，否则为0.0
-            current_holding = float(stocks.get(code, {}).get("amount", 0.0)) if isinstance(stocks, dict) and isinstance(stocks.get(code), dict) and isinstance(stocks.get(code).get("amount"), (int, float)) else 0.0 # 确保持仓是浮点数并检查结构
+                self.player["stocks"][code] = Holding(amount, price)
+            print(f"{Fore.GREEN}成功买入 {int(amount)} 股 {stock.name}{Style.RESET_ALL}") # 数量显示为整数
+            trade_action, exp, pnl = "买入", 20, 0.0  # 购买股票增加20点经验
 
-            # 强化类型检查和数量检查
+        # 卖出逻辑
+        elif action == "sell":
+            holding = self.player["stocks"].get(code)
+            current_holding = holding.amount if holding else 0.0
             if current_holding < amount:
-                print(f"{Fore.RED}错误：持仓不足，当前持有 {int(current_holding)} 股{Style.RESET_ALL}") # 数量显示为整数
-                return
-
+                raise ValueError(f"持仓不足，当前持有 {int(current_holding)} 股") # 数量显示为整数
             # 计算收益和盈亏
-            total_income = stock.current_price * amount
-            # 获取平均成本价，确保是数字
-            avg_price = float(stocks[code].get("avg_price", 0.0)) if isinstance(stocks.get(code), dict) and "avg_price" in stocks.get(code) else 0.0
-            profit_loss = (stock.current_price - avg_price) * amount # 计算盈亏
-
-            self.player["cash"] = float(self.player.get("cash", 0.0)) + total_income if isinstance(self.player.get("cash", 0.0), (int, float)) else total_income # 确保现金是浮点数
-
+            total_income = price * amount
+            profit_loss = (price - holding.avg_price) * amount # 计算盈亏
+            self.player["cash"] += total_income
             # 更新持仓数量，平均成本价不变
-            if isinstance(stocks, dict):
-                # 确保获取持仓数据时处理可能的数据异常
-                holding_data = stocks.get(code)
-                if isinstance(holding_data, dict) and "amount" in holding_data:
-                    new_holding_amount = float(holding_data["amount"]) - amount
-                    if new_holding_amount <= 0.0: # 使用<=0.0处理浮点误差
-                        if code in stocks:
-                            del stocks[code]  # 完全卖出后移除持仓记录
-                    else:
-                         holding_data["amount"] = new_holding_amount # 更新剩余数量 (浮点)
-                         stocks[code] = holding_data # 更新持仓字典
-                else:
-                    print(f"{Fore.RED}内部错误：卖出时获取持仓数据异常 for {code}{Style.RESET_ALL}")
-                    return # 数据异常则退出
-
-                self.player["stocks"] = stocks
-
+            holding.amount -= amount
+            if holding.amount <= 0.0: # 使用<=0.0处理浮点误差
+                del self.player["stocks"][code]  # 完全卖出后移除持仓记录
             print(f"{Fore.GREEN}成功卖出 {int(amount)} 股 {stock.name}，获得{total_income:.2f}元{Style.RESET_ALL}") # 数量显示为整数，格式化收益
             print(f"{Fore.GREEN}本次交易盈亏：{profit_loss:.2f}元{Style.RESET_ALL}") # 格式化盈亏
-
-            # 新增操作记录
-            stock.operation_history.append({
-                "day": self.day,
-                "action": "卖出",
-                "amount": int(amount), # 操作记录数量保存为整数
-                "price": stock.current_price
-            })
-            self.record_trade("股票", code, "卖出", amount, stock.current_price) # 交易记录数量保存为浮点数
-            self.add_exp(int(profit_loss / 1000))  # 盈利每1000元增加1点经验
-            self.save_game()
+            trade_action, exp, pnl = "卖出", int(profit_loss / 1000), profit_loss  # 盈利每1000元增加1点经验
 
         # 做空逻辑
-        elif action == "3":
-             # amount变量已经在try块外初始化并获取
-             # 计算保证金（假设50%保证金率），确保浮点数运算
-             margin_required = stock.current_price * amount * 0.5
-             current_cash = float(self.player.get("cash", 0.0)) if isinstance(self.player.get("cash", 0), (int, float)) else 0.0 # 确保现金是浮点数
-             if current_cash < margin_required:
-                 print(f"{Fore.RED}错误：保证金不足，需要{margin_required:.2f}元{Style.RESET_ALL}") # 格式化保证金
-                 return
-
-             # 记录做空仓位，确保借入价格是浮点数，数量是浮点数以便计算
-             # 做空仓位存储 {代码: [数量(float), 借入价格(float), 借入天数(int)]}
-             shorts = self.player.get("shorts", {})
-             if not isinstance(shorts, dict): # 确保shorts是字典
-                  shorts = {}
-
-             # 如果已经有做空仓位，更新数量和借入价格（使用加权平均）
-             if code in shorts and isinstance(shorts[code], list) and len(shorts[code]) >= 3:
-                 existing_amount = float(shorts[code][0])
-                 existing_borrow_price = float(shorts[code][1])
-                 new_total_amount = existing_amount + amount
-                 new_borrow_price = ((existing_borrow_price * existing_amount) + (stock.current_price * amount)) / new_total_amount if new_total_amount > 0 else 0.0
-                 shorts[code] = [new_total_amount, new_borrow_price, self.day] # 更新借入天数为最新的
-             else:
-                 # 新建做空仓位记录
-                 shorts[code] = [float(amount), float(stock.current_price), self.day]
-
-             self.player["cash"] = current_cash + stock.current_price * amount - margin_required
-             self.player["shorts"] = shorts
-
-             print(f"{Fore.GREEN}成功做空 {int(amount)} 股 {stock.name}，保证金已扣除{margin_required:.2f}元{Style.RESET_ALL}") # 数量显示为整数，格式化保证金
-             # 新增操作记录
-             stock.operation_history.append({
-                 "day": self.day,
-                 "action": "做空",
-                 "amount": int(amount), # 操作记录数量保存为整数
-                 "price": stock.current_price
-             })
-             self.record_trade("股票", code, "做空", amount, stock.current_price) # 交易记录数量保存为浮点数
-             self.add_exp(30)  # 做空增加30点经验
-             self.save_game()
+        elif action == "short":
+            # 计算保证金（假设50%保证金率）
+            margin_required = price * amount * 0.5
+            if self.player["cash"] < margin_required:
+                raise ValueError(f"保证金不足，需要{margin_required:.2f}元") # 格式化保证金
+            # 如果已经有做空仓位，更新数量和借入价格（使用加权平均）
+            position = self.player["shorts"].get(code)
+            if position:
+                position.add(amount, price, self.day)
+            else:
+                # 新建做空仓位记录
+                self.player["shorts"][code] = ShortPosition(amount, price, self.day)
+            self.player["cash"] += price * amount - margin_required
+            print(f"{Fore.GREEN}成功做空 {int(amount)} 股 {stock.name}，保证金已扣除{margin_required:.2f}元{Style.RESET_ALL}") # 数量显示为整数，格式化保证金
+            trade_action, exp, pnl = "做空", 30, 0.0  # 做空增加30点经验
 
         # 平仓做空逻辑
-        elif action == "4":
-             # 平仓数量单独获取，确保为数字类型
-             amount_to_cover = 0.0
-             try:
-                 shorts = self.player.get("shorts", {})
-                 if not isinstance(shorts, dict) or code not in shorts or not isinstance(shorts[code], list) or len(shorts[code]) < 3:
-                     print(f"{Fore.RED}错误：没有该股票的做空仓位或数据异常{Style.RESET_ALL}")
-                     return
-                 # 确保获取当前做空数量时处理可能的数据异常
-                 current_short_amount = float(shorts[code][0]) if isinstance(shorts[code][0], (int, float)) else 0.0
-
-                 amount_to_cover = int(input(f"平仓数量（当前做空：{int(current_short_amount)}股）：")) # 数量显示为整数
-                 if amount_to_cover <= 0 or amount_to_cover > current_short_amount:
-                      print(f"{Fore.RED}错误：无效或超过做空数量{Style.RESET_ALL}")
-                      return
-                 amount_to_cover = float(amount_to_cover) # 将平仓数量转换为浮点数
-             except ValueError as e:
-                 print(f"{Fore.RED}错误：{e}{Style.RESET_ALL}")
-                 return
-
-             # shorts变量已经在try块外获取并验证
-             short_data = shorts[code]
-             borrow_price = float(short_data[1]) # 确保借入价格是浮点数
-             original_short_amount = float(short_data[0]) # 确保原始做空数量是浮点数
-
-             # 计算买回成本，确保浮点数运算
-             buyback_cost = stock.current_price * amount_to_cover
-             current_cash = float(self.player.get("cash", 0.0)) if isinstance(self.player.get("cash", 0), (int, float)) else 0.0 # 确保现金是浮点数
-             if current_cash < buyback_cost:
-                 print(f"{Fore.RED}错误：现金不足，需要{buyback_cost:.2f}元{Style.RESET_ALL}") # 格式化成本
-                 return
-
-             # 计算盈亏 (只计算平仓部分的盈亏)，确保浮点数运算
-             profit_per_share = borrow_price - stock.current_price
-             total_profit = profit_per_share * amount_to_cover
-
-             # 返还平仓部分的保证金，并结算盈亏
-             # 保证金计算基于借入价格，返还时应按比例
-             returned_margin = (amount_to_cover / original_short_amount) * (borrow_price * original_short_amount * 0.5) if original_short_amount > 0 else 0.0 # 避免除以零
-             self.player["cash"] = current_cash + total_profit + returned_margin # 确保现金是浮点数
-
-             # 更新做空仓位
-             short_data[0] = original_short_amount - amount_to_cover
-             if short_data[0] <= 0.0: # 使用<=0.0处理浮点误差
-                 del shorts[code]
-             else:
-                 shorts[code] = short_data # 更新剩余数量 (浮点)
-
-             self.player["shorts"] = shorts
-             print(f"{Fore.GREEN}平仓 {int(amount_to_cover)} 股成功，净盈亏：{total_profit:.2f}元{Style.RESET_ALL}") # 数量显示为整数，格式化盈亏
-             # 新增操作记录
-             stock.operation_history.append({
-                 "day": self.day,
-                 "action": "平仓",
-                 "amount": int(amount_to_cover), # 操作记录数量保存为整数
-                 "price": stock.current_price
-             })
-             self.record_trade("股票", code, "平仓做空", amount_to_cover, stock.current_price) # 交易记录数量保存为浮点数
-             self.add_exp(int(total_profit / 1000))  # 盈利每1000元增加1点经验
-             self.save_game()
+        elif action == "cover":
+            position = self.player["shorts"].get(code)
+            if not position:
+                raise ValueError("没有该股票的做空仓位")
+            if amount > position.amount:
+                raise ValueError(f"超过做空数量，当前做空 {int(position.amount)} 股")
+            borrow_price = position.price
+            original_short_amount = position.amount
+            # 计算买回成本
+            buyback_cost = price * amount
+            if self.player["cash"] < buyback_cost:
+                raise ValueError(f"现金不足，需要{buyback_cost:.2f}元") # 格式化成本
+            # 计算盈亏 (只计算平仓部分的盈亏)
+            total_profit = (borrow_price - price) * amount
+            # 返还平仓部分的保证金，并结算盈亏
+            # 保证金计算基于借入价格，返还时应按比例
+            returned_margin = (amount / original_short_amount) * (borrow_price * original_short_amount * 0.5) if original_short_amount > 0 else 0.0 # 避免除以零
+            self.player["cash"] += total_profit + returned_margin
+            # 更新做空仓位
+            position.amount = original_short_amount - amount
+            if position.amount <= 0.0: # 使用<=0.0处理浮点误差
+                del self.player["shorts"][code]
+            print(f"{Fore.GREEN}平仓 {int(amount)} 股成功，净盈亏：{total_profit:.2f}元{Style.RESET_ALL}") # 数量显示为整数，格式化盈亏
+            trade_action, exp, pnl = "平仓做空", int(total_profit / 1000), total_profit  # 盈利每1000元增加1点经验
 
         else:
-            print(f"{Fore.RED}错误：无效的操作选择{Style.RESET_ALL}")
-            # 不需要保存游戏，因为没有成功交易
-            return
+            raise ValueError(f"股票不支持的操作：{action}")
 
-        # self.save_game() # 成功交易后在各个分支内部保存游戏
+        record = self.record_trade("股票", code, trade_action, amount, price, pnl) # 交易记录数量保存为浮点数
+        self._add_trade_exp(action, exp, quick)
+        return record
+
+    def _add_trade_exp(self, action, exp, quick):
+        """成交后增加经验；快捷交易只有盈利的卖出获得经验（亏损不扣经验）"""
+        if quick:
+            exp = max(exp, 0) if action == "sell" else 0
+            if not exp:
+                return
+        self.add_exp(exp)
+
+    def _parse_batch_order(self, order):
+        """解析批量订单中的一条，返回 (类别, 资产, 操作, 数量)，格式错误时抛出ValueError"""
+        if not isinstance(order, dict):
+            raise ValueError("订单格式错误")
+        code = str(order.get("code") or "").strip().upper()
+        action = str(order.get("action") or "").strip().lower()
+        if code in self.market.stock_dict:
+            kind, asset, actions = "stocks", self.market.stock_dict[code], STOCK_ORDER_ACTIONS
+        elif code in self.market.bond_dict:
+            kind, asset, actions = "bonds", self.market.bond_dict[code], BOND_ORDER_ACTIONS
+        else:
+            raise ValueError(f"无效的资产代码：{code}")
+        if action not in actions:
+            raise ValueError(f"不支持的操作：{action}")
+        try:
+            amount = float(order.get("amount"))
+        except (TypeError, ValueError):
+            raise ValueError("无效的数量")
+        if amount <= 0 or not amount.is_integer():
+            raise ValueError("数量必须为正整数")
+        return kind, asset, action, amount
+
+    def execute_order_batch(self, orders):
+        """批量执行订单：先在模拟状态上逐笔校验现金、持仓和土豪模式规则，再一次性执行全部通过的订单并只存档一次，返回逐笔报告"""
+        cash = self.player["cash"]
+        holdings = {(kind, code): h.amount for kind in PortfolioValuation.KINDS for code, h in self.player[kind].items()}
+        shorts = {code: [p.amount, p.price] for code, p in self.player["shorts"].items()}
+        report, accepted = [], []
+        for line, order in enumerate(orders, 1):
+            entry = {"line": line, "code": order.get("code") if isinstance(order, dict) else None,
+                     "action": order.get("action") if isinstance(order, dict) else None,
+                     "amount": order.get("amount") if isinstance(order, dict) else None, "status": "rejected"}
+            report.append(entry)
+            try:
+                kind, asset, action, amount = self._parse_batch_order(order)
+                entry.update(code=asset.code, action=action, amount=int(amount))
+                if action in ("buy", "short") and self.tycoon_mode and amount < 1000:
+                    raise ValueError("土豪模式下必须购买1000股或以上！")
+                # 与 execute_stock_order/execute_bond_order 相同的校验和资金变化，作用在模拟状态上
+                price = asset.current_price
+                key = (kind, asset.code)
+                if action == "buy":
+                    if price * amount > cash:
+                        raise ValueError(f"资金不足，需要{price * amount:.2f}元")
+                    cash -= price * amount
+                    holdings[key] = holdings.get(key, 0.0) + amount
+                elif action == "sell":
+                    if holdings.get(key, 0.0) < amount:
+                        raise ValueError(f"持仓不足，当前持有 {int(holdings.get(key, 0.0))} {'股' if kind == 'stocks' else '单位'}")
+                    cash += price * amount
+                    holdings[key] -= amount
+                elif action == "short":
+                    margin_required = price * amount * 0.5
+                    if cash < margin_required:
+                        raise ValueError(f"保证金不足，需要{margin_required:.2f}元")
+                    cash += price * amount - margin_required
+                    short = shorts.setdefault(asset.code, [0.0, 0.0])
+                    short[1] = (short[1] * short[0] + price * amount) / (short[0] + amount)
+                    short[0] += amount
+                else:
+                    short = shorts.get(asset.code)
+                    if not short or short[0] <= 0.0:
+                        raise ValueError("没有该股票的做空仓位")
+                    if amount > short[0]:
+                        raise ValueError(f"超过做空数量，当前做空 {int(short[0])} 股")
+                    if cash < price * amount:
+                        raise ValueError(f"现金不足，需要{price * amount:.2f}元")
+                    cash += (short[1] - price) * amount + amount * short[1] * 0.5
+                    short[0] -= amount
+                accepted.append((entry, kind, asset, action, amount))
+            except ValueError as e:
+                entry["reason"] = str(e)
+
+        # 校验通过的订单一次性执行，逐笔输出被收集起来，只打印汇总报告
+        with contextlib.redirect_stdout(io.StringIO()):
+            for entry, kind, asset, action, amount in accepted:
+                execute = self.execute_stock_order if kind == "stocks" else self.execute_bond_order
+                try:
+                    record = execute(asset, action, amount)
+                except ValueError as e:
+                    entry["reason"] = str(e)
+                    continue
+                entry.update(status="filled", price=record["price"])
+        if accepted:
+            self.save_game()
+        return report
+
+    def run_order_file(self):
+        """交互式执行批量订单文件"""
+        print(f"{Fore.CYAN}=== 批量执行订单文件 ==={Style.RESET_ALL}")
+        print("CSV 文件表头为 code,action,amount；JSON 文件为订单列表。action 可选 buy/sell/short/cover（债券只支持 buy/sell）")
+        path = input("请输入订单文件路径：").strip()
+        try:
+            orders = read_order_file(path)
+        except (OSError, ValueError) as e:
+            print(f"{Fore.RED}错误：无法读取订单文件：{e}{Style.RESET_ALL}")
+            return
+        print_batch_report(self.execute_order_batch(orders))
+
+    def place_order(self, kind, code, type, amount, trigger):
+        """新建条件单，参数不合法时抛出ValueError"""
+        lookup = self.market.stock_dict if kind == "stocks" else self.market.bond_dict
+        if code not in lookup:
+            raise ValueError(f"无效的资产代码：{code}")
+        if type not in (ORDER_TYPES if kind == "stocks" else BOND_ORDER_TYPES):
+            raise ValueError("该资产不支持此类条件单")
+        if amount <= 0 or trigger <= 0:
+            raise ValueError("数量和触发价格必须大于0")
+        if ORDER_TYPES[type][1] in ("buy", "short") and self.tycoon_mode and amount < 1000:
+            raise ValueError("土豪模式下必须购买1000股或以上！")
+        order = self.order_book.place(kind, code, type, float(amount), float(trigger), self.day)
+        self._orders_changed = True
+        return order
+
+    def cancel_order(self, order_id):
+        """撤销条件单，返回被撤销的挂单（不存在时返回None）"""
+        order = self.order_book.cancel(order_id)
+        if order is not None:
+            self._orders_changed = True
+        return order
+
+    def match_orders(self):
+        """撮合当前价格触发的条件单，返回成交笔数（成交条件不满足的挂单作废）"""
+        filled = 0
+        for kind, engine, lookup, execute in (("stocks", self.market.stock_engine, self.market.stock_dict, self.execute_stock_order),
+                                              ("bonds", self.market.bond_engine, self.market.bond_dict, self.execute_bond_order)):
+            for order in self.order_book.triggered(kind, engine.prices):
+                self._orders_changed = True
+                asset = lookup[order.code]
+                print(f"{Fore.YELLOW}条件单 #{order.id} {order.label} {order.code} 触发（触发价 {order.trigger:.2f}元，当前价 {asset.current_price:.2f}元）{Style.RESET_ALL}")
+                try:
+                    execute(asset, order.action, order.amount)
+                    filled += 1
+                except ValueError as e:
+                    print(f"{Fore.RED}条件单 #{order.id} 未能成交：{e}{Style.RESET_ALL}")
+        return filled
+
+    def show_orders(self):
+        """显示所有未成交的条件单"""
+        print(f"\n{Fore.CYAN}=== 条件单 ==={Style.RESET_ALL}")
+        if not self.order_book:
+            print("当前没有挂单")
+            return
+        print("编号 | 代码 | 类型 | 数量 | 触发价(元) | 当前价(元) | 挂单日")
+        print("-" * 70)
+        for order in self.order_book:
+            asset = self.market.stock_dict.get(order.code) or self.market.bond_dict.get(order.code)
+            print(f"#{order.id} | {order.code} | {order.label} | {int(order.amount)} | {order.trigger:.2f} | {asset.current_price:.2f} | {order.day}日")
+
+    def create_order(self):
+        """交互式新建条件单"""
+        code = input("请输入资产代码：").upper()
+        kind = "stocks" if code in self.market.stock_dict else ("bonds" if code in self.market.bond_dict else None)
+        if kind is None:
+            print(f"{Fore.RED}错误：无效的资产代码{Style.RESET_ALL}")
+            return
+        types = list(ORDER_TYPES) if kind == "stocks" else list(BOND_ORDER_TYPES)
+        for idx, type in enumerate(types, 1):
+            label, _, direction = ORDER_TYPES[type]
+            print(f"{idx}. {label}（价格{'跌至' if direction == 'below' else '涨至'}触发价时成交）")
+        try:
+            choice = int(input("请选择条件单类型："))
+            if not 1 <= choice <= len(types):
+                raise ValueError("无效的条件单类型")
+            type = types[choice - 1]
+            asset = self.market.stock_dict.get(code) or self.market.bond_dict.get(code)
+            trigger = float(input(f"请输入触发价格（当前价：{asset.current_price:.2f}元）："))
+            amount = int(input("请输入数量："))
+            order = self.place_order(kind, code, type, amount, trigger)
+        except ValueError as e:
+            print(f"{Fore.RED}错误：{e}{Style.RESET_ALL}")
+            return
+        print(f"{Fore.GREEN}已挂单 #{order.id}：{order.label} {code} {int(order.amount)} @ {order.trigger:.2f}元{Style.RESET_ALL}")
+        self.save_game()
 
     def daily_update(self):
         """增强的每日结算"""
-        self.day += 1
-        self.market.set_day(self.day)
-        # 使用游戏天数获取季节
-        season = self.season.current_season(self.day)
-
-        # 更新股票和债券价格及历史
-        self.market.update_stocks(season["stock_vol"], self.day)
-        self.market.update_bonds(season, self.day)
+        self.advance_days(1)
 
-        # 每日资产快照
-        total_assets = self.calculate_total_assets()
-        self.total_assets_history.append(total_assets)
-        if len(self.total_assets_history) > 365: # 保留一年数据
-            self.total_assets_history.pop(0)
+    def advance_days(self, days):
+        """无界面快进多天：逐日向量化推进价格，批量更新资产历史，最后只存档一次"""
+        days = int(days)
+        if days <= 0:
+            return
+        if self.current_save is not None:
+            self._attach_archive(os.path.join('saves', self.current_save))  # 新存档从第一天起就写入价格归档
+        # 快进期间持仓不变，预先把持仓转换为数组，每天的估值只是一次点积
+        stock_idx, stock_amounts = self.valuation.held("stocks")
+        bond_idx, bond_amounts = self.valuation.held("bonds")
+        stocks_bonds_values = np.empty(days)
+        cash_values = np.empty(days)  # 条件单成交会改变现金，逐日记录
+        for offset in range(days):
+            self.day += 1
+            self.market.set_day(self.day)
+            # 使用游戏天数获取季节
+            season = self.season.current_season(self.day)
+            # 更新股票和债券价格及历史
+            self.market.update_stocks(season["stock_vol"], self.day)
+            self.market.update_bonds(season, self.day)
+            # 新价格出来后立即撮合被触发的条件单，有成交时重新取持仓数组
+            if self.order_book and self.match_orders():
+                stock_idx, stock_amounts = self.valuation.held("stocks")
+                bond_idx, bond_amounts = self.valuation.held("bonds")
+            cash_values[offset] = self.player["cash"]
+            stocks_bonds_values[offset] = (self.market.stock_engine.prices[stock_idx] @ stock_amounts +
+                                           self.market.bond_engine.prices[bond_idx] @ bond_amounts)
+
+        # 每日资产快照（批量追加，内存中保留一年数据，更早的记录在价格归档中）
+        keep = self.market.HISTORY_DAYS
+        totals = stocks_bonds_values + cash_values
+        self.total_assets_history = (self.total_assets_history + totals.tolist())[-keep:]
+        self.stocks_bonds_value_history = (self.stocks_bonds_value_history + stocks_bonds_values.tolist())[-keep:]
+        if self.market.archive is not None:
+            rows = np.column_stack([totals, stocks_bonds_values])
+            for offset in range(days):
+                self.market.archive.assets.append(self.day - days + 1 + offset, rows[offset])
 
         # TODO: 每日债务利息计算
         # TODO: 每日做空利息计算
         self.save_game()
 
     def show_trade_history(self):
-        """显示交易历史"""
+        """分页显示交易历史，可按代码、类型、操作和日期区间筛选，并按代码汇总成交和已实现盈亏"""
         print(f"\n{Fore.CYAN}=== 交易历史 ==={Style.RESET_ALL}")
-        if not self.trade_history:
+        if not self.ledger:
             print("暂无交易历史")
             return
-        # 价格显示单位修正为元，格式化
-        print("日期 | 类型 | 代码 | 操作 | 数量 | 价格(元)")
+        filters, page = {}, 1
+        while True:
+            records, total = self.ledger.query(page=page, page_size=self.TRADE_PAGE_SIZE, **filters)
+            pages = max(1, -(-total // self.TRADE_PAGE_SIZE))
+            # 价格显示单位为元，格式化为2位小数
+            print("日期 | 类型 | 代码 | 操作 | 数量 | 价格(元) | 实现盈亏(元)")
+            print("-" * 70)
+            for record in records:
+                print(f"{record['day']}日 | {record['type']} | {record['code']} | {record['action']} | "
+                      f"{record['amount']} | {record['price']:.2f} | {record['pnl']:.2f}")
+            print(f"第 {page}/{pages} 页，共 {total} 笔" + ("（已筛选）" if filters else ""))
+            choice = input("n 下一页 / p 上一页 / f 筛选 / s 按代码汇总 / 回车返回：").strip().lower()
+            if choice == 'n' and page < pages:
+                page += 1
+            elif choice == 'p' and page > 1:
+                page -= 1
+            elif choice == 'f':
+                filters, page = self._input_trade_filters(), 1
+            elif choice == 's':
+                self._show_trade_summary(filters)
+            elif choice == '':
+                return
+
+    def _input_trade_filters(self):
+        """输入交易历史的筛选条件，留空表示不限"""
+        filters = {}
+        code = input("资产代码（留空为全部）：").strip().upper()
+        if code:
+            filters["code"] = code
+        type = input("类型 股票/债券（留空为全部）：").strip()
+        if type:
+            filters["type"] = type
+        action = input("操作 买入/卖出/做空/平仓做空（留空为全部）：").strip()
+        if action:
+            filters["action"] = action
+        for key, prompt in (("start_day", "起始天（留空为不限）："), ("end_day", "结束天（留空为不限）：")):
+            value = input(prompt).strip()
+            if value:
+                try:
+                    filters[key] = int(value)
+                except ValueError:
+                    print(f"{Fore.RED}天数必须是整数，已忽略{Style.RESET_ALL}")
+        return filters
+
+    def _show_trade_summary(self, filters):
+        """按代码汇总成交笔数、成交量、成交额和已实现盈亏（按成交额排序）"""
+        summary = self.ledger.aggregate(**filters)
+        print(f"\n{Fore.CYAN}=== 按代码汇总 ==={Style.RESET_ALL}")
+        print("代码 | 笔数 | 成交量 | 成交额(元) | 已实现盈亏(元)")
         print("-" * 60)
-        # 显示最近30条，并格式化价格为元
-        for record in self.trade_history[-30:]:
-            # 确保价格是数字
-            price = float(record.get("price", 0.0)) if isinstance(record.get("price"), (int, float)) else 0.0
-            print(f"{record.get('day','未知')}日 | {record.get('type','未知')} | {record.get('code','未知')} | "
-                  f"{record.get('action','未知')} | {record.get('amount','未知')} | {price:.2f}") # 格式化价格为2位小数
+        for code, item in sorted(summary.items(), key=lambda kv: kv[1]["turnover"], reverse=True)[:self.TRADE_PAGE_SIZE]:
+            color = Fore.GREEN if item["realized_pnl"] > 0 else (Fore.RED if item["realized_pnl"] < 0 else Style.RESET_ALL)
+            print(f"{code} | {item['trades']} | {item['volume']:.0f} | {item['turnover']:.2f} | "
+                  f"{color}{item['realized_pnl']:.2f}{Style.RESET_ALL}")
+        if not summary:
+            print("没有符合条件的成交")
 
     def show_asset_history(self):
         """显示资产详细历史"""
@@ -1036,107 +3665,102 @@ class StockTycoon:
         if not asset.history:
              print("暂无价格历史数据")
         else:
+            # 可查询任意日期区间（有价格归档时不限于最近一年），留空显示最近30天
+            start_day, end_day = None, None
+            try:
+                start = input("起始天（留空显示最近30天）：").strip()
+                if start:
+                    start_day = int(start)
+                    end = input("结束天（留空为今天）：").strip()
+                    end_day = int(end) if end else None
+            except ValueError:
+                print(f"{Fore.RED}天数必须是整数，显示最近30天{Style.RESET_ALL}")
+                start_day, end_day = None, None
+            days, prices = self.price_history(asset, start_day, end_day)
+            if start_day is None:
+                days, prices = days[-30:], prices[-30:]
             # 价格显示单位修正为元，格式化
             print("日期 | 价格(元)")
             print("-" * 20)
-            # 显示最近30天价格历史，并格式化价格为元
-            for h in asset.history[-30:]:
-                # 确保历史数据是字典且价格是数字
-                if isinstance(h, dict) and isinstance(h.get("day"), int) and isinstance(h.get("price"), (int, float)):
-                    day = h["day"]
-                    price = float(h["price"])
-                    print(f"{day}日 | {price:.2f}") # 格式化价格为2位小数
-                else:
-                    print(f"历史数据格式错误: {h}")
+            print("\n".join(f"{day}日 | {price:.2f}" for day, price in zip(days.tolist(), prices.tolist()))) # 格式化价格为2位小数
 
-        # 显示操作历史
+        # 显示操作历史（来自交易账本的代码索引）
         print(f"\n{Fore.YELLOW}{asset.name} ({code}) 操作历史：{Style.RESET_ALL}")
-        if not asset.operation_history:
+        records, total = self.ledger.query(code=code, page_size=30)
+        if not records:
             print("暂无操作历史数据")
         else:
              # 价格显示单位修正为元，格式化
             print("日期 | 操作 | 数量 | 价格(元)")
             print("-" * 40)
-            # 显示最近30条操作历史，并格式化价格为元
-            for op in asset.operation_history[-30:]: # 显示最近30条
-                 # 确保操作数据是字典且包含必要键，数量和价格是数字
-                 if isinstance(op, dict) and isinstance(op.get("day"), int) and isinstance(op.get("amount"), (int, float)) and isinstance(op.get("price"), (int, float)):
-                    day = op["day"]
-                    amount = op["amount"]
-                    price = float(op["price"])
-                    action = op.get("action", "未知")
-                    # 根据操作类型调整显示
-                    action_desc = f"{action} {amount}股" if asset in self.market.stock_dict.values() else f"{action} {amount}单位"
-                    print(f"{day}日 | {action_desc} | {amount} | {price:.2f}") # 格式化价格为2位小数
-                 else:
-                    print(f"操作历史数据格式错误: {op}")
-
-
-    def record_trade(self, type, code, action, amount, price):
-        """记录交易历史"""
-        # 确保记录的数据类型正确
-        record = {
-            "day": int(self.day),
-            "type": str(type),
-            "code": str(code),
-            "action": str(action),
-            "amount": float(amount), # 数量保存为浮点数以便后续计算
-            "price": float(price) # 价格保存为浮点数
-        }
-        self.trade_history.append(record)
+            # 显示最近30条操作历史（按时间顺序），并格式化价格为元
+            unit = "股" if isinstance(asset, Asset) else "单位"
+            for op in reversed(records):
+                print(f"{op['day']}日 | {op['action']} {int(op['amount'])}{unit} | {int(op['amount'])} | {op['price']:.2f}") # 格式化价格为2位小数
+            if total > len(records):
+                print(f"（共 {total} 笔，完整记录见交易历史）")
+
+
+    def record_trade(self, type, code, action, amount, price, pnl=0.0):
+        """把一笔成交记入交易账本并返回记录，pnl为本笔实现的盈亏"""
+        record = self.ledger.append({"day": self.day, "type": type, "code": code, "action": action,
+                                     "amount": amount, "price": price, "pnl": pnl})
+        # 标记本次交易涉及的持仓和操作记录，下次保存时只把这些写入日志
+        for kind in (("stocks", "shorts") if record["type"] == "股票" else ("bonds",)):
+            self._touched_positions.add((kind, record["code"]))
+            if kind in PortfolioValuation.KINDS:
+                self.valuation.update(kind, record["code"], self.player[kind].get(record["code"]))
+        return record
 
     def screen_good_investments(self):
-        """自动筛选近指定天数内势头很猛的股票和债券"""
+        """按滚动指标多条件筛选股票和债券；只输入天数时按近N天涨幅筛选（有价格归档时可超过一年）"""
         print(f"{Fore.CYAN}=== 自动筛选好投资 ==={Style.RESET_ALL}")
+        windows = "/".join(map(str, INDICATOR_WINDOWS))
+        print(f"可用指标：price（当前价），以及下列指标加窗口天数（{windows}），如 momentum_20")
+        for family, description in INDICATOR_FAMILIES.items():
+            print(f"  {family}_N  {description}")
+        text = input("请输入筛选条件（如 momentum_20>10, volatility_20<3；直接回车不过滤；只输入天数则按近N天涨幅筛选）：").strip()
         try:
-            days = int(input("请输入筛选天数："))
-            if days <= 0:
-                print("天数必须大于0")
-                return
-        except ValueError:
-            print("无效输入，天数必须是整数")
+            if text.isdigit():
+                days, conditions, sort_by = int(text), [], None
+                if days <= 0:
+                    raise ValueError("天数必须大于0")
+            else:
+                days, conditions = None, parse_screen_conditions(text)
+                sort_by = input(f"请输入排序指标（默认 {DEFAULT_SCREEN_SORT}，前加 - 表示从小到大）：").strip().lower() or DEFAULT_SCREEN_SORT
+            top = input("每类显示前几名（默认10）：").strip() or "10"
+            if not top.isdigit() or int(top) <= 0:
+                raise ValueError("显示数量必须是正整数")
+            top = int(top)
+        except ValueError as e:
+            print(f"{Fore.RED}无效输入：{e}{Style.RESET_ALL}")
             return
-        
-        # 筛选股票
-        print(f"\n{Fore.YELLOW}股票筛选结果（近{days}天涨幅）：{Style.RESET_ALL}")
-        stock_results = []
-        for stock in self.market.stocks:
-            if len(stock.history) >= days:
-                recent_history = stock.history[-days:]
-                start_price = float(recent_history[0].get("price", 0.0))
-                end_price = float(recent_history[-1].get("price", 0.0))
-                if start_price > 0:
-                    percentage_change = (end_price - start_price) / start_price * 100
-                    stock_results.append((stock, percentage_change))
-        
-        # 按涨幅排序并显示前3名
-        stock_results.sort(key=lambda x: x[1], reverse=True)
-        for idx, (stock, change) in enumerate(stock_results[:3], 1):
-            color = Fore.GREEN if change > 0 else (Fore.RED if change < 0 else Style.RESET_ALL)
-            print(f"{idx}. {stock.code} - {stock.name}: {color}{change:.2f}%{Style.RESET_ALL}")
-        if not stock_results:
-            print("暂无足够历史数据的股票")
-        
-        # 筛选债券
-        print(f"\n{Fore.YELLOW}债券筛选结果（近{days}天涨幅）：{Style.RESET_ALL}")
-        bond_results = []
-        for bond in self.market.bonds:
-            if len(bond.history) >= days:
-                recent_history = bond.history[-days:]
-                start_price = float(recent_history[0].get("price", 0.0))
-                end_price = float(recent_history[-1].get("price", 0.0))
-                if start_price > 0:
-                    percentage_change = (end_price - start_price) / start_price * 100
-                    bond_results.append((bond, percentage_change))
-        
-        # 按涨幅排序并显示前2名
-        bond_results.sort(key=lambda x: x[1], reverse=True)
-        for idx, (bond, change) in enumerate(bond_results[:2], 1):
-            color = Fore.GREEN if change > 0 else (Fore.RED if change < 0 else Style.RESET_ALL)
-            print(f"{idx}. {bond.code} - {bond.name}: {color}{change:.2f}%{Style.RESET_ALL}")
-        if not bond_results:
-            print("暂无足够历史数据的债券")
-        
+
+        for kind, label in (("stocks", "股票"), ("bonds", "债券")):
+            assets = self.market.stocks if kind == "stocks" else self.market.bonds
+            if days is not None:
+                print(f"\n{Fore.YELLOW}{label}筛选结果（近{days}天涨幅）：{Style.RESET_ALL}")
+                # 有价格归档时可以筛选超过一年的区间
+                results = self.market.period_changes(assets, self.market.price_source(kind), days)
+                results.sort(key=lambda x: x[1], reverse=True)
+                for idx, (asset, change) in enumerate(results[:top], 1):
+                    color = Fore.GREEN if change > 0 else (Fore.RED if change < 0 else Style.RESET_ALL)
+                    print(f"{idx}. {asset.code} - {asset.name}: {color}{change:.2f}%{Style.RESET_ALL}")
+                if not results:
+                    print(f"暂无足够历史数据的{label}")
+                continue
+            try:
+                results, matched = self.market.screen_assets(kind, conditions, sort_by.lstrip("-"), top, sort_by.startswith("-"))
+            except ValueError as e:
+                print(f"{Fore.RED}错误：{e}{Style.RESET_ALL}")
+                return
+            print(f"\n{Fore.YELLOW}{label}筛选结果（{matched} 个满足条件，按 {sort_by} 排序）：{Style.RESET_ALL}")
+            for idx, (asset, values) in enumerate(results, 1):
+                columns = " | ".join(format_indicator(name, value) for name, value in values.items())
+                print(f"{idx}. {asset.code} - {asset.name}: {columns} | 价格 {asset.current_price:.2f}元")
+            if not results:
+                print(f"没有满足条件且历史数据足够的{label}")
+
         # 询问用户是否查看详情
         choice = input("\n是否查看具体详情？(y/n)：").lower()
         if choice == 'y':
@@ -1149,243 +3773,98 @@ class StockTycoon:
                 # 询问是否购买
                 buy_choice = input("是否购买该资产？(y/n)：").lower()
                 if buy_choice == 'y':
-                    if asset in self.market.stocks:
+                    if isinstance(asset, Asset):
                         self.bulk_stock_trade_for_asset(asset)
-                    elif asset in self.market.bonds:
+                    else:
                         self.buy_bonds_for_asset(asset)
             else:
                 print("无效的资产代码")
 
-    def show_horizontal_chart_for_asset(self, asset):
-        """为特定资产显示水平走势图"""
-        print(f"\n=== {asset.name} 价格走势分析 ===")
+    def show_horizontal_chart_for_asset(self, asset, days=None):
+        """为特定资产显示水平走势图；days为显示的天数，超出屏幕行数时按能放下的最细分辨率显示K线收盘价"""
+        term_width, _ = shutil.get_terminal_size()
+        self._show_chart(("asset", asset.code, self.day, term_width, days),
+                         lambda: self._asset_chart_frame(asset, days, term_width))
+
+    def _asset_chart_frame(self, asset, days, term_width):
+        """构建资产走势图的整帧文本"""
+        lines = [f"\n=== {asset.name} 价格走势分析 ==="]
         if not asset.history:
-            print("没有历史数据")
-            return
+            return "\n".join(lines + ["没有历史数据"]) + "\n"
 
         # 动态终端适配
-        term_width, _ = shutil.get_terminal_size()
         max_bar_width = max(30, term_width - 35)  # 为价格标签留出空间
-        max_days_to_show = min(len(asset.history), max_bar_width)
 
-        # 获取历史数据
-        history_to_show = asset.history[-max_days_to_show:]
-        day_count = len(history_to_show)
-        start_day_display = self.day - day_count + 1
+        # 获取K线（默认显示最近 max_bar_width 天的日K）
+        resolution, starts, ohlc = self.price_ohlc(asset, max_bar_width, self.day - (days or max_bar_width) + 1)
+        valid = ~np.isnan(ohlc[:, 3])
+        starts, ohlc = np.asarray(starts)[valid], np.asarray(ohlc)[valid]
+        if not len(ohlc):
+            return "\n".join(lines + ["没有历史数据"]) + "\n"
+        row_count = len(ohlc)
+        prices_to_show = ohlc[:, 3].tolist()  # 每行画收盘价
 
         # 计算显示参数
-        prices_to_show = [float(entry["price"]) for entry in history_to_show if isinstance(entry.get("price"), (int, float))]
-        if not prices_to_show:
-            print("历史价格数据格式错误")
-            return
-
-        min_price = min(prices_to_show) if prices_to_show else 0.0
-        max_price = max(prices_to_show) if prices_to_show else (min_price + 1.0)
+        min_price = float(np.nanmin(ohlc[:, 2]))
+        max_price = float(np.nanmax(ohlc[:, 1]))
         price_range = max(max_price - min_price, 1.0)
 
-        # 打印头部信息
-        print(f"\n{asset.name} ({asset.code}) 近期价格走势".center(term_width))
-        print(f"当前第 {self.day} 天 | 显示最近 {day_count} 个交易日".center(term_width))
-        print(f"历史价格范围：{min_price:.2f}元 ~ {max_price:.2f}元".center(term_width))
-
-        # 绘制走势图
-        for idx in range(day_count):
-            current_entry = history_to_show[idx]
-            current_price = float(current_entry.get("price", 0.0)) if isinstance(current_entry.get("price"), (int, float)) else 0.0
-            prev_price = float(history_to_show[idx-1].get("price", 0.0)) if idx > 0 and isinstance(history_to_show[idx-1].get("price"), (int, float)) else current_price
-
-            norm_val = (current_price - min_price) / price_range if price_range > 0 else 0.0
-            bar_width = max(1, int(norm_val * max_bar_width))
-
-            color = Style.RESET_ALL
-            if idx > 0:
-                if current_price > prev_price:
-                    color = Fore.GREEN
-                elif current_price < prev_price:
-                    color = Fore.RED
-
-            bar = f"{color}{'█' * bar_width}"
-            price_label = f"{Style.RESET_ALL}{current_price:,.2f}元".replace(",", "_").rjust(12)
-            day_label = f" (第{start_day_display + idx}天)" if idx % 5 == 0 or idx == day_count-1 else ""
-
-            line = f"{bar}{price_label}{day_label}"
-            print(line.ljust(term_width))
-
-        # 图例说明
-        print(f"\n{Fore.YELLOW}图例说明：{Style.RESET_ALL}")
-        print(f"{Fore.GREEN}███绿色：当日价格上涨{Style.RESET_ALL}")
-        print(f"{Fore.RED}███红色：当日价格下跌{Style.RESET_ALL}")
-        print("███白色：当日价格无变化或首日")
-        print("柱状长度反映相对价格区间，非绝对涨跌幅")
-        print("（注意：由于终端字符限制，图表精度有限）")
-
-    def bulk_stock_trade_for_asset(self, stock):
-        """为特定股票执行交易"""
+        # 头部信息
+        lines.append(f"\n{asset.name} ({asset.code}) 近期价格走势".center(term_width))
+        if resolution == "日":
+            lines.append(f"当前第 {self.day} 天 | 显示最近 {row_count} 个交易日".center(term_width))
+        else:
+            lines.append(f"当前第 {self.day} 天 | {resolution}K线 {row_count} 根（每行为该{resolution}收盘价）".center(term_width))
+        lines.append(f"历史价格范围：{min_price:.2f}元 ~ {max_price:.2f}元".center(term_width))
+
+        # 走势图：横条长度和涨跌颜色整列计算，每5行和最后一行标注日期
+        suffix = "" if resolution == "日" else "起"
+        starts = starts.tolist()
+        lines += [f"{color}{'█' * length}{f'{Style.RESET_ALL}{price:,.2f}元'.replace(',', '_').rjust(12)}"
+                  + (f" (第{starts[idx]}天{suffix})" if idx % 5 == 0 or idx == row_count - 1 else "")
+                  for idx, (color, length, price) in enumerate(zip(bar_colors(prices_to_show),
+                                                                   bar_lengths(prices_to_show, min_price, price_range, max_bar_width, 1),
+                                                                   prices_to_show))]
+        lines += legend_lines("价格", resolution)
+        return "\n".join(lines) + "\n"
+
+    def bulk_stock_trade_for_asset(self, stock, quick=True):
+        """为特定股票执行交易
+
+        默认是筛选结果中的快捷交易：不做土豪模式数量校验，经验规则见 execute_stock_order；
+        股票交易菜单以 quick=False 调用，按常规规则校验和增加经验。
+        """
         print(f"\n{Fore.CYAN}=== 股票交易 - {stock.name} ==={Style.RESET_ALL}")
-        action = input("请选择操作 (1.买入 / 2.卖出 / 3.做空 / 4.平仓做空): ")
-
-        amount = 0.0
-        if action in ["1", "2", "3"]:
-            try:
-                amount = int(input(f"操作数量（当前价：{stock.current_price:.2f}元/股）："))
-                if amount <= 0:
-                    raise ValueError("数量必须为正整数")
-                amount = float(amount)
-            except ValueError as e:
-                print(f"{Fore.RED}错误：{e}{Style.RESET_ALL}")
-                return
-
-        if action == "1":
-            total_cost = stock.current_price * amount
-            current_cash = float(self.player.get("cash", 0.0)) if isinstance(self.player.get("cash", 0), (int, float)) else 0.0
-            if total_cost > current_cash:
-                print(f"{Fore.RED}错误：资金不足，需要{total_cost:.2f}元{Style.RESET_ALL}")
-            else:
-                self.player["cash"] = current_cash - total_cost
-                stocks = self.player.get("stocks", {})
-                if isinstance(stocks, dict):
-                    current_holding = float(stocks.get(stock.code, {}).get("amount", 0.0)) if isinstance(stocks.get(stock.code), dict) else 0.0
-                    stocks[stock.code] = {"amount": current_holding + amount, "avg_price": float(stocks.get(stock.code, {}).get("avg_price", stock.current_price))}
-                    self.player["stocks"] = stocks
-                print(f"{Fore.GREEN}成功买入 {int(amount)} 股 {stock.name}{Style.RESET_ALL}")
-                stock.operation_history.append({
-                    "day": self.day,
-                    "action": "买入",
-                    "amount": int(amount),
-                    "price": stock.current_price
-                })
-                self.record_trade("股票", stock.code, "买入", amount, stock.current_price)
-                self.save_game()
-        elif action == "2":
-            stocks = self.player.get("stocks", {})
-            current_holding = float(stocks.get(stock.code, {}).get("amount", 0.0)) if isinstance(stocks, dict) else 0.0
-            if current_holding < amount:
-                print(f"{Fore.RED}错误：持仓不足，当前持有 {int(current_holding)} 股{Style.RESET_ALL}")
-                return
-
-            total_income = stock.current_price * amount
-            avg_price = float(stocks[stock.code].get("avg_price", 0.0)) if isinstance(stocks.get(stock.code), dict) and "avg_price" in stocks.get(stock.code) else 0.0
-            profit_loss = (stock.current_price - avg_price) * amount
-
-            self.player["cash"] = float(self.player.get("cash", 0.0)) + total_income if isinstance(self.player.get("cash", 0.0), (int, float)) else total_income
-
-            if isinstance(stocks, dict):
-                holding_data = stocks.get(stock.code)
-                if isinstance(holding_data, dict) and "amount" in holding_data:
-                    new_holding_amount = float(holding_data["amount"]) - amount
-                    if new_holding_amount <= 0.0:
-                        if stock.code in stocks:
-                            del stocks[stock.code]
-                    else:
-                        holding_data["amount"] = new_holding_amount
-                        stocks[stock.code] = holding_data
-                else:
-                    print(f"{Fore.RED}内部错误：卖出时获取持仓数据异常 for {stock.code}{Style.RESET_ALL}")
-                    return
-                self.player["stocks"] = stocks
-
-            print(f"{Fore.GREEN}成功卖出 {int(amount)} 股 {stock.name}，获得{total_income:.2f}元{Style.RESET_ALL}")
-            print(f"{Fore.GREEN}本次交易盈亏：{profit_loss:.2f}元{Style.RESET_ALL}")
-
-            if profit_loss > 0:
-                self.add_exp(int(profit_loss / 1000))  # 盈利每1000元增加1点经验
-
-            stock.operation_history.append({
-                "day": self.day,
-                "action": "卖出",
-                "amount": int(amount),
-                "price": stock.current_price
-            })
-            self.record_trade("股票", stock.code, "卖出", amount, stock.current_price)
-            self.save_game()
-        elif action == "3":
-            margin_required = stock.current_price * amount * 0.5
-            current_cash = float(self.player.get("cash", 0.0)) if isinstance(self.player.get("cash", 0), (int, float)) else 0.0
-            if current_cash < margin_required:
-                print(f"{Fore.RED}错误：保证金不足，需要{margin_required:.2f}元{Style.RESET_ALL}")
-                return
-
-            shorts = self.player.get("shorts", {})
-            if not isinstance(shorts, dict):
-                shorts = {}
+        choice = input("请选择操作 (1.买入 / 2.卖出 / 3.做空 / 4.平仓做空): ")
+        action = {"1": "buy", "2": "sell", "3": "short", "4": "cover"}.get(choice)
+        if action is None:
+            print(f"{Fore.RED}错误：无效的操作选择{Style.RESET_ALL}")
+            # 不需要保存游戏，因为没有成功交易
+            return
 
-            if stock.code in shorts and isinstance(shorts[stock.code], list) and len(shorts[stock.code]) >= 3:
-                existing_amount = float(shorts[stock.code][0])
-                existing_borrow_price = float(shorts[stock.code][1])
-                new_total_amount = existing_amount + amount
-                new_borrow_price = ((existing_borrow_price * existing_amount) + (stock.current_price * amount)) / new_total_amount if new_total_amount > 0 else 0.0
-                shorts[stock.code] = [new_total_amount, new_borrow_price, self.day]
+        try:
+            if action == "cover":
+                position = self.player["shorts"].get(stock.code)
+                if not position:
+                    raise ValueError("没有该股票的做空仓位")
+                amount = int(input(f"平仓数量（当前做空：{int(position.amount)}股）：")) # 数量显示为整数
             else:
-                shorts[stock.code] = [float(amount), float(stock.current_price), self.day]
-
-            self.player["cash"] = current_cash + stock.current_price * amount - margin_required
-            self.player["shorts"] = shorts
-
-            print(f"{Fore.GREEN}成功做空 {int(amount)} 股 {stock.name}，保证金已扣除{margin_required:.2f}元{Style.RESET_ALL}")
-            stock.operation_history.append({
-                "day": self.day,
-                "action": "做空",
-                "amount": int(amount),
-                "price": stock.current_price
-            })
-            self.record_trade("股票", stock.code, "做空", amount, stock.current_price)
-            self.save_game()
-        elif action == "4":
-            amount_to_cover = 0.0
-            try:
-                shorts = self.player.get("shorts", {})
-                if not isinstance(shorts, dict) or stock.code not in shorts or not isinstance(shorts[stock.code], list) or len(shorts[stock.code]) < 3:
-                    print(f"{Fore.RED}错误：没有该股票的做空仓位或数据异常{Style.RESET_ALL}")
-                    return
-                current_short_amount = float(shorts[stock.code][0]) if isinstance(shorts[stock.code][0], (int, float)) else 0.0
-
-                amount_to_cover = int(input(f"平仓数量（当前做空：{int(current_short_amount)}股）："))
-                if amount_to_cover <= 0 or amount_to_cover > current_short_amount:
-                    print(f"{Fore.RED}错误：无效或超过做空数量{Style.RESET_ALL}")
-                    return
-                amount_to_cover = float(amount_to_cover)
-            except ValueError as e:
-                print(f"{Fore.RED}错误：{e}{Style.RESET_ALL}")
-                return
-
-            short_data = shorts[stock.code]
-            borrow_price = float(short_data[1])
-            original_short_amount = float(short_data[0])
-
-            buyback_cost = stock.current_price * amount_to_cover
-            current_cash = float(self.player.get("cash", 0.0)) if isinstance(self.player.get("cash", 0), (int, float)) else 0.0
-            if current_cash < buyback_cost:
-                print(f"{Fore.RED}错误：现金不足，需要{buyback_cost:.2f}元{Style.RESET_ALL}")
+                amount = int(input(f"操作数量（当前价：{stock.current_price:.2f}元/股）："))
+            if amount <= 0:
+                raise ValueError("数量必须为正整数")
+            amount = float(amount)
+            # 验证土豪模式
+            if not quick and action in ("buy", "short") and not self.validate_tycoon_purchase(amount):
                 return
-
-            profit_per_share = borrow_price - stock.current_price
-            total_profit = profit_per_share * amount_to_cover
-
-            returned_margin = (amount_to_cover / original_short_amount) * (borrow_price * original_short_amount * 0.5) if original_short_amount > 0 else 0.0
-            self.player["cash"] = current_cash + total_profit + returned_margin
-
-            short_data[0] = original_short_amount - amount_to_cover
-            if short_data[0] <= 0.0:
-                del shorts[stock.code]
-            else:
-                shorts[stock.code] = short_data
-
-            self.player["shorts"] = shorts
-            print(f"{Fore.GREEN}平仓 {int(amount_to_cover)} 股成功，净盈亏：{total_profit:.2f}元{Style.RESET_ALL}")
-            stock.operation_history.append({
-                "day": self.day,
-                "action": "平仓",
-                "amount": int(amount_to_cover),
-                "price": stock.current_price
-            })
-            self.record_trade("股票", stock.code, "平仓做空", amount_to_cover, stock.current_price)
-            self.save_game()
-        else:
-            print(f"{Fore.RED}错误：无效的操作选择{Style.RESET_ALL}")
+            self.execute_stock_order(stock, action, amount, quick)
+        except ValueError as e:
+            print(f"{Fore.RED}错误：{e}{Style.RESET_ALL}")
             return
+        # 成功交易后保存游戏
+        self.save_game()
 
-    def buy_bonds_for_asset(self, bond):
-        """为特定债券执行购买"""
+    def buy_bonds_for_asset(self, bond, quick=True):
+        """为特定债券执行购买；默认是筛选结果中的快捷购买（不校验土豪模式、不加经验），债券菜单以 quick=False 调用"""
         print(f"\n{Fore.CYAN}=== 债券购买 - {bond.name} ==={Style.RESET_ALL}")
         try:
             amount = int(input("请输入购买数量："))
@@ -1395,38 +3874,106 @@ class StockTycoon:
         except ValueError:
             print("无效的数量")
             return
+        # 验证土豪模式
+        if not quick and not self.validate_tycoon_purchase(amount):
+            return
 
-        total_cost = bond.current_price * amount
-        current_cash = float(self.player.get('cash', 0.0)) if isinstance(self.player.get('cash', 0), (int, float)) else 0.0
-        if total_cost > current_cash:
-            print("资金不足")
+        try:
+            self.execute_bond_order(bond, "buy", amount, quick)
+        except ValueError as e:
+            print(e)
             return
+        self.save_game()
 
-        self.player['cash'] = current_cash - total_cost
-        bonds = self.player.get('bonds', {})
-        if not isinstance(bonds, dict):
-            bonds = {}
-
-        if bond.code in bonds:
-            existing_amount = float(bonds[bond.code].get("amount", 0.0))
-            existing_avg_price = float(bonds[bond.code].get("avg_price", 0.0))
-            new_total_amount = existing_amount + amount
-            new_avg_price = ((existing_avg_price * existing_amount) + (bond.current_price * amount)) / new_total_amount if new_total_amount > 0 else 0.0
-            bonds[bond.code] = {"amount": new_total_amount, "avg_price": new_avg_price}
-        else:
-            bonds[bond.code] = {"amount": amount, "avg_price": bond.current_price}
+    def project_wealth(self, horizon=365, paths=10000, workers=None, seed=None):
+        """蒙特卡洛预测未来horizon天后的总资产分布"""
+        return simulate_wealth_distribution(self, horizon, paths, workers, seed)
 
-        self.player['bonds'] = bonds
+    def show_wealth_projection(self):
+        """交互式显示总资产的蒙特卡洛预测"""
+        print(f"{Fore.CYAN}=== 未来财富预测 ==={Style.RESET_ALL}")
+        try:
+            horizon = int(input("请输入预测天数：") or 365)
+            paths = int(input("请输入模拟路径数（默认10000）：") or 10000)
+            if horizon <= 0 or paths <= 0:
+                raise ValueError
+        except ValueError:
+            print("无效输入，天数和路径数必须是正整数")
+            return
 
-        print(f"成功购买 {int(amount)} 单位 {bond.name}")
-        bond.operation_history.append({
-            "day": self.day,
-            "action": "买入",
-            "amount": int(amount),
-            "price": bond.current_price
-        })
-        self.record_trade("债券", bond.code, "买入", amount, bond.current_price)
-        self.save_game()
+        start = time.time()
+        result = self.project_wealth(horizon, paths)
+        elapsed = time.time() - start
+
+        print(f"\n基于 {result['paths']} 条路径预测第 {self.day + horizon} 天的总资产（耗时 {elapsed:.2f} 秒）")
+        print(f"当前总资产：{result['current']:.2f}元")
+        print(f"期望总资产：{result['expected']:.2f}元 (标准差 {result['std']:.2f}元)")
+        for pct, value in result["percentiles"].items():
+            change = value - result["current"]
+            color = Fore.GREEN if change > 0 else (Fore.RED if change < 0 else Style.RESET_ALL)
+            print(f"  {pct:>2}% 分位：{value:.2f}元 ({color}{change:+.2f}元{Style.RESET_ALL})")
+        loss_color = Fore.RED if result["prob_loss"] > 0.5 else Fore.GREEN
+        print(f"亏损概率：{loss_color}{result['prob_loss'] * 100:.1f}%{Style.RESET_ALL}")
+
+    def export_charts(self, directory=None, workers=None, force=False):
+        """把每只股票、债券的全部价格历史和总资产趋势导出为PNG
+
+        导出目录中的清单记录每张图表对应的历史签名，只重画上次导出后历史有变化的图表（force 时全部重画）；
+        需要重画的图表分给多个进程并行渲染。返回导出目录、重画和跳过的图表数。
+        """
+        if directory is None:
+            directory = os.path.join(CHART_EXPORT_DIRECTORY, os.path.splitext(self.current_save or "memory")[0])
+        os.makedirs(directory, exist_ok=True)
+        manifest_path = os.path.join(directory, CHART_EXPORT_MANIFEST)
+        manifest = {}
+        if not force and os.path.exists(manifest_path):
+            try:
+                with open(manifest_path, 'r', encoding='utf-8') as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                manifest = {}  # 清单损坏时全部重画
+
+        self.flush_saves()  # SQLite存档的价格历史在数据库中，先让待写入的价格落盘
+        series = [(asset.code, f"{asset.name} ({asset.code})", "价格(元)") + tuple(self.price_history(asset))
+                  for asset in self.market.stocks + self.market.bonds]
+        series.append((TOTAL_ASSETS_CHART, "总资产趋势", "总资产(元)") + tuple(self.asset_history()))
+
+        signatures, jobs = {}, []
+        for name, title, ylabel, days, values in series:
+            signature = history_signature(days, values)
+            if signature is None:
+                continue
+            signatures[name] = signature
+            path = os.path.join(directory, f"{name}.png")
+            if manifest.get(name) != signature or not os.path.exists(path):
+                jobs.append((path, title, np.array(days), np.array(values), ylabel))  # 复制出归档视图，子进程只收到数组本身
+
+        workers = workers or os.cpu_count() or 1
+        if workers <= 1 or len(jobs) <= 1:
+            for job in jobs:
+                _render_chart_png(job)
+        else:
+            workers = min(workers, len(jobs))
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                list(pool.map(_render_chart_png, jobs, chunksize=max(1, len(jobs) // (workers * 4))))
+        atomic_write(manifest_path, 'w', lambda f: json.dump(signatures, f))
+        return {"directory": directory, "rendered": len(jobs), "skipped": len(signatures) - len(jobs)}
+
+    def show_chart_export(self):
+        """交互式导出PNG走势图"""
+        print(f"{Fore.CYAN}=== 导出PNG走势图 ==={Style.RESET_ALL}")
+        force = input("是否重画全部图表？(y/n，默认只重画有变化的图表)：").strip().lower() == 'y'
+        start = time.time()
+        try:
+            result = self.export_charts(force=force)
+        except ImportError:
+            print(f"{Fore.RED}错误：导出图表需要matplotlib，请先 pip install -r requirements.txt{Style.RESET_ALL}")
+            return
+        except OSError as e:
+            print(f"{Fore.RED}错误：导出失败：{e}{Style.RESET_ALL}")
+            return
+        print(f"{Fore.GREEN}已导出 {result['rendered']} 张图表到 {result['directory']}，"
+              f"{result['skipped']} 张没有变化已跳过（耗时 {time.time() - start:.2f} 秒）{Style.RESET_ALL}")
 
     def add_exp(self, amount):
         """增加经验并检查是否升级"""
@@ -1448,38 +3995,15 @@ def main_menu(game):
         print(f"等级：{game.player['level']} | 经验：{game.player['exp']}/{game.player['exp_to_next_level']}")
         cash_display = float(game.player.get('cash', 0.0))
         debt_display = float(game.player.get('debt', 0.0))
-        # 计算股票和债券的总价值，并显示详细拆分
-        stocks_total_value = 0.0
-        stocks_profit_loss = 0.0
-        stocks_dict = game.player.get('stocks', {})
-        stocks_breakdown = []
-        if isinstance(stocks_dict, dict):
-            for code, holding_data in stocks_dict.items():
-                if isinstance(holding_data, dict) and isinstance(holding_data.get("amount"), (int, float)):
-                    stock = game.market.stock_dict.get(code)
-                    if stock:
-                        value = float(stock.current_price) * float(holding_data["amount"])
-                        profit_loss = (float(stock.current_price) - float(holding_data.get("avg_price", 0.0))) * float(holding_data["amount"])
-                        stocks_total_value += value
-                        stocks_profit_loss += profit_loss
-                        stocks_breakdown.append(f"{value:.2f}")
-        bonds_total_value = 0.0
-        bonds_profit_loss = 0.0
-        bonds_dict = game.player.get('bonds', {})
-        bonds_breakdown = []
-        if isinstance(bonds_dict, dict):
-            for code, holding_data in bonds_dict.items():
-                if isinstance(holding_data, dict) and isinstance(holding_data.get("amount"), (int, float)):
-                    bond = game.market.bond_dict.get(code)
-                    if bond:
-                        value = float(bond.current_price) * float(holding_data["amount"])
-                        profit_loss = (float(bond.current_price) - float(holding_data.get("avg_price", 0.0))) * float(holding_data["amount"])
-                        bonds_total_value += value
-                        bonds_profit_loss += profit_loss
-                        bonds_breakdown.append(f"{value:.2f}")
+        # 股票和债券的总价值及详细拆分由估值组件增量维护，刷新菜单不再遍历持仓
+        valuation = game.valuation
+        stocks_total_value = valuation.value("stocks")
+        stocks_profit_loss = valuation.profit_loss("stocks")
+        bonds_total_value = valuation.value("bonds")
+        bonds_profit_loss = valuation.profit_loss("bonds")
         stocks_bonds_total_value = stocks_total_value + bonds_total_value
-        stocks_breakdown_str = '+'.join(stocks_breakdown) if stocks_breakdown else '0.00'
-        bonds_breakdown_str = '+'.join(bonds_breakdown) if bonds_breakdown else '0.00'
+        stocks_breakdown_str = valuation.breakdown("stocks")
+        bonds_breakdown_str = valuation.breakdown("bonds")
         print(f"股票总价值：{stocks_breakdown_str}={stocks_total_value:.2f}元")
         stocks_color = Fore.GREEN if stocks_profit_loss > 0 else (Fore.RED if stocks_profit_loss < 0 else Style.RESET_ALL)
         print(f"股票盈亏：{stocks_color}{stocks_profit_loss:.2f}元{Style.RESET_ALL}")
@@ -1512,6 +4036,9 @@ def main_menu(game):
         print("7. 自动筛选好投资")
         print("8. 存档管理")
         print("9. 保存并退出")
+        print("10. 高级工具")
+        print("11. 条件单（限价/止损/止盈）")
+        print("12. 查看总资产趋势")
 
         choice = input("请选择操作：")
 
@@ -1527,35 +4054,15 @@ def main_menu(game):
         elif choice == "3":
             game.show_portfolio()
         elif choice == "4":
+            # 每日结算会同时更新总资产和股票+债券总价值的历史记录并保存
             game.daily_update()
-            # 在每日更新后保存股票和债券总价值的历史记录
-            stocks_bonds_total_value = 0.0
-            stocks_dict = game.player.get('stocks', {})
-            if isinstance(stocks_dict, dict):
-                for code, holding_data in stocks_dict.items():
-                    if isinstance(holding_data, dict) and isinstance(holding_data.get("amount"), (int, float)):
-                        stock = game.market.stock_dict.get(code)
-                        if stock:
-                            stocks_bonds_total_value += float(stock.current_price) * float(holding_data["amount"])
-            bonds_dict = game.player.get('bonds', {})
-            if isinstance(bonds_dict, dict):
-                for code, holding_data in bonds_dict.items():
-                    if isinstance(holding_data, dict) and isinstance(holding_data.get("amount"), (int, float)):
-                        bond = game.market.bond_dict.get(code)
-                        if bond:
-                            stocks_bonds_total_value += float(bond.current_price) * float(holding_data["amount"])
-            game.stocks_bonds_value_history.append(stocks_bonds_total_value)
-            if len(game.stocks_bonds_value_history) > 365:  # 保留一年数据
-                game.stocks_bonds_value_history.pop(0)
-            game.save_game()
         elif choice == "5":
             game.show_trade_history()
         elif choice == "6":
             # 在显示走势图前列出资产列表
             print(f"\n{Fore.YELLOW}=== 可查看资产列表 ==={Style.RESET_ALL}")
             print(f"{Fore.CYAN}--- 股票 ---{Style.RESET_ALL}")
-            for stock in game.market.stocks:
-                print(f"  {stock.code}: {stock.name}")
+            print("\n".join(f"  {stock.code}: {stock.name}" for stock in game.market.stocks))
             print(f"{Fore.CYAN}--- 债券 ---{Style.RESET_ALL}")
             for bond in game.market.bonds:
                 print(f"  {bond.code}: {bond.name}")
@@ -1566,46 +4073,109 @@ def main_menu(game):
         elif choice == "8":
             manage_saves(game)
         elif choice == "9":
-            game.save_game()
+            game.save_game(snapshot=True)
+            game.flush_saves()
             print(f"{Fore.GREEN}游戏已保存，再见！{Style.RESET_ALL}")
             break
+        elif choice == "10":
+            advanced_tools_menu(game)
+        elif choice == "11":
+            orders_menu(game)
+        elif choice == "12":
+            game.show_total_assets_trend()
         else:
             print("无效输入！")
 
+def orders_menu(game):
+    """条件单子菜单"""
+    while True:
+        game.show_orders()
+        print("\n1. 新建条件单")
+        print("2. 撤销条件单")
+        print("3. 返回主菜单")
+
+        choice = input("请选择操作：")
+
+        if choice == '1':
+            game.create_order()
+        elif choice == '2':
+            try:
+                order = game.cancel_order(int(input("请输入要撤销的挂单编号：").lstrip('#')))
+            except ValueError:
+                order = None
+            if order is None:
+                print(f"{Fore.RED}无效的挂单编号{Style.RESET_ALL}")
+            else:
+                print(f"已撤销挂单 #{order.id}")
+                game.save_game()
+        elif choice == '3':
+            return
+        else:
+            print(f"{Fore.RED}无效的输入{Style.RESET_ALL}")
+
+def show_backtests():
+    """交互式并行回测内置的策略/参数组合"""
+    print(f"{Fore.CYAN}=== 策略回测 ==={Style.RESET_ALL}")
+    try:
+        days = int(input("请输入回测天数（默认365）：") or 365)
+        seed_text = input("请输入随机种子（留空则随机）：").strip()
+        seed = int(seed_text) if seed_text else None
+        if days <= 0:
+            raise ValueError
+    except ValueError:
+        print("无效输入，天数和种子必须是整数")
+        return
+    combos = default_backtest_grid()
+    start = time.time()
+    results = run_backtests(combos, days, seed)
+    print(f"\n回测 {len(combos)} 组策略参数，每组 {days} 天（耗时 {time.time() - start:.2f} 秒）")
+    print_backtest_results(results)
+
+def advanced_tools_menu(game):
+    """高级工具子菜单"""
+    while True:
+        print(f"\n{Fore.CYAN}=== 高级工具 ==={Style.RESET_ALL}")
+        print("1. 未来财富预测（蒙特卡洛）")
+        print("2. 批量执行订单文件")
+        print("3. 策略回测")
+        print("4. 导出PNG走势图")
+        print("5. 返回主菜单")
+
+        choice = input("请选择操作：")
+
+        if choice == '1':
+            game.show_wealth_projection()
+        elif choice == '2':
+            game.run_order_file()
+        elif choice == '3':
+            show_backtests()
+        elif choice == '4':
+            game.show_chart_export()
+        elif choice == '5':
+            return
+        else:
+            print(f"{Fore.RED}无效的输入{Style.RESET_ALL}")
+
 def select_save():
-    """启动时选择存档"""
+    """启动时选择存档（摘要信息来自存档目录索引，不需要解析每个存档）"""
     if not os.path.exists('saves'):
         os.makedirs('saves')
     
-    save_files = [f for f in os.listdir('saves') if f.endswith('.json')]
     print(f"\n{Fore.CYAN}=== 存档选择 ==={Style.RESET_ALL}")
     
-    if not save_files:
+    if list_save_files():
+        print("请选择存档：")
+        selected = browse_saves(SaveCatalog('saves'), {"n": ("新建存档", None)})
+        if selected is not None:
+            return selected
+    else:
         print("暂无存档，创建新存档")
-        while True:
-            new_name = input("请输入新存档名称（无需扩展名）: ").strip()
-            if new_name:
-                return f"{new_name}.json"
-            print("名称不能为空")
-    
-    print("请选择存档：")
-    for idx, save in enumerate(save_files):
-        print(f"{idx+1}. {save}")
-    print(f"{len(save_files)+1}. 新建存档")
     
     while True:
-        choice = input("请输入选择（数字）: ").strip()
-        if choice.isdigit():
-            choice = int(choice)
-            if 1 <= choice <= len(save_files):
-                return save_files[choice-1]
-            elif choice == len(save_files)+1:
-                while True:
-                    new_name = input("请输入新存档名称（无需扩展名）: ").strip()
-                    if new_name:
-                        return f"{new_name}.json"
-                    print("名称不能为空")
-        print("输入无效，请重新输入")
+        new_name = input("请输入新存档名称（无扩展名时使用 .json，.npz/.db 为二进制/SQLite存档）: ").strip()
+        if new_name:
+            return new_name if new_name.endswith(SAVE_EXTENSIONS) else f"{new_name}.json"
+        print("名称不能为空")
 
 def manage_saves(game):
     """存档管理子菜单"""
@@ -1616,7 +4186,8 @@ def manage_saves(game):
         print("3. 加载其他存档")
         print("4. 删除存档")
         print(f"5. 土豪模式: {'开启' if game.tycoon_mode else '关闭'}") # 直接显示当前状态，不显示锁定
-        print("6. 返回主菜单")
+        print("6. 迁移JSON存档为二进制/SQLite格式")
+        print("7. 返回主菜单")
         
         choice = input("请选择操作：")
         
@@ -1625,13 +4196,14 @@ def manage_saves(game):
             print(f"{Fore.GREEN}当前进度已保存至 {game.current_save}{Style.RESET_ALL}")
         
         elif choice == '2':
-            new_name = input("请输入新存档名称（无需扩展名）: ").strip()
+            new_name = input("请输入新存档名称（无扩展名时使用 .json，.npz/.db 为二进制/SQLite存档）: ").strip()
             if new_name:
-                new_save = f"{new_name}.json"
+                new_save = new_name if new_name.endswith(SAVE_EXTENSIONS) else f"{new_name}.json"
                 old_save = game.current_save
                 
                 game.current_save = new_save
                 game.save_game()
+                game.flush_saves()
                 
                 switch = input(f"是否切换到新存档 {new_save}？(y/n): ").lower()
                 if switch == 'y':
@@ -1642,81 +4214,541 @@ def manage_saves(game):
             print(f"{Fore.RED}无效的存档名称{Style.RESET_ALL}")
         
         elif choice == '3':
-            saves = [f for f in os.listdir('saves') if f.endswith('.json')]
+            saves = list_save_files()
             if not saves:
                 print(f"{Fore.YELLOW}暂无其他存档{Style.RESET_ALL}")
                 continue
             
             print(f"\n{Fore.CYAN}=== 可用存档 ==={Style.RESET_ALL}")
-            for idx, save in enumerate(saves):
-                print(f"{idx+1}. {save}")
-            print("0. 取消")
-            
-            load_choice = input("请选择要加载的存档（数字）: ").strip()
-            if load_choice == '0':
-                continue
-            if not load_choice.isdigit():
-                print(f"{Fore.RED}请输入数字{Style.RESET_ALL}")
+            game.flush_saves()  # 让存档目录反映最新写入
+            selected = browse_saves(game.catalog, {"0": ("取消", None)})
+            if selected is None:
                 continue
             
-            load_choice = int(load_choice)
-            if 1 <= load_choice <= len(saves):
-                selected = saves[load_choice-1]
-                
-                save_current = input("是否先保存当前进度？(y/n): ").lower()
-                if save_current == 'y':
-                    game.save_game()
-                
-                game.current_save = selected
-                game.load_game()
-                print(f"{Fore.GREEN}已加载存档 {selected}{Style.RESET_ALL}")
-                return
-            print(f"{Fore.RED}无效的选择{Style.RESET_ALL}")
+            save_current = input("是否先保存当前进度？(y/n): ").lower()
+            if save_current == 'y':
+                game.save_game()
+            game.flush_saves()
+            
+            game.current_save = selected
+            game.load_game()
+            print(f"{Fore.GREEN}已加载存档 {selected}{Style.RESET_ALL}")
+            return
         
         elif choice == '4':
-            saves = [f for f in os.listdir('saves') if f.endswith('.json')]
+            saves = list_save_files()
             if not saves:
                 print(f"{Fore.YELLOW}暂无存档可删除{Style.RESET_ALL}")
                 continue
             
             print(f"\n{Fore.CYAN}=== 删除存档 ==={Style.RESET_ALL}")
-            for idx, save in enumerate(saves):
-                print(f"{idx+1}. {save}")
-            print("0. 取消")
-            
-            del_choice = input("请选择要删除的存档（数字）: ").strip()
-            if del_choice == '0':
-                continue
-            if not del_choice.isdigit():
-                print(f"{Fore.RED}请输入数字{Style.RESET_ALL}")
+            game.flush_saves()  # 避免待写入的存档在删除后重新出现
+            selected = browse_saves(game.catalog, {"0": ("取消", None)})
+            if selected is None:
                 continue
             
-            del_choice = int(del_choice)
-            if 1 <= del_choice <= len(saves):
-                selected = saves[del_choice-1]
-                confirm = input(f"确认删除存档 {selected}？此操作不可恢复！(y/n): ").lower()
-                if confirm == 'y':
-                    try:
-                        os.remove(os.path.join('saves', selected))
-                        print(f"{Fore.GREEN}存档 {selected} 已删除{Style.RESET_ALL}")
-                        if selected == game.current_save:
-                            game.current_save = 'default_save.json'
-                            print(f"{Fore.YELLOW}当前存档已重置为默认存档{Style.RESET_ALL}")
-                    except Exception as e:
-                        print(f"{Fore.RED}删除失败：{str(e)}{Style.RESET_ALL}")
-            else:
-                print(f"{Fore.RED}无效的选择{Style.RESET_ALL}")
+            confirm = input(f"确认删除存档 {selected}？此操作不可恢复！(y/n): ").lower()
+            if confirm == 'y':
+                try:
+                    game.close_sqlite()  # 删除SQLite存档前先关闭连接和价格归档
+                    game.close_archive()
+                    remove_save_files(os.path.join('saves', selected))
+                    print(f"{Fore.GREEN}存档 {selected} 已删除{Style.RESET_ALL}")
+                    if selected == game.current_save:
+                        game.current_save = 'default_save.json'
+                        print(f"{Fore.YELLOW}当前存档已重置为默认存档{Style.RESET_ALL}")
+                except Exception as e:
+                    print(f"{Fore.RED}删除失败：{str(e)}{Style.RESET_ALL}")
         
         elif choice == '5':
             game.toggle_tycoon_mode()
         
         elif choice == '6':
+            extension = {'1': BINARY_SAVE_EXTENSION, '2': SQLITE_SAVE_EXTENSION}.get(
+                input("目标格式（1. 二进制 .npz  2. SQLite .db）: ").strip())
+            if extension is None:
+                print(f"{Fore.RED}无效的格式{Style.RESET_ALL}")
+                continue
+            confirm = input(f"将所有JSON存档转换为 {extension} 格式（原文件保留为 .json.bak），是否继续？(y/n): ").lower()
+            if confirm != 'y':
+                continue
+            game.save_game(snapshot=True)
+            game.flush_saves()
+            migrated = migrate_json_saves(extension)
+            for old_save, new_save in migrated:
+                print(f"{Fore.GREEN}{old_save} -> {new_save}{Style.RESET_ALL}")
+                if old_save == game.current_save:
+                    game.current_save = new_save
+            print(f"共迁移 {len(migrated)} 个存档")
+        
+        elif choice == '7':
             return
         
         else:
             print(f"{Fore.RED}无效的输入{Style.RESET_ALL}")
 
+# ========== 多人服务器 ==========
+SERVER_TICK_SECONDS = 1.0  # 默认每秒推进一天
+
+class MarketServer:
+    """本地多人服务器：所有玩家共享一个权威市场，按固定节拍推进价格；订单先排队，在每个节拍的价格更新后按到达顺序统一成交
+
+    协议为按行分隔的JSON，同一连接上的响应按请求顺序返回（带回请求中的 id）：
+    {"op": "join", "player": 名称}、{"op": "order", "code", "action", "amount"}、{"op": "portfolio"}、
+    {"op": "quote", "codes": [代码, ...]}、{"op": "leaderboard", "top": 数量}
+    """
+    def __init__(self, host="127.0.0.1", port=0, tick_seconds=SERVER_TICK_SECONDS, seed=None, universe=None):
+        self.host = host
+        self.port = port  # 为0时由系统分配，启动后更新为实际端口
+        self.tick_seconds = tick_seconds
+        self.market = FinancialMarket(seed, universe=universe)
+        self.season = SeasonSystem()
+        self.day = 0
+        self.players = {}   # 玩家名 -> StockTycoon（共享同一个市场，不读写存档）
+        self._pending = []  # 本节拍排队的订单 (玩家, 类别, 资产, 操作, 数量, future)
+        self.stats = {"ticks": 0, "orders": 0, "filled": 0, "rejected": 0, "connections": 0, "max_tick_ms": 0.0}
+        self._server = None
+        self._ticker = None
+        self._clients = {}  # 已接入的连接 writer -> 处理任务，关闭服务器时逐个断开
+
+    async def start(self):
+        """开始监听并启动节拍任务"""
+        self._server = await asyncio.start_server(self._handle_client, self.host, self.port, backlog=1024)
+        self.port = self._server.sockets[0].getsockname()[1]
+        self._ticker = asyncio.ensure_future(self._run_ticks())
+
+    async def stop(self):
+        """停止节拍和监听，仍在排队的订单全部拒绝"""
+        if self._ticker:
+            self._ticker.cancel()
+            try:
+                await self._ticker
+            except asyncio.CancelledError:
+                pass
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+        pending, self._pending = self._pending, []
+        for *_, future in pending:
+            if not future.done():
+                future.set_result({"ok": False, "error": "服务器已关闭"})
+        clients, self._clients = self._clients, {}
+        for writer in clients:
+            writer.close()
+        await asyncio.gather(*clients.values(), return_exceptions=True)
+
+    async def serve_forever(self):
+        """启动服务器并一直运行，直到被取消（Ctrl+C）"""
+        await self.start()
+        print(f"服务器已启动：{self.host}:{self.port}，每 {self.tick_seconds} 秒推进一天", file=sys.stderr)
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await self.stop()
+
+    async def _run_ticks(self):
+        """按绝对时间排期推进市场，单个节拍的处理耗时不会累积成漂移"""
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            next_tick += self.tick_seconds
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+            self.tick()
+
+    def tick(self):
+        """推进一天：更新共享价格，按到达顺序成交本节拍排队的订单，再撮合各玩家的条件单"""
+        start = time.perf_counter()
+        self.day += 1
+        self.market.set_day(self.day)
+        season = self.season.current_season(self.day)
+        self.market.update_stocks(season["stock_vol"], self.day)
+        self.market.update_bonds(season, self.day)
+        pending, self._pending = self._pending, []
+        with contextlib.redirect_stdout(io.StringIO()):  # 游戏内的提示文字不输出到服务器终端
+            for game in self.players.values():
+                game.day = self.day
+            for game, kind, asset, action, amount, future in pending:
+                execute = game.execute_stock_order if kind == "stocks" else game.execute_bond_order
+                try:
+                    result = {"ok": True, "day": self.day, "trade": execute(asset, action, amount), "cash": game.player["cash"]}
+                    self.stats["filled"] += 1
+                except ValueError as e:
+                    result = {"ok": False, "day": self.day, "error": str(e)}
+                    self.stats["rejected"] += 1
+                if not future.done():  # 客户端可能已断开
+                    future.set_result(result)
+            for game in self.players.values():
+                if game.order_book:
+                    game.match_orders()
+        self.stats["ticks"] += 1
+        self.stats["max_tick_ms"] = max(self.stats["max_tick_ms"], (time.perf_counter() - start) * 1000)
+
+    def leaderboard(self, top=10):
+        """按净资产排名的玩家列表"""
+        ranking = sorted(((game.calculate_total_assets() - game.player["debt"], name) for name, game in self.players.items()),
+                         reverse=True)
+        return [{"player": name, "net_assets": net_assets} for net_assets, name in ranking[:top]]
+
+    async def _dispatch(self, game, request):
+        """处理一个请求，返回 (本连接的玩家, 响应)；请求无效时抛出ValueError"""
+        op = request.get("op")
+        if op == "join":
+            name = request.get("player")
+            name = name.strip() if isinstance(name, str) else ""
+            if not name:
+                raise ValueError("玩家名称不能为空")
+            if name not in self.players:
+                with contextlib.redirect_stdout(io.StringIO()):
+                    self.players[name] = StockTycoon(None, background_save=False, market=self.market)
+                self.players[name].day = self.day
+            return self.players[name], {"ok": True, "player": name, "day": self.day}
+        if op == "quote":
+            codes = request.get("codes")
+            if not isinstance(codes, list):
+                raise ValueError("codes 必须是代码列表")
+            assets = (self.market.stock_dict.get(str(code).upper()) or self.market.bond_dict.get(str(code).upper()) for code in codes)
+            return game, {"ok": True, "day": self.day, "prices": {a.code: a.current_price for a in assets if a}}
+        if op == "leaderboard":
+            top = request.get("top", 10)
+            if isinstance(top, bool) or not isinstance(top, int) or top <= 0:
+                raise ValueError("top 必须是正整数")
+            return game, {"ok": True, "day": self.day, "leaderboard": self.leaderboard(top)}
+        if game is None:
+            raise ValueError("请先加入游戏（join）")
+        if op == "order":
+            kind, asset, action, amount = game._parse_batch_order(request)
+            future = asyncio.get_running_loop().create_future()
+            self._pending.append((game, kind, asset, action, amount, future))
+            self.stats["orders"] += 1
+            return game, await future  # 在下一个节拍成交后返回
+        if op == "portfolio":
+            return game, dict(_cli_portfolio(game, None), ok=True)
+        raise ValueError(f"未知的请求：{op}")
+
+    async def _handle_client(self, reader, writer):
+        """一个客户端连接：逐行读取请求并按顺序写回响应"""
+        self.stats["connections"] += 1
+        self._clients[writer] = asyncio.current_task()
+        game = None
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                request = None
+                try:
+                    request = json.loads(line)
+                    if not isinstance(request, dict):
+                        raise ValueError("请求必须是JSON对象")
+                    game, response = await self._dispatch(game, request)
+                except ValueError as e:
+                    response = {"ok": False, "error": str(e)}
+                except (TypeError, KeyError, AttributeError) as e:  # 字段类型不对等漏网的畸形请求只拒绝这一条，不断开连接
+                    response = {"ok": False, "error": f"请求格式错误：{e}"}
+                if isinstance(request, dict) and "id" in request:
+                    response["id"] = request["id"]
+                writer.write((json.dumps(response, ensure_ascii=False) + "\n").encode("utf-8"))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self._clients.pop(writer, None)
+            writer.close()
+
+async def _simulated_client(host, port, index, orders, codes, rng, latencies):
+    """模拟客户端：加入游戏，依次提交orders笔随机买卖订单，最后查询一次持仓"""
+    reader, writer = await asyncio.open_connection(host, port)
+
+    async def request(payload):
+        start = time.perf_counter()
+        writer.write((json.dumps(payload) + "\n").encode("utf-8"))
+        await writer.drain()
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("服务器关闭了连接")
+        latencies.setdefault(payload["op"], []).append(time.perf_counter() - start)
+        return json.loads(line)
+
+    try:
+        await request({"op": "join", "player": f"bot{index}"})
+        for n in range(orders):
+            await request({"op": "order", "id": n, "code": rng.choice(codes),
+                           "action": rng.choice(("buy", "buy", "sell")), "amount": rng.randint(1, 100)})
+        return await request({"op": "portfolio"})
+    finally:
+        writer.close()
+
+def _latency_summary(samples):
+    """延迟样本（秒）的中位数、p99和最大值（毫秒）"""
+    if not samples:
+        return None
+    values = np.array(samples) * 1000
+    return {"p50": float(np.percentile(values, 50)), "p99": float(np.percentile(values, 99)), "max": float(values.max())}
+
+async def run_load_test(clients=200, orders=10, tick_seconds=0.05, seed=None, universe=None):
+    """在本机启动服务器和clients个模拟客户端（每个提交orders笔订单），返回吞吐和延迟统计"""
+    server = MarketServer(port=0, tick_seconds=tick_seconds, seed=seed, universe=universe)
+    await server.start()
+    rng = random.Random(seed)
+    codes = [s.code for s in server.market.stocks[:50]] + [b.code for b in server.market.bonds]
+    latencies = {}
+    start = time.perf_counter()
+    try:
+        outcomes = await asyncio.gather(*(_simulated_client(server.host, server.port, index, orders, codes,
+                                                            random.Random(rng.random()), latencies)
+                                          for index in range(clients)), return_exceptions=True)
+    finally:
+        await server.stop()
+    elapsed = time.perf_counter() - start
+    failures = [str(outcome) for outcome in outcomes if isinstance(outcome, BaseException)]
+    return {
+        "clients": clients,
+        "failed_clients": len(failures),
+        "errors": sorted(set(failures))[:5],
+        "players": len(server.players),
+        "seconds": elapsed,
+        "orders_per_second": server.stats["filled"] / elapsed if elapsed > 0 else 0.0,
+        **server.stats,
+        "order_latency_ms": _latency_summary(latencies.get("order", [])),
+        "portfolio_latency_ms": _latency_summary(latencies.get("portfolio", [])),
+        "leaderboard": server.leaderboard(3),
+    }
+
+# ========== 命令行模式 ==========
+def _cli_positions(game):
+    """持仓明细（纯数据，不含颜色）"""
+    result = {}
+    for kind in PortfolioValuation.KINDS:
+        result[kind] = [{"code": code, "name": asset.name, "amount": amount, "avg_price": avg_price,
+                         "price": price, "value": value, "profit_loss": profit_loss}
+                        for code, asset, amount, avg_price, price, value, profit_loss in game.valuation.positions(kind)]
+    result["shorts"] = []
+    for code, position in game.player["shorts"].items():
+        stock = game.market.stock_dict.get(code)
+        price = stock.current_price if stock else 0.0
+        result["shorts"].append({"code": code, "amount": position.amount, "borrow_price": position.price, "day": position.day,
+                                 "price": price, "profit_loss": (position.price - price) * position.amount})
+    return result
+
+def _cli_portfolio(game, args):
+    total_assets = game.calculate_total_assets()
+    result = {
+        "day": game.day,
+        "cash": game.player["cash"],
+        "debt": game.player["debt"],
+        "level": game.player["level"],
+        "tycoon_mode": game.tycoon_mode,
+        "universe": game.market.universe,
+        "stocks_value": game.valuation.value("stocks"),
+        "bonds_value": game.valuation.value("bonds"),
+        "profit_loss": game.valuation.profit_loss(),
+        "total_assets": total_assets,
+        "net_assets": total_assets - game.player["debt"],
+    }
+    result.update(_cli_positions(game))
+    return result
+
+def _cli_advance(game, args):
+    if args.days <= 0:
+        raise ValueError("天数必须大于0")
+    trades = len(game.ledger)
+    game.advance_days(args.days)
+    return {"day": game.day, "total_assets": game.calculate_total_assets(), "trades": game.ledger.records(trades)}
+
+def _cli_trade(game, args):
+    code = args.code.upper()
+    asset = game.market.stock_dict.get(code) or game.market.bond_dict.get(code)
+    if asset is None:
+        raise ValueError(f"无效的资产代码：{code}")
+    if args.amount <= 0:
+        raise ValueError("数量必须为正整数")
+    if args.action in ("buy", "short") and game.tycoon_mode and args.amount < 1000:
+        raise ValueError("土豪模式下必须购买1000股或以上！")
+    if code in game.market.stock_dict:
+        record = game.execute_stock_order(asset, args.action, float(args.amount))
+    else:
+        record = game.execute_bond_order(asset, args.action, float(args.amount))
+    game.save_game()
+    return {"trade": record, "cash": game.player["cash"]}
+
+def _cli_batch(game, args):
+    report = game.execute_order_batch(read_order_file(args.path))
+    return {"filled": sum(1 for entry in report if entry["status"] == "filled"), "orders": report}
+
+def _cli_trades(game, args):
+    filters = {"code": args.code.upper() if args.code else None, "type": args.type, "action": args.action,
+               "start_day": args.start_day, "end_day": args.end_day}
+    if args.summary:
+        return {"summary": game.ledger.aggregate(**filters)}
+    records, total = game.ledger.query(page=args.page, page_size=args.page_size, **filters)
+    return {"total": total, "page": args.page, "trades": records}
+
+def _cli_history(game, args):
+    code = args.code.upper()
+    asset = game.market.stock_dict.get(code) or game.market.bond_dict.get(code)
+    if asset is None:
+        raise ValueError(f"无效资产代码：{code}")
+    days, prices = game.price_history(asset, args.start_day, args.end_day)
+    return {"code": code, "history": [{"day": day, "price": price} for day, price in zip(days.tolist(), prices.tolist())]}
+
+def _cli_migrate(game, args):
+    migrated = migrate_json_saves(SQLITE_SAVE_EXTENSION if args.format == "db" else BINARY_SAVE_EXTENSION)
+    return {"migrated": [{"source": source, "target": target} for source, target in migrated]}
+
+def _cli_screen(game, args):
+    if args.where or args.sort:
+        conditions = [condition for text in args.where for condition in parse_screen_conditions(text)]
+        sort_by = (args.sort or DEFAULT_SCREEN_SORT).lower()
+        result = {"day": game.day, "conditions": [list(c) for c in conditions], "sort": sort_by}
+        for kind in ("stocks", "bonds"):
+            rows, matched = game.market.screen_assets(kind, conditions, sort_by.lstrip("-"), args.top, sort_by.startswith("-"))
+            result[f"{kind}_matched"] = matched
+            result[kind] = [dict({"code": asset.code, "name": asset.name, "price": asset.current_price}, **values) for asset, values in rows]
+        return result
+    if args.days <= 0:
+        raise ValueError("天数必须大于0")
+    result = {"day": game.day, "days": args.days}
+    for kind, assets in (("stocks", game.market.stocks), ("bonds", game.market.bonds)):
+        changes = sorted(game.market.period_changes(assets, game.market.price_source(kind), args.days), key=lambda x: x[1], reverse=True)
+        result[kind] = [{"code": asset.code, "name": asset.name, "change_pct": change, "price": asset.current_price}
+                        for asset, change in changes[:args.top]]
+    return result
+
+def _cli_backtest(game, args):
+    if args.days <= 0:
+        raise ValueError("天数必须大于0")
+    return {"results": run_backtests(default_backtest_grid(), args.days, args.seed, args.workers, args.tycoon)}
+
+def _cli_export(game, args):
+    return game.export_charts(args.out, args.workers, args.force)
+
+def build_cli_parser():
+    """无界面命令行模式的参数解析器"""
+    parser = argparse.ArgumentParser(prog="main.py", description="Rainbow 模拟投资（无界面模式，结果以JSON输出）")
+    parser.add_argument("--save", default="default_save.json", help="存档名称（无扩展名时使用 .json）")
+    parser.add_argument("--universe", type=int, default=None, metavar="SIZE", help="新存档使用生成的股票池（股票数量），已有存档沿用其中记录的股票池")
+    parser.add_argument("--universe-seed", type=int, default=None, help="生成股票池的随机种子")
+    parser.add_argument("--shards", type=int, default=None, help="用多个进程分片推进股票价格（大股票池）")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("portfolio", help="输出当前持仓和资产")
+    command.set_defaults(handler=_cli_portfolio)
+
+    command = commands.add_parser("advance", help="快进若干天")
+    command.add_argument("days", type=int)
+    command.set_defaults(handler=_cli_advance)
+
+    command = commands.add_parser("trade", help="按当前价格执行一笔交易")
+    command.add_argument("code")
+    command.add_argument("action", choices=STOCK_ORDER_ACTIONS)
+    command.add_argument("amount", type=int)
+    command.set_defaults(handler=_cli_trade)
+
+    command = commands.add_parser("batch", help="执行批量订单文件（CSV/JSON）")
+    command.add_argument("path")
+    command.set_defaults(handler=_cli_batch)
+
+    command = commands.add_parser("trades", help="分页查询交易账本（最新的在前）或按代码汇总")
+    command.add_argument("--code")
+    command.add_argument("--type", choices=("股票", "债券"))
+    command.add_argument("--action")
+    command.add_argument("--from", dest="start_day", type=int, help="起始天（含）")
+    command.add_argument("--to", dest="end_day", type=int, help="结束天（含）")
+    command.add_argument("--page", type=int, default=1)
+    command.add_argument("--page-size", type=int, default=StockTycoon.TRADE_PAGE_SIZE)
+    command.add_argument("--summary", action="store_true", help="按代码汇总成交量、成交额和已实现盈亏")
+    command.set_defaults(handler=_cli_trades)
+
+    command = commands.add_parser("history", help="查询单个资产的价格历史（SQLite存档包含全部历史）")
+    command.add_argument("code")
+    command.add_argument("--from", dest="start_day", type=int, help="起始天（含）")
+    command.add_argument("--to", dest="end_day", type=int, help="结束天（含）")
+    command.set_defaults(handler=_cli_history)
+
+    command = commands.add_parser("migrate", help="把 saves/ 下的JSON存档（连同日志）导入为二进制或SQLite存档")
+    command.add_argument("--format", choices=("npz", "db"), default="db")
+    command.set_defaults(handler=_cli_migrate, needs_game=False)
+
+    command = commands.add_parser("screen", help="按滚动指标多条件筛选资产（或按近若干天涨幅排序）")
+    command.add_argument("--days", type=int, default=7, help="没有 --where/--sort 时按近若干天涨幅排序")
+    command.add_argument("--where", action="append", default=[], help="筛选条件，如 \"momentum_20>10\"（可重复，或用逗号分隔）")
+    command.add_argument("--sort", default=None, help=f"排序指标（默认 {DEFAULT_SCREEN_SORT}，前加 - 表示从小到大，如 --sort=-volatility_20）")
+    command.add_argument("--top", type=int, default=10)
+    command.set_defaults(handler=_cli_screen)
+
+    command = commands.add_parser("backtest", help="并行回测内置的策略/参数组合（不读写存档）")
+    command.add_argument("--days", type=int, default=365)
+    command.add_argument("--seed", type=int, default=None)
+    command.add_argument("--workers", type=int, default=None)
+    command.add_argument("--tycoon", action="store_true", help="按土豪模式规则执行订单")
+    command.set_defaults(handler=_cli_backtest, needs_game=False)
+
+    command = commands.add_parser("export", help="把价格走势和总资产趋势导出为PNG（只重画有变化的图表）")
+    command.add_argument("--out", default=None, help="导出目录（默认 exports/<存档名>）")
+    command.add_argument("--workers", type=int, default=None)
+    command.add_argument("--force", action="store_true", help="重画全部图表")
+    command.set_defaults(handler=_cli_export)
+
+    command = commands.add_parser("serve", help="启动本地多人服务器（共享一个市场，Ctrl+C停止）")
+    command.add_argument("--host", default="127.0.0.1")
+    command.add_argument("--port", type=int, default=8765)
+    command.add_argument("--tick", type=float, default=SERVER_TICK_SECONDS, help="每推进一天的秒数")
+    command.add_argument("--seed", type=int, default=None)
+    command.set_defaults(handler=_cli_serve, needs_game=False)
+
+    command = commands.add_parser("loadtest", help="在本机启动服务器和模拟客户端，输出吞吐和延迟")
+    command.add_argument("--clients", type=int, default=200)
+    command.add_argument("--orders", type=int, default=10, help="每个客户端提交的订单数")
+    command.add_argument("--tick", type=float, default=0.05, help="每推进一天的秒数")
+    command.add_argument("--seed", type=int, default=None)
+    command.set_defaults(handler=_cli_loadtest, needs_game=False)
+    return parser
+
+def _cli_universe(args):
+    return {"size": args.universe, "seed": args.universe_seed} if args.universe else None
+
+def _cli_serve(game, args):
+    server = MarketServer(args.host, args.port, args.tick, args.seed, _cli_universe(args))
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    return {"host": server.host, "port": server.port, "day": server.day, "players": len(server.players), **server.stats}
+
+def _cli_loadtest(game, args):
+    if args.clients <= 0 or args.orders <= 0:
+        raise ValueError("客户端数和订单数必须大于0")
+    return asyncio.run(run_load_test(args.clients, args.orders, args.tick, args.seed, _cli_universe(args)))
+
+def run_cli(argv):
+    """执行一条命令并把结果以一行JSON写到标准输出，返回进程退出码"""
+    args = build_cli_parser().parse_args(argv)
+    save_name = args.save if args.save.endswith(SAVE_EXTENSIONS) else f"{args.save}.json"
+    result = {"ok": True, "command": args.command, "save": save_name}
+    # 游戏内部的提示文字和颜色输出全部丢弃，只输出结构化结果；存档同步写入，命令返回时已落盘
+    with contextlib.redirect_stdout(io.StringIO()):
+        try:
+            universe = _cli_universe(args)
+            game = StockTycoon(save_name, background_save=False, universe=universe) if getattr(args, "needs_game", True) else None
+            if game and game.load_error:
+                # 无界面模式下不能用默认值继续，否则命令结束时的存档会覆盖无法读取的原存档
+                raise ValueError(f"无法读取存档 {save_name}：{game.load_error}")
+            if game and args.shards:
+                game.market.start_sharding(args.shards)
+            result.update(args.handler(game, args))
+            if game:
+                game.market.stop_sharding()
+            error = game.saver.flush() if game else None
+            if error:
+                raise error
+        except (OSError, ValueError) as e:
+            result = {"ok": False, "command": args.command, "save": save_name, "error": str(e)}
+    print(json.dumps(result, ensure_ascii=False))
+    return 0 if result["ok"] else 1
+
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        sys.exit(run_cli(sys.argv[1:]))
     save_file = select_save()
     game = StockTycoon(save_file)
     main_menu(game)
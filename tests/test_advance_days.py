@@ -0,0 +1,37 @@
+import contextlib
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import StockTycoon
+
+
+def fast_forward(days, place_order=False):
+    """用固定种子的内存游戏快进若干天，可选先挂一笔限价买单"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        game = StockTycoon(None, background_save=False, seed=0)
+        if place_order:
+            stock = game.market.stocks[0]
+            game.place_order("stocks", stock.code, "limit_buy", 1000, stock.current_price * 0.9)
+        game.advance_days(days)
+    return game
+
+
+class AdvanceDaysTest(unittest.TestCase):
+    def test_fill_does_not_rewrite_earlier_total_assets(self):
+        """条件单成交后，成交日之前的每日总资产与没有挂单时相同"""
+        plain = fast_forward(20)
+        ordered = fast_forward(20, place_order=True)
+        fills = [record["day"] for record in ordered.ledger.records()]
+        self.assertTrue(fills, "限价买单应在快进期间成交")
+        before_fill = fills[0] - 1  # 第1天对应历史中的第0项
+        self.assertGreater(before_fill, 0)
+        self.assertEqual(ordered.total_assets_history[:before_fill], plain.total_assets_history[:before_fill])
+        self.assertEqual(ordered.stocks_bonds_value_history[:before_fill], plain.stocks_bonds_value_history[:before_fill])
+
+
+if __name__ == "__main__":
+    unittest.main()
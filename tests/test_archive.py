@@ -0,0 +1,47 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import StockTycoon
+
+
+class DailyAssetsArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def test_daily_assets_outlive_memory_window(self):
+        """内存中的每日资产只保留窗口大小，更早的记录从归档读出，读档后仍在"""
+        with contextlib.redirect_stdout(io.StringIO()):
+            game = StockTycoon("long.json", background_save=False, seed=0)
+            game.market.HISTORY_DAYS = 30
+            game.advance_days(50)
+            game.advance_days(10)
+            days, totals = game.asset_history()
+            self.assertEqual(len(game.total_assets_history), 30)
+            self.assertEqual(days.tolist(), list(range(1, 61)))
+            np.testing.assert_array_equal(totals[-30:], game.total_assets_history)
+            recent = game.asset_history(41)
+            game.save_game(snapshot=True)
+            game.close_archive()
+            reloaded = StockTycoon("long.json", background_save=False)
+        np.testing.assert_array_equal(reloaded.asset_history()[1], totals)
+        np.testing.assert_array_equal(recent[0], np.arange(41, 61))
+        frame = reloaded._asset_trend_frame(60, os.terminal_size((120, 80)))
+        self.assertIn("近 60 天", frame)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import contextlib
+import io
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import StockTycoon
+
+
+class AssetTrendTest(unittest.TestCase):
+    def setUp(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.game = StockTycoon(None, background_save=False, seed=0)
+        self.game.day = 360
+        self.game.total_assets_history = [1e13 + day for day in range(1, 361)]
+        self.terminal = os.terminal_size((120, 40))  # 最多显示30行
+
+    def test_short_span_is_daily(self):
+        frame = self.game._asset_trend_frame(20, self.terminal)
+        self.assertIn("近 20 天总资产趋势 (单位：元)\n", frame)
+        self.assertIn("第341天", frame)
+
+    def test_long_span_uses_coarser_resolution(self):
+        frame = self.game._asset_trend_frame(360, self.terminal)
+        self.assertIn("近 360 天总资产趋势 (单位：元)，每行为一月末", frame)
+        self.assertLessEqual(frame.count("天 |"), 30)
+
+    def test_menu_prompts_for_span(self):
+        output = io.StringIO()
+        with mock.patch("builtins.input", return_value="200"), mock.patch("shutil.get_terminal_size", return_value=self.terminal), \
+                contextlib.redirect_stdout(output):
+            self.game.show_total_assets_trend()
+        self.assertIn("近 200 天总资产趋势", output.getvalue())
+        self.assertIn("每行为一周末", output.getvalue())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,66 @@
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import SAVE_SUMMARY_SUFFIX, SaveCatalog, StockTycoon, read_save_summary
+
+
+class SaveSummaryTest(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+        self.path = os.path.join("saves", "c.json")
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def quiet(self, func, *args, **kwargs):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return func(*args, **kwargs)
+
+    def sidecar(self):
+        with open(self.path + SAVE_SUMMARY_SUFFIX, encoding="utf-8") as f:
+            return json.load(f)
+
+    def test_journal_saves_leave_catalog_until_flush(self):
+        game = self.quiet(StockTycoon, "c.json", background_save=False)
+        self.quiet(game.save_game, snapshot=True)
+        catalog_path = os.path.join("saves", SaveCatalog.FILENAME)
+        catalog_mtime = os.stat(catalog_path).st_mtime_ns
+        self.assertEqual(self.sidecar()["day"], 0)
+
+        self.quiet(game.advance_days, 2)  # 只追加日志
+        self.assertEqual(os.stat(catalog_path).st_mtime_ns, catalog_mtime)
+        self.assertEqual(self.sidecar()["day"], 0)
+        self.assertEqual(read_save_summary(self.path)["day"], 2)  # 摘要文件签名已过期，改读存档
+
+        self.quiet(game.flush_saves)
+        self.assertEqual(self.sidecar()["day"], 2)
+        self.assertEqual(dict(SaveCatalog("saves").entries())["c.json"]["day"], 2)
+        game.close_archive()
+
+    def test_sidecar_with_wrong_signature_is_ignored(self):
+        game = self.quiet(StockTycoon, "c.json", background_save=False)
+        self.quiet(game.advance_days, 3)
+        self.quiet(game.flush_saves)
+        game.close_archive()
+        forged = dict(self.sidecar(), day=999)
+        with open(self.path + SAVE_SUMMARY_SUFFIX, "w", encoding="utf-8") as f:
+            json.dump(forged, f)
+        self.assertEqual(read_save_summary(self.path)["day"], 999)  # 签名一致时直接采用摘要文件
+        forged["signature"][1] += 1
+        with open(self.path + SAVE_SUMMARY_SUFFIX, "w", encoding="utf-8") as f:
+            json.dump(forged, f)
+        self.assertEqual(read_save_summary(self.path)["day"], 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,54 @@
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import run_cli
+
+
+class CliTest(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)  # 存档写入临时目录下的 saves/
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def cli(self, *argv):
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            code = run_cli(list(argv))
+        return code, json.loads(output.getvalue())
+
+    def test_advance_persists_day(self):
+        code, result = self.cli("--save", "good", "advance", "3")
+        self.assertEqual(code, 0)
+        self.assertTrue(result["ok"])
+        code, result = self.cli("--save", "good", "portfolio")
+        self.assertEqual(result["day"], 3)
+
+    def test_corrupted_save_is_not_overwritten(self):
+        """读不出的存档返回 ok:false，且不会被新游戏覆盖"""
+        self.cli("--save", "good", "advance", "2")
+        path = os.path.join("saves", "good.json")
+        with open(path, "r+") as f:
+            f.truncate(10)
+        with open(path, "rb") as f:
+            damaged = f.read()
+        code, result = self.cli("--save", "good", "advance", "1")
+        self.assertEqual(code, 1)
+        self.assertFalse(result["ok"])
+        self.assertIn("good.json", result["error"])
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), damaged)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,31 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import INDICATOR_FAMILIES, PriceHistory, RollingIndicators
+
+
+class RollingIndicatorsTest(unittest.TestCase):
+    def test_incremental_matches_rebuild_after_many_days(self):
+        """逐日增量更新700天后，各指标列与按历史窗口整体重建的结果一致（窗口和不随天数累积误差）"""
+        rng = np.random.default_rng(0)
+        store = PriceHistory(500, 40)
+        incremental = RollingIndicators(store, windows=(5, 20, 30))
+        prices = rng.uniform(10000, 20000, 500)
+        for day in range(1, 701):
+            prices = np.round(prices * np.exp(rng.normal(0, 0.03, 500)), 2)
+            store.append(day, prices)
+            incremental.sync()
+        rebuilt = RollingIndicators(store, windows=(5, 20, 30))
+        for family in INDICATOR_FAMILIES:
+            for window in (5, 20, 30):
+                name = f"{family}_{window}"
+                np.testing.assert_allclose(incremental.column(name), rebuilt.column(name), rtol=1e-12, atol=1e-12, err_msg=name)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import TradeLedger
+
+
+def sample_trades():
+    """三个代码、两种操作，第1~100天每天一笔"""
+    return [{"day": day, "type": "股票" if day % 4 else "债券", "code": ("AAA", "BBB", "CCC")[day % 3],
+             "action": "买入" if day % 2 else "卖出", "amount": float(day), "price": 10.0, "pnl": float(day % 5 - 2)}
+            for day in range(1, 101)]
+
+
+class TradeLedgerTest(unittest.TestCase):
+    def setUp(self):
+        self.trades = sample_trades()
+        self.ledger = TradeLedger()
+        self.ledger.extend(self.trades)
+
+    def expected(self, code=None, type=None, action=None, start_day=None, end_day=None):
+        return [t for t in self.trades if (code is None or t["code"] == code) and (type is None or t["type"] == type)
+                and (action is None or t["action"] == action) and (start_day is None or t["day"] >= start_day)
+                and (end_day is None or t["day"] <= end_day)]
+
+    def test_records_round_trip(self):
+        self.assertEqual(len(self.ledger), 100)
+        self.assertEqual(self.ledger.records(), self.trades)
+        self.assertEqual(self.ledger.records(10, 12), self.trades[10:12])
+        self.assertEqual(self.ledger.record(99), self.trades[99])
+
+    def test_pagination_newest_first(self):
+        pages = []
+        for page in range(1, 5):
+            records, total = self.ledger.query(page=page, page_size=30)
+            self.assertEqual(total, 100)
+            pages += records
+        self.assertEqual(pages, self.trades[::-1])
+        self.assertEqual(self.ledger.query(page=5, page_size=30), ([], 100))
+        records, _ = self.ledger.query(page=1, page_size=5, newest_first=False)
+        self.assertEqual(records, self.trades[:5])
+
+    def test_date_range_is_inclusive(self):
+        for filters in ({"start_day": 20, "end_day": 30}, {"start_day": 95}, {"end_day": 3}, {"start_day": 200},
+                        {"code": "BBB", "start_day": 10, "end_day": 40}, {"code": "ZZZ"}):
+            expected = self.expected(**filters)
+            records, total = self.ledger.query(page_size=1000, newest_first=False, **filters)
+            self.assertEqual((records, total), (expected, len(expected)), filters)
+
+    def test_type_and_action_filters(self):
+        for filters in ({"type": "债券"}, {"action": "卖出"}, {"type": "股票", "action": "买入", "start_day": 50},
+                        {"code": "AAA", "action": "卖出", "end_day": 60}, {"action": "做空"}):
+            expected = self.expected(**filters)
+            records, total = self.ledger.query(page_size=1000, newest_first=False, **filters)
+            self.assertEqual((records, total), (expected, len(expected)), filters)
+
+    def test_aggregate(self):
+        for filters in ({}, {"start_day": 30, "end_day": 60}, {"code": "CCC"}, {"type": "股票", "action": "买入"}):
+            expected = {}
+            for t in self.expected(**filters):
+                item = expected.setdefault(t["code"], {"trades": 0, "volume": 0.0, "turnover": 0.0, "realized_pnl": 0.0})
+                item["trades"] += 1
+                item["volume"] += t["amount"]
+                item["turnover"] += t["amount"] * t["price"]
+                item["realized_pnl"] += t["pnl"]
+            self.assertEqual(self.ledger.aggregate(**filters), expected, filters)
+        self.assertEqual(self.ledger.turnover(), sum(t["amount"] * t["price"] for t in self.trades))
+
+    def test_load_columns_sorts_by_day_and_indexes(self):
+        shuffled = self.trades[50:] + self.trades[:50]
+        ledger = TradeLedger()
+        ledger.load_columns({field: [t[field] for t in shuffled] for field in TradeLedger.FIELDS})
+        self.assertEqual(ledger.records(), self.trades)
+        self.assertEqual(ledger.query(code="AAA", action="买入", page_size=1000, newest_first=False)[0],
+                         self.expected(code="AAA", action="买入"))
+        ledger.append({"day": 101, "type": "股票", "code": "DDD", "action": "买入", "amount": 1, "price": 2})
+        self.assertEqual(ledger.query(code="DDD")[1], 1)
+        self.assertEqual(ledger.column("code")[-1], "DDD")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,111 @@
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import StockTycoon, migrate_json_saves
+
+
+def play(name):
+    """在存档上玩一小段：快进、买卖股票和债券、做空、挂条件单，每步都照常存档（JSON存档写日志）"""
+    game = StockTycoon(name, seed=0)
+    market = game.market
+    game.advance_days(3)
+    for stock, action, amount in ((market.stocks[0], "buy", 10.0), (market.stocks[1], "short", 5.0)):
+        game.execute_stock_order(stock, action, amount)
+        game.save_game()
+    game.execute_bond_order(market.bonds[0], "buy", 3.0)
+    game.save_game()
+    game.place_order("stocks", market.stocks[2].code, "limit_buy", 100, market.stocks[2].current_price * 0.01)  # 远低于现价，挂单保留到存档
+    game.save_game()
+    game.advance_days(5)
+    game.execute_stock_order(market.stocks[0], "sell", 4.0)
+    game.execute_stock_order(market.stocks[1], "cover", 2.0)
+    game.save_game()
+    game.flush_saves()
+    return game
+
+
+def state(game):
+    """游戏中会被存档保存的全部状态"""
+    market = game.market
+    return {
+        "player": game.player_record(),
+        "day": game.day,
+        "tycoon_mode": game.tycoon_mode,
+        "trades": game.ledger.records(),
+        "orders": game.order_book.to_records(),
+        "total_assets": list(game.total_assets_history),
+        "stocks_bonds_value": list(game.stocks_bonds_value_history),
+        "prices": [a.current_price for a in market.stocks + market.bonds],
+        "history": [store.window()[0].tolist() + store.window()[1].ravel().tolist()
+                    for store in (market.stock_history, market.bond_history)],
+        "daily_assets": [values.tolist() for values in game.asset_history()],
+    }
+
+
+def close(game):
+    game.close_sqlite()
+    game.close_archive()
+
+
+class SaveRoundTripTest(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def reload(self, name):
+        with contextlib.redirect_stdout(io.StringIO()):
+            game = StockTycoon(name)
+        self.assertIsNone(game.load_error)
+        return game
+
+    def test_reload_equals_saved_state(self):
+        for name in ("r.json", "r.npz", "r.db"):
+            with self.subTest(name=name):
+                with contextlib.redirect_stdout(io.StringIO()):
+                    game = play(name)
+                expected = state(game)
+                close(game)
+                if not name.endswith(".db"):
+                    with open(os.path.join("saves", name + ".journal")) as f:
+                        self.assertGreater(len(f.readlines()), 0)  # 读档要重放快照之后的日志
+                reloaded = self.reload(name)
+                self.assertEqual(state(reloaded), expected)
+                self.assertTrue(reloaded.ledger)
+                self.assertTrue(reloaded.order_book.to_records())
+                close(reloaded)
+
+    def test_migrate_json_keeps_state(self):
+        for extension in (".npz", ".db"):
+            with self.subTest(extension=extension):
+                name = f"m{extension[1:]}.json"
+                with contextlib.redirect_stdout(io.StringIO()):
+                    game = play(name)
+                expected = state(game)
+                close(game)
+                with contextlib.redirect_stdout(io.StringIO()):
+                    migrated = migrate_json_saves(extension)
+                target = name[:-len(".json")] + extension
+                self.assertEqual(migrated, [(name, target)])
+                self.assertFalse(os.path.exists(os.path.join("saves", name)))
+                self.assertTrue(os.path.exists(os.path.join("saves", name + ".bak")))
+                reloaded = self.reload(target)
+                self.assertEqual(state(reloaded), expected)
+                np.testing.assert_array_equal(reloaded.asset_history()[1], expected["daily_assets"][1])
+                close(reloaded)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import asyncio
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import MarketServer, run_load_test
+
+
+async def exchange(server, requests):
+    """在同一连接上一次性发出全部请求，再按到达顺序读回同样数量的响应"""
+    reader, writer = await asyncio.open_connection(server.host, server.port)
+    for request in requests:
+        writer.write((request if isinstance(request, str) else json.dumps(request)).encode("utf-8") + b"\n")
+    await writer.drain()
+    responses = [json.loads(await reader.readline()) for _ in requests]
+    writer.close()
+    return responses
+
+
+class ServerTest(unittest.TestCase):
+    def test_load_test_small_scale(self):
+        result = asyncio.run(run_load_test(clients=20, orders=5, tick_seconds=0.01, seed=0))
+        self.assertEqual(result["failed_clients"], 0, result["errors"])
+        self.assertEqual(result["players"], 20)
+        self.assertEqual(result["orders"], 100)
+        self.assertGreater(result["filled"], 0)
+        self.assertGreater(result["rejected"], 0)  # 没有持仓的卖单会被拒绝
+        self.assertEqual(result["filled"] + result["rejected"], result["orders"])
+
+    def test_responses_keep_request_order_and_survive_bad_requests(self):
+        async def scenario():
+            server = MarketServer(port=0, tick_seconds=0.01, seed=0)
+            await server.start()
+            code = server.market.stocks[0].code
+            try:
+                return await exchange(server, [
+                    {"op": "join", "player": "alice", "id": 0},
+                    {"op": "order", "code": code, "action": "buy", "amount": 10, "id": 1},
+                    {"op": "leaderboard", "top": [1], "id": 2},
+                    "not json",
+                    {"op": "quote", "codes": [code], "id": 4},
+                    {"op": "order", "code": code, "action": "sell", "amount": 1000, "id": 5},
+                    {"op": "portfolio", "id": 6},
+                ])
+            finally:
+                await server.stop()
+
+        responses = asyncio.run(scenario())
+        self.assertEqual([r.get("id") for r in responses], [0, 1, 2, None, 4, 5, 6])
+        self.assertEqual([r["ok"] for r in responses], [True, True, False, False, True, False, True])
+        self.assertEqual(responses[1]["trade"]["amount"], 10)
+
+    def test_stop_disconnects_idle_clients(self):
+        async def scenario():
+            server = MarketServer(port=0, tick_seconds=0.01, seed=0)
+            await server.start()
+            reader, writer = await asyncio.open_connection(server.host, server.port)
+            writer.write(b'{"op": "join", "player": "idle"}\n')
+            await writer.drain()
+            await reader.readline()
+            await asyncio.wait_for(server.stop(), 5)
+            self.assertFalse(server._clients)
+            self.assertEqual(await asyncio.wait_for(reader.readline(), 5), b"")
+            writer.close()
+
+        asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    unittest.main()
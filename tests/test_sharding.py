@@ -0,0 +1,76 @@
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import FinancialMarket, StockTycoon, run_cli
+
+UNIVERSE = {"size": 10000, "seed": 1}  # 三个资产块，3个进程时每个进程一块
+
+
+def sharded_history(workers, days=3):
+    market = FinancialMarket(universe=UNIVERSE)
+    market.start_sharding(workers)
+    try:
+        for day in range(1, days + 1):
+            market.update_stocks(1.0, day)
+    finally:
+        market.stop_sharding()
+    return market.stock_history.window()[1].copy()
+
+
+class ShardingTest(unittest.TestCase):
+    def test_seed_derived_from_universe(self):
+        self.assertEqual(FinancialMarket(universe=UNIVERSE).shard_seed, FinancialMarket(universe=UNIVERSE).shard_seed)
+        self.assertEqual(FinancialMarket(seed=3).shard_seed, FinancialMarket(seed=3).shard_seed)
+
+    def test_one_and_many_workers_match(self):
+        np.testing.assert_array_equal(sharded_history(1), sharded_history(3))
+
+    def test_random_seed_is_saved(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                for name in ("seed.json", "seed.npz", "seed.db"):
+                    with contextlib.redirect_stdout(io.StringIO()):
+                        game = StockTycoon(name, background_save=False)
+                        game.save_game(snapshot=True)
+                        game.close_archive()
+                        reloaded = StockTycoon(name, background_save=False)
+                        reloaded.close_archive()
+                    self.assertEqual(reloaded.market.shard_seed, game.market.shard_seed, name)
+            finally:
+                os.chdir(cwd)
+
+    def test_cli_shards_are_reproducible_across_runs(self):
+        cwd = os.getcwd()
+        with tempfile.TemporaryDirectory() as tmp:
+            os.chdir(tmp)
+            try:
+                spec = ["--universe", str(UNIVERSE["size"]), "--universe-seed", str(UNIVERSE["seed"])]
+                for save, first, second in (("one", "1", "1"), ("many", "3", "2")):
+                    for shards in (first, second):  # 第二次运行从存档中读回分片种子
+                        with contextlib.redirect_stdout(io.StringIO()) as output:
+                            self.assertEqual(run_cli(["--save", save, "--shards", shards] + spec + ["advance", "2"]), 0)
+                        self.assertTrue(json.loads(output.getvalue())["ok"])
+                with contextlib.redirect_stdout(io.StringIO()):
+                    one, many = StockTycoon("one.json", background_save=False), StockTycoon("many.json", background_save=False)
+                self.assertEqual(one.day, 4)
+                self.assertEqual(one.market.shard_seed, many.market.shard_seed)
+                np.testing.assert_array_equal(one.market.stock_history.window()[1], many.market.stock_history.window()[1])
+                one.close_archive()
+                many.close_archive()
+            finally:
+                os.chdir(cwd)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+import contextlib
+import io
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import StockTycoon
+
+
+class QuickTradeTest(unittest.TestCase):
+    """股票/债券菜单按常规规则交易；筛选结果中的快捷交易沿用原来的规则（不校验土豪模式，只有盈利的卖出加经验）"""
+
+    def setUp(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.game = StockTycoon(None, background_save=False, seed=0)
+        self.stock = self.game.market.stocks[0]
+        self.bond = self.game.market.bonds[0]
+
+    def trade(self, method, *answers, **kwargs):
+        with mock.patch("builtins.input", side_effect=list(answers)), contextlib.redirect_stdout(io.StringIO()):
+            method(**kwargs)
+
+    def test_menu_trades_earn_exp(self):
+        self.trade(self.game.bulk_stock_trade_for_asset, "1", "10", stock=self.stock, quick=False)
+        self.assertEqual(self.game.player["exp"], 20)
+        self.trade(self.game.bulk_stock_trade_for_asset, "3", "10", stock=self.stock, quick=False)
+        self.assertEqual(self.game.player["exp"], 50)
+        self.trade(self.game.buy_bonds_for_asset, "10", bond=self.bond, quick=False)
+        self.assertEqual(self.game.player["exp"], 60)
+
+    def test_quick_trades_earn_no_exp_for_buys_and_shorts(self):
+        self.trade(self.game.bulk_stock_trade_for_asset, "1", "10", stock=self.stock)
+        self.trade(self.game.bulk_stock_trade_for_asset, "3", "10", stock=self.stock)
+        self.trade(self.game.bulk_stock_trade_for_asset, "4", "10", stock=self.stock)
+        self.trade(self.game.buy_bonds_for_asset, "10", bond=self.bond)
+        self.assertEqual(self.game.player["exp"], 0)
+        self.assertIn(self.stock.code, self.game.player["stocks"])
+        self.assertIn(self.bond.code, self.game.player["bonds"])
+        self.assertEqual(len(self.game.ledger), 4)
+
+    def test_quick_losing_sell_does_not_reduce_exp(self):
+        self.game.player["exp"] = 50
+        self.trade(self.game.bulk_stock_trade_for_asset, "1", "100000", stock=self.stock)
+        self.stock.current_price *= 0.5
+        self.trade(self.game.bulk_stock_trade_for_asset, "2", "100000", stock=self.stock)
+        self.assertLess(self.game.ledger.record(1)["pnl"], -1000)
+        self.assertEqual(self.game.player["exp"], 50)
+
+    def test_quick_profitable_sell_earns_exp(self):
+        self.trade(self.game.bulk_stock_trade_for_asset, "1", "1", stock=self.stock)
+        self.stock.current_price *= 1.5
+        self.trade(self.game.bulk_stock_trade_for_asset, "2", "1", stock=self.stock)
+        pnl = self.game.ledger.record(1)["pnl"]
+        self.assertGreater(int(pnl / 1000), 0)
+        self.assertEqual(self.game.player["exp"], int(pnl / 1000))
+
+    def test_tycoon_mode_only_checks_menu_trades(self):
+        self.game.tycoon_mode = True
+        self.trade(self.game.bulk_stock_trade_for_asset, "1", "10", stock=self.stock, quick=False)
+        self.trade(self.game.buy_bonds_for_asset, "10", bond=self.bond, quick=False)
+        self.assertFalse(self.game.ledger)
+        self.trade(self.game.bulk_stock_trade_for_asset, "1", "10", stock=self.stock)
+        self.trade(self.game.buy_bonds_for_asset, "10", bond=self.bond)
+        self.assertEqual(len(self.game.ledger), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
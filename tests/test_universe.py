@@ -0,0 +1,66 @@
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import UNIVERSE_VERSION, FinancialMarket, generate_stock_universe, normalize_universe, run_cli
+
+
+class UniverseTest(unittest.TestCase):
+    def setUp(self):
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.TemporaryDirectory()
+        os.chdir(self._tmp.name)
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        self._tmp.cleanup()
+
+    def cli(self, *argv):
+        with contextlib.redirect_stdout(io.StringIO()) as output:
+            code = run_cli(list(argv))
+        return code, json.loads(output.getvalue())
+
+    def test_base_prices_stay_above_floor(self):
+        prices = [s.base_price for s in generate_stock_universe(2000, 5)]
+        self.assertGreater(min(prices), 10000.0)
+        self.assertGreater(len(set(prices)), 1900)
+
+    def test_spec_records_version_and_checksum(self):
+        market = FinancialMarket(universe={"size": 50, "seed": 3})
+        self.assertEqual(market.universe["version"], UNIVERSE_VERSION)
+        self.assertEqual(FinancialMarket(universe=market.universe).universe, market.universe)
+        with self.assertRaises(ValueError):
+            normalize_universe(dict(market.universe, version=UNIVERSE_VERSION + 1))
+        with self.assertRaises(ValueError):
+            FinancialMarket(universe=dict(market.universe, checksum=market.universe["checksum"] ^ 1))
+
+    def test_changed_generator_refuses_save(self):
+        """重新生成的股票池与存档记录的校验值不一致时拒绝读档，也不改写存档"""
+        code, result = self.cli("--save", "u", "--universe", "50", "--universe-seed", "3", "advance", "2")
+        self.assertEqual(code, 0)
+        path = os.path.join("saves", "u.json")
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        self.assertEqual(data["universe"]["checksum"], FinancialMarket(universe={"size": 50, "seed": 3}).universe["checksum"])
+        self.assertEqual(self.cli("--save", "u", "portfolio")[1]["day"], 2)
+
+        data["universe"]["checksum"] ^= 1
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(data, f)
+        with open(path, "rb") as f:
+            tampered = f.read()
+        code, result = self.cli("--save", "u", "advance", "1")
+        self.assertEqual(code, 1)
+        self.assertIn("股票池", result["error"])
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), tampered)
+
+
+if __name__ == "__main__":
+    unittest.main()